@@ -1,7 +1,14 @@
 from django.contrib import admin
-from .models import Prompt, Assessment, ConversationThread, Message
+from .models import (
+    Prompt, Assessment, ConversationThread, Message, GenerationJob, GenerationBatch, Question,
+    BankedQuestion
+)
 
 admin.site.register(Prompt)
 admin.site.register(Assessment)
+admin.site.register(Question)
+admin.site.register(BankedQuestion)
 admin.site.register(ConversationThread)
 admin.site.register(Message)
+admin.site.register(GenerationJob)
+admin.site.register(GenerationBatch)
@@ -1,24 +1,158 @@
+import asyncio
 import os
+import random
+import threading
+import time
+import weakref
+import httpx
 import requests
 import json
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, AsyncIterator, Iterator, Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from .cache import cache_key, response_cache
+from .cassette import AsyncCassetteTransport, Cassette, CassetteAdapter
+from .context import estimate_tokens
+from .metrics import CallTimer
+from .ratelimit import RateLimitExceeded, RateLimiter, request_cost
+from .structured import ASSESSMENT_TOOL, TOOL_CHOICE
+
+# Static instructions sent as a cached system block; everything that varies per
+# request (role, parameters, skills) goes in the user message
+ASSESSMENT_SYSTEM_PROMPT = """You are an expert job assessment designer with years of experience creating effective hiring assessments for top companies.
+
+You will be given a role and a set of ASSESSMENT PARAMETERS. Create a comprehensive assessment that:
+1. Is appropriate for the specified time limit
+2. Balances performance, behavioral, and cultural fit according to the weights
+3. Tests the specific skills requested
+4. Incorporates the company context naturally
+5. Matches the requested difficulty level
+
+Format questions according to the question types requested:
+- Multiple-choice questions: include 4-5 options each and clearly mark the correct answer for the hiring manager.
+- Situational judgment tests: include realistic workplace scenarios with multiple possible responses, ranking from most to least effective.
+- Open-ended questions: include thought-provoking open-ended questions with sample strong answers and evaluation criteria.
+- Coding challenges: include practical coding challenges with clear requirements, sample solutions, and evaluation rubrics.
+
+Record a new assessment with the record_assessment tool; its fields correspond to these sections:
+
+ASSESSMENT OVERVIEW:
+[Brief summary of the assessment, appropriate skills tested, and how it relates to the role]
+
+ASSESSMENT QUESTIONS:
+[Numbered questions with clear instructions]
+
+EVALUATION GUIDELINES:
+[Detailed criteria for hiring managers to evaluate responses, including what constitutes poor, acceptable, and excellent answers]
+
+TIME ALLOCATION:
+[Suggested breakdown of how candidates should use their time]
+
+Each question should clearly indicate whether it's primarily assessing performance, behavioral attributes, or cultural fit."""
+
+# Conversation turns revise an existing assessment in plain text; they have no
+# tools, so they get their own instructions rather than the generation prompt
+CONVERSATION_SYSTEM_PROMPT = """You are an expert job assessment designer helping a hiring manager refine an assessment you created for them. The conversation holds the assessment and their feedback so far; a summary of earlier turns may follow these instructions.
+
+When the hiring manager asks for changes, reply with the complete revised assessment as plain text in these sections:
+
+ASSESSMENT OVERVIEW:
+ASSESSMENT QUESTIONS:
+EVALUATION GUIDELINES:
+TIME ALLOCATION:
+
+Keep everything they did not ask to change, number the questions, and state whether each question primarily assesses performance, behavioral attributes, or cultural fit. When they ask about the assessment rather than for changes, answer briefly without rewriting it."""
+
+QUESTION_SYSTEM_PROMPT = """You are an expert job assessment designer. You will be given a role, an ASSESSMENT AREA and question PARAMETERS; create one professional assessment question for it.
+
+FORMAT YOUR RESPONSE WITH:
+
+QUESTION TITLE: [Brief descriptive title]
+
+SCENARIO: [Any relevant context or situation]
+
+MAIN QUESTION: [Clear, concise question]
+
+INSTRUCTIONS: [How the candidate should approach the answer]
+
+EVALUATION CRITERIA: [Hidden from candidate - specific points the hiring manager should look for]
+
+Make the question challenging but fair, relevant to the role, and designed to reveal meaningful insights about the candidate's abilities."""
+
+# Anthropic only caches a prompt prefix (tools, then system, then messages) of at
+# least this many tokens (2048 on Haiku models); a shorter prefix marked with
+# cache_control is simply not cached, so it is not marked
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+
+def cache_marker(*prefix: Any) -> Dict[str, Any]:
+    """
+    {"cache_control": ...} for the last block of a prompt prefix made of the
+    given parts (strings, or blocks such as tool definitions), or {} when the
+    prefix is estimated to be too short to be cached
+    """
+    text = ''.join(part if isinstance(part, str) else json.dumps(part) for part in prefix)
+    if estimate_tokens(text) < PROMPT_CACHE_MIN_TOKENS:
+        return {}
+    return {"cache_control": {"type": "ephemeral"}}
+
+
+# Status codes worth retrying: rate limited, overloaded (529) and transient server errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504, 529}
+
 
 class AnthropicClient:
-    def __init__(self):
-        self.api_key = os.environ.get('ANTHROPIC_API_KEY')
+    def __init__(self,
+                 api_key: Optional[str] = None,
+                 api_base: Optional[str] = None,
+                 connect_timeout: Optional[float] = None,
+                 read_timeout: Optional[float] = None,
+                 max_retries: Optional[int] = None,
+                 pool_maxsize: Optional[int] = None,
+                 cassette: Optional[Cassette] = None):
+        # recorded exchanges to replay, or to record to (see cassette.py)
+        self.cassette = cassette or Cassette.from_settings()
+        self.api_key = api_key or os.environ.get('ANTHROPIC_API_KEY')
+        if not self.api_key and self.cassette is not None and self.cassette.replaying:
+            self.api_key = 'replay'  # replayed calls never reach the API
         if not self.api_key:
             raise ValueError("ANTHROPIC_API_KEY environment variable is not set")
-        
-        self.base_url = "https://api.anthropic.com/v1/messages"
+
+        self.api_base = (api_base or settings.ANTHROPIC_API_BASE).rstrip('/')
+        self.base_url = f"{self.api_base}/v1/messages"
         self.headers = {
             "x-api-key": self.api_key,
             "anthropic-version": "2023-06-01",
             "content-type": "application/json"
         }
 
+        # (connect, read) tuple understood by requests
+        self.timeout = (
+            connect_timeout if connect_timeout is not None else settings.ANTHROPIC_CONNECT_TIMEOUT,
+            read_timeout if read_timeout is not None else settings.ANTHROPIC_READ_TIMEOUT,
+        )
+        self.max_retries = max_retries if max_retries is not None else settings.ANTHROPIC_MAX_RETRIES
+        self.backoff_base = settings.ANTHROPIC_RETRY_BACKOFF
+        self.backoff_max = settings.ANTHROPIC_RETRY_MAX_BACKOFF
+
+        # one pooled keep-alive session per client; retries are handled in _send
+        pool_maxsize = pool_maxsize or settings.ANTHROPIC_POOL_MAXSIZE
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=0)
+        if self.cassette is not None:
+            adapter = CassetteAdapter(self.cassette, adapter)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update(self.headers)
+
+        # node-wide request/token budget shared with the other processes
+        self.rate_limiter = RateLimiter.from_settings(self.api_key)
+
     def generate_assessment(self, 
                            role: str, 
-                           assessment_params: Dict[str, Any]) -> Dict[str, Any]:
+                           assessment_params: Dict[str, Any],
+                           use_cache: bool = True) -> Dict[str, Any]:
         """
         Generate an assessment for a job role based on specified parameters
         
@@ -31,34 +165,64 @@ class AnthropicClient:
                 - skills (list): Skills to assess
                 - company_context (str): Company information for contextualization
                 - weights (dict): Performance, behavioral, cultural_fit weights
+            use_cache (bool): Serve an identical earlier generation if cached;
+                pass False to regenerate (the fresh result replaces the cached one)
                 
         Returns:
             dict: The API response with assessment content
         """
+        return self._cached_post(self.assessment_payload(role, assessment_params), 'assessment', use_cache)
+
+    def stream_assessment(self,
+                          role: str,
+                          assessment_params: Dict[str, Any],
+                          use_cache: bool = True) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant of generate_assessment. A cache hit is replayed as
+        one complete stream.
+
+        Yields:
+            dict: Parsed server-sent events from the Messages API
+        """
+        return self._cached_stream(self.assessment_payload(role, assessment_params), 'assessment', use_cache)
+
+    def assessment_payload(self, role: str, assessment_params: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the Messages API payload for a full assessment"""
         prompt = self._create_detailed_prompt(role, assessment_params)
 
-        payload = {
+        return {
             "model": "claude-3-opus-20240229",
             "max_tokens": 4000,
             "temperature": 0.7,  # Add some creativity but not too random
+            "system": self.assessment_system(),
+            # structured output: questions are stored as rows, see structured.py
+            "tools": [ASSESSMENT_TOOL],
+            "tool_choice": TOOL_CHOICE,
             "messages": [{"role": "user", "content": prompt}]
-        } 
+        }
 
-        try:
-            response = requests.post(self.base_url, headers=self.headers, json=payload)
-            response.raise_for_status()  # Raise exception for HTTP errors
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            # Handle API errors gracefully
-            return {
-                "error": True,
-                "message": str(e),
-                "status_code": getattr(e.response, 'status_code', None) if hasattr(e, 'response') else None
-            }
+    @staticmethod
+    def assessment_system() -> List[Dict[str, Any]]:
+        """
+        The static assessment-designer instructions as a system block, marked
+        for prompt caching together with the tool definition once they are
+        long enough to be cached
+        """
+        return [{"type": "text", "text": ASSESSMENT_SYSTEM_PROMPT,
+                 **cache_marker(ASSESSMENT_TOOL, ASSESSMENT_SYSTEM_PROMPT)}]
+
+    @staticmethod
+    def conversation_system() -> List[Dict[str, Any]]:
+        """
+        The instructions for conversation turns; the turns themselves carry the
+        cache breakpoint, see AssessmentService._conversation_request
+        """
+        return [{"type": "text", "text": CONVERSATION_SYSTEM_PROMPT}]
     
     def _create_detailed_prompt(self, role: str, params: Dict[str, Any]) -> str:
         """
-        Create a detailed prompt for Claude based on assessment parameters
+        Create the variable part of the assessment prompt; the instructions and
+        response format live in ASSESSMENT_SYSTEM_PROMPT
         
         Args:
             role (str): The job role
@@ -69,27 +233,21 @@ class AnthropicClient:
         """
         # Extract parameters with defaults
         time_limit = params.get('time_limit', 30)
-        difficulty = params.get('difficulty', ['Medium'])[0] if isinstance(params.get('difficulty', []), list) else params.get('difficulty', 'Medium')
-        question_types = params.get('question_types', [])
-        skills = params.get('skills', [])
-        company_context = params.get('company_context', [])
-        weights = params.get('weights', {
-            'performance': 33,
-            'behavioral': 33,
-            'cultural_fit': 34
-        })
+        difficulty = self._difficulty(params)
+        question_types = _as_list(params.get('question_types'))
+        skills = _as_list(params.get('skills'))
+        company_context = _as_list(params.get('company_context'))
+        weights = params.get('weights') or {}
         
         # Create detailed prompt with clear structure
-        prompt = f"""You are an expert job assessment designer with years of experience creating effective hiring assessments for top companies.
-
-Your task is to create a professional job assessment for the role of "{role}" based on the following parameters:
+        prompt = f"""Create a professional job assessment for the role of "{role}" based on the following parameters:
 
 ASSESSMENT PARAMETERS:
 - Time limit: {time_limit} minutes
 - Difficulty level: {difficulty}
-- Performance weight: {weights.get('performance', 33)}%
-- Behavioral weight: {weights.get('behavioral', 33)}%
-- Cultural fit weight: {weights.get('cultural_fit', 34)}%
+- Performance weight: {_weight(weights, 'performance', 33)}%
+- Behavioral weight: {_weight(weights, 'behavioral', 33)}%
+- Cultural fit weight: {_weight(weights, 'cultural_fit', 34)}%
 """
 
         # Add question types if provided
@@ -107,54 +265,13 @@ ASSESSMENT PARAMETERS:
             company_context_str = ", ".join(company_context)
             prompt += f"- Company context: {company_context_str}\n"
         
-        # Add detailed instructions
-        prompt += f"""
-Please create a comprehensive assessment that:
-1. Is appropriate for the specified time limit of {time_limit} minutes
-2. Balances performance, behavioral, and cultural fit according to the weights
-3. Tests the specific skills requested
-4. Incorporates the company context naturally
-5. Matches the {difficulty} difficulty level
-"""
-
-        # Format based on question types
-        if "Multiple-choice questions" in question_types:
-            prompt += "\nInclude multiple-choice questions with 4-5 options each and clearly mark the correct answer for the hiring manager.\n"
-        
-        if "Situational judgment tests" in question_types:
-            prompt += "\nInclude realistic workplace scenarios with multiple possible responses, ranking from most to least effective.\n"
-        
-        if "Open-ended questions" in question_types:
-            prompt += "\nInclude thought-provoking open-ended questions with sample strong answers and evaluation criteria.\n"
-        
-        if "Coding challenges" in question_types:
-            prompt += "\nInclude practical coding challenges with clear requirements, sample solutions, and evaluation rubrics.\n"
-        
-        # Add structure for the response
-        prompt += """
-FORMAT YOUR RESPONSE WITH THE FOLLOWING SECTIONS:
-
-ASSESSMENT OVERVIEW:
-[Brief summary of the assessment, appropriate skills tested, and how it relates to the role]
-
-ASSESSMENT QUESTIONS:
-[Numbered questions with clear instructions]
-
-EVALUATION GUIDELINES:
-[Detailed criteria for hiring managers to evaluate responses, including what constitutes poor, acceptable, and excellent answers]
-
-TIME ALLOCATION:
-[Suggested breakdown of how candidates should use their time]
-
-Each question should clearly indicate whether it's primarily assessing performance, behavioral attributes, or cultural fit.
-"""
-        
         return prompt
 
     def generate_single_question(self, 
                                 role: str, 
                                 question_prompt: str,
-                                params: Dict[str, Any]) -> Dict[str, Any]:
+                                params: Dict[str, Any],
+                                use_cache: bool = True) -> Dict[str, Any]:
         """
         Generate a single assessment question based on a specific prompt
         
@@ -162,41 +279,40 @@ Each question should clearly indicate whether it's primarily assessing performan
             role (str): The job role
             question_prompt (str): Specific area or prompt for the question
             params (dict): Question parameters
+            use_cache (bool): Serve an identical earlier generation if cached
             
         Returns:
             dict: The API response with the generated question
         """
+        return self._cached_post(self.question_payload(role, question_prompt, params), 'question', use_cache)
+
+    def question_payload(self, role: str, question_prompt: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the Messages API payload for a single question"""
         prompt = self._create_single_question_prompt(role, question_prompt, params)
-        
-        payload = {
+
+        return {
             "model": "claude-3-opus-20240229",
             "max_tokens": 2000,
             "temperature": 0.6,
+            # Not prompt-cached: the only stable prefix is this short system
+            # prompt, well under PROMPT_CACHE_MIN_TOKENS, and everything after
+            # it varies per question.
+            "system": [{"type": "text", "text": QUESTION_SYSTEM_PROMPT}],
             "messages": [{"role": "user", "content": prompt}]
         }
-        
-        try:
-            response = requests.post(self.base_url, headers=self.headers, json=payload)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return {
-                "error": True,
-                "message": str(e),
-                "status_code": getattr(e.response, 'status_code', None) if hasattr(e, 'response') else None
-            }
     
     def _create_single_question_prompt(self, role: str, question_prompt: str, params: Dict[str, Any]) -> str:
-        """Create a prompt for generating a single assessment question"""
+        """Create the variable part of a single-question prompt"""
         
         # Extract parameters
-        difficulty = params.get('difficulty', ['Medium'])[0] if isinstance(params.get('difficulty', []), list) else params.get('difficulty', 'Medium')
-        question_type = params.get('question_types', ['Open-ended questions'])[0] if params.get('question_types') else 'Open-ended questions'
-        skills = params.get('skills', [])
-        company_context = params.get('company_context', [])
+        difficulty = self._difficulty(params)
+        question_types = _as_list(params.get('question_types'))
+        question_type = question_types[0] if question_types else 'Open-ended questions'
+        skills = _as_list(params.get('skills'))
+        company_context = _as_list(params.get('company_context'))
         time_limit = params.get('time_limit', 15)
         
-        prompt = f"""You are an expert job assessment designer. Create a professional {difficulty}-level {question_type} for a {role} position based on this specific area:
+        prompt = f"""Create a professional {difficulty}-level {question_type} for a {role} position based on this specific area:
 
 ASSESSMENT AREA: {question_prompt}
 
@@ -212,42 +328,546 @@ PARAMETERS:
         if company_context:
             prompt += f"- Company context: {', '.join(company_context)}\n"
         
-        prompt += """
-FORMAT YOUR RESPONSE WITH:
-
-QUESTION TITLE: [Brief descriptive title]
-
-SCENARIO: [Any relevant context or situation]
-
-MAIN QUESTION: [Clear, concise question]
-
-INSTRUCTIONS: [How the candidate should approach the answer]
-
-EVALUATION CRITERIA: [Hidden from candidate - specific points the hiring manager should look for]
-
-Make the question challenging but fair, relevant to the role, and designed to reveal meaningful insights about the candidate's abilities.
-"""
-        
         return prompt
+
+    @staticmethod
+    def _difficulty(params: Dict[str, Any]) -> str:
+        difficulty = params.get('difficulty') or 'Medium'
+        if isinstance(difficulty, list):
+            difficulty = difficulty[0] if difficulty else 'Medium'
+        return str(difficulty).capitalize()
     
-    def _make_api_call(self, payload):
+    def _make_api_call(self, payload, kind='conversation'):
         """
         Make a direct API call with the given payload
         
         Args:
             payload (dict): The full payload for the API request
+            kind (str): What the call is for, as recorded in the call metrics
             
         Returns:
             dict: The API response
         """
+        return self._post(payload, kind)
+
+    def _post(self, payload: Dict[str, Any], kind: str) -> Dict[str, Any]:
+        """
+        POST a payload to the Messages API over the pooled session and record
+        the call's latency and usage
+
+        Args:
+            payload (dict): The full payload for the API request
+            kind (str): What the call is for (assessment, question, conversation, summary)
+
+        Returns:
+            dict: The API response, or an error dict when all attempts fail
+        """
+        timer = CallTimer(payload, kind)
         try:
-            response = requests.post(self.base_url, headers=self.headers, json=payload)
-            response.raise_for_status()  # Raise exception for HTTP errors
-            return response.json()
-        except requests.exceptions.RequestException as e:
+            response = self._send(payload)
+            timer.first_byte(response.elapsed.total_seconds())
+            result = response.json()
+        except (requests.exceptions.RequestException, RateLimitExceeded) as e:
             # Handle API errors gracefully
-            return {
-                "error": True,
-                "message": str(e),
-                "status_code": getattr(e.response, 'status_code', None) if hasattr(e, 'response') else None
-            }
\ No newline at end of file
+            error = self._error_response(e)
+            timer.finish(error['status_code'])
+            return error
+        timer.finish(response.status_code, result)
+        return result
+
+    def _cached_post(self, payload: Dict[str, Any], kind: str, use_cache: bool) -> Dict[str, Any]:
+        """
+        _post behind the content-addressed response cache. Only complete,
+        successful responses are stored.
+        """
+        key = cache_key(payload)
+        if use_cache:
+            cached = response_cache.get(key)
+            if cached is not None:
+                return cached
+
+        response = self._post(payload, kind)
+        if not response.get('error') and response.get('stop_reason'):
+            response_cache.set(key, kind, payload['model'], response)
+        return response
+
+    def _cached_stream(self, payload: Dict[str, Any], kind: str, use_cache: bool) -> Iterator[Dict[str, Any]]:
+        """Streaming counterpart of _cached_post"""
+        key = cache_key(payload)
+        if use_cache:
+            cached = response_cache.get(key)
+            if cached is not None:
+                yield from response_events(cached)
+                return
+
+        streamed = StreamedMessage()
+        for event in self.stream(payload, kind):
+            streamed.feed(event)
+            yield event
+        if streamed.error is None and streamed.response.get('stop_reason'):
+            response_cache.set(key, kind, payload['model'], streamed.response)
+
+    def stream(self, payload: Dict[str, Any], kind: str = 'conversation') -> Iterator[Dict[str, Any]]:
+        """
+        Make a streaming API call and yield its server-sent events as they arrive
+
+        Args:
+            payload (dict): The full payload for the API request; stream is forced on
+            kind (str): What the call is for, as recorded in the call metrics
+
+        Yields:
+            dict: Parsed events (message_start, content_block_delta, ...). A failed
+            request yields a single event of type "error".
+        """
+        timer = CallTimer(payload, kind, streamed=True)
+        try:
+            response = self._send(dict(payload, stream=True), stream=True)
+        except (requests.exceptions.RequestException, RateLimitExceeded) as e:
+            error = self._error_response(e)
+            timer.finish(error['status_code'])
+            yield _error_event(error)
+            return
+
+        streamed = StreamedMessage()
+        def observe(event):
+            timer.first_byte()
+            streamed.feed(event)
+            return event
+
+        try:
+            with response:
+                response.encoding = 'utf-8'
+                data_lines = []
+                for line in response.iter_lines(decode_unicode=True):
+                    if line:
+                        if line.startswith('data:'):
+                            data_lines.append(line[5:].strip())
+                        continue
+                    # a blank line terminates the event
+                    if data_lines:
+                        yield observe(json.loads("\n".join(data_lines)))
+                        data_lines = []
+                if data_lines:
+                    yield observe(json.loads("\n".join(data_lines)))
+        finally:
+            timer.finish(response.status_code, streamed.response)
+
+    def create_message_batch(self, requests_: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Submit payloads through the Message Batches API
+
+        Args:
+            requests_ (list): {"custom_id": str, "params": payload} items
+
+        Returns:
+            dict: The created batch, or an error dict
+        """
+        try:
+            return self._send({"requests": requests_}, url=f"{self.base_url}/batches").json()
+        except requests.exceptions.RequestException as e:
+            return self._error_response(e)
+
+    def retrieve_message_batch(self, batch_id: str) -> Dict[str, Any]:
+        """Fetch a message batch; results_url is set once processing_status is "ended" """
+        try:
+            return self._send(method='GET', url=f"{self.base_url}/batches/{batch_id}").json()
+        except requests.exceptions.RequestException as e:
+            return self._error_response(e)
+
+    def message_batch_results(self, results_url: str) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the per-request results of an ended batch. Raises requests
+        exceptions if the results cannot be downloaded.
+        """
+        with self._send(method='GET', url=results_url, stream=True) as response:
+            response.encoding = 'utf-8'
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    yield json.loads(line)
+
+    def _send(self,
+              payload: Optional[Dict[str, Any]] = None,
+              stream: bool = False,
+              method: str = 'POST',
+              url: Optional[str] = None) -> requests.Response:
+        """
+        Send a request, retrying rate-limited, overloaded and transient failures
+        with jittered backoff. Raises requests exceptions once retries run out,
+        or RateLimitExceeded if the rate limiter has no capacity in time.
+        """
+        # only Messages API calls draw from the rate limit budget
+        limiter = self.rate_limiter if url is None else None
+        attempt = 0
+        while True:
+            try:
+                if limiter is not None:
+                    limiter.acquire(request_cost(payload))
+                response = self.session.request(
+                    method, url or self.base_url, json=payload, timeout=self.timeout, stream=stream
+                )
+                if limiter is not None:
+                    limiter.update(response.headers, response.status_code)
+                if response.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                    response.close()
+                    # after a 429 the limiter already holds every caller until retry-after
+                    if limiter is None or response.status_code != 429:
+                        time.sleep(self._retry_delay(attempt, response))
+                    attempt += 1
+                    continue
+                response.raise_for_status()  # Raise exception for HTTP errors
+                return response
+            except requests.exceptions.ConnectionError:
+                # connection-level failure (includes connect timeouts); read timeouts are not
+                # retried so a slow generation is never paid for twice
+                if attempt < self.max_retries:
+                    time.sleep(self._retry_delay(attempt))
+                    attempt += 1
+                    continue
+                raise
+
+    def _retry_delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """
+        Seconds to wait before the next attempt: the server's retry-after when
+        given, otherwise full-jitter exponential backoff
+        """
+        if response is not None:
+            retry_after = response.headers.get('retry-after')
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.backoff_max) + random.uniform(0, self.backoff_base)
+                except ValueError:
+                    pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    @staticmethod
+    def _error_response(e: Exception) -> Dict[str, Any]:
+        return _error_dict(e, getattr(e, 'response', None))
+
+
+def _error_dict(e: Exception, response) -> Dict[str, Any]:
+    """
+    The error dict returned in place of a response. Rate limiting keeps
+    status_code 429 and says when to retry, so callers can tell it apart.
+    """
+    if isinstance(e, RateLimitExceeded):
+        return {"error": True, "message": str(e), "status_code": 429, "retry_after": e.retry_after}
+    error = {
+        "error": True,
+        "message": str(e),
+        "status_code": response.status_code if response is not None else None
+    }
+    if error["status_code"] == 429:
+        try:
+            error["retry_after"] = float(response.headers.get('retry-after'))
+        except (TypeError, ValueError):
+            pass
+    return error
+
+
+def _error_event(error: Dict[str, Any]) -> Dict[str, Any]:
+    """The stream event standing in for a failed streaming request"""
+    return {"type": "error", "error": {key: value for key, value in error.items() if key != 'error'}}
+
+
+def _as_list(value) -> List[str]:
+    """Prompt fields arrive as lists, comma-separated strings or a single name"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(',') if item.strip()]
+    return [str(item) for item in value]
+
+
+def _weight(weights: Dict[str, Any], name: str, default: int) -> int:
+    # accept both 'performance' and the model's 'performance_weight' spelling
+    return weights.get(name, weights.get(f'{name}_weight', default))
+
+
+def usage_summary(response: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Token counts from a response's usage block, including prompt-cache
+    writes and reads
+    """
+    usage = response.get('usage') or {}
+    return {
+        field: usage.get(field) or 0
+        for field in ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens')
+    }
+
+
+class StreamedMessage:
+    """
+    Rebuilds the non-streaming Messages API response from stream events so
+    streamed generations are stored exactly like regular ones
+    """
+
+    def __init__(self):
+        self.message: Dict[str, Any] = {}
+        self.error: Optional[Dict[str, Any]] = None
+        self._partial_json: Dict[int, str] = {}
+
+    def feed(self, event: Dict[str, Any]) -> str:
+        """
+        Apply one stream event
+
+        Returns:
+            str: Any text produced by this event ('' if none)
+        """
+        event_type = event.get('type')
+        if event_type == 'message_start':
+            self.message = dict(event.get('message', {}))
+            self.message['content'] = []
+        elif event_type == 'content_block_start':
+            self.message.setdefault('content', []).append(dict(event.get('content_block', {})))
+        elif event_type == 'content_block_delta':
+            index = event.get('index', 0)
+            delta = event.get('delta', {})
+            block = self.message['content'][index]
+            if delta.get('type') == 'text_delta':
+                block['text'] = block.get('text', '') + delta.get('text', '')
+                return delta.get('text', '')
+            if delta.get('type') == 'input_json_delta':
+                self._partial_json[index] = self._partial_json.get(index, '') + delta.get('partial_json', '')
+        elif event_type == 'content_block_stop':
+            index = event.get('index', 0)
+            if index in self._partial_json:
+                raw = self._partial_json.pop(index)
+                self.message['content'][index]['input'] = json.loads(raw) if raw else {}
+        elif event_type == 'message_delta':
+            self.message.update(event.get('delta', {}))
+            usage = dict(self.message.get('usage', {}))
+            usage.update(event.get('usage', {}))
+            self.message['usage'] = usage
+        elif event_type == 'error':
+            self.error = event.get('error', {})
+        return ''
+
+    @property
+    def response(self) -> Dict[str, Any]:
+        return self.message
+
+
+def response_events(response: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Replay a complete Messages API response as the stream events that would
+    have produced it, one delta per content block
+    """
+    message = dict(response, content=[])
+    usage = message.get('usage', {})
+    yield {"type": "message_start", "message": dict(message, stop_reason=None)}
+    for index, block in enumerate(response.get('content', [])):
+        if block.get('type') == 'text':
+            yield {"type": "content_block_start", "index": index, "content_block": {"type": "text", "text": ""}}
+            yield {"type": "content_block_delta", "index": index, "delta": {"type": "text_delta", "text": block.get('text', '')}}
+        elif block.get('type') == 'tool_use':
+            yield {"type": "content_block_start", "index": index, "content_block": dict(block, input={})}
+            yield {"type": "content_block_delta", "index": index,
+                   "delta": {"type": "input_json_delta", "partial_json": json.dumps(block.get('input', {}))}}
+        else:
+            yield {"type": "content_block_start", "index": index, "content_block": block}
+        yield {"type": "content_block_stop", "index": index}
+    yield {"type": "message_delta",
+           "delta": {"stop_reason": response.get('stop_reason'), "stop_sequence": response.get('stop_sequence')},
+           "usage": {"output_tokens": usage.get('output_tokens', 0)}}
+    yield {"type": "message_stop"}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> AnthropicClient:
+    """
+    Return the process-wide AnthropicClient so every caller shares one
+    pooled set of keep-alive connections
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = AnthropicClient()
+    return _client
+
+
+class AsyncAnthropicClient:
+    """
+    asyncio counterpart of AnthropicClient for async views: the same
+    payloads, response cache and retry policy over a pooled httpx.AsyncClient,
+    so a request waiting on a generation holds no worker thread. Settings and
+    payload building come from the wrapped AnthropicClient.
+    """
+
+    def __init__(self, client: AnthropicClient, max_connections: Optional[int] = None):
+        self.sync_client = client
+        self.base_url = client.base_url
+        connect_timeout, read_timeout = client.timeout
+        transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(
+            max_connections=max_connections or settings.ANTHROPIC_ASYNC_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.ANTHROPIC_POOL_MAXSIZE,
+        ))
+        if client.cassette is not None:
+            transport = AsyncCassetteTransport(client.cassette, transport)
+        self.http = httpx.AsyncClient(
+            headers=client.headers,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            transport=transport,
+        )
+
+    def assessment_payload(self, role: str, assessment_params: Dict[str, Any]) -> Dict[str, Any]:
+        return self.sync_client.assessment_payload(role, assessment_params)
+
+    def question_payload(self, role: str, question_prompt: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self.sync_client.question_payload(role, question_prompt, params)
+
+    @staticmethod
+    def assessment_system() -> List[Dict[str, Any]]:
+        return AnthropicClient.assessment_system()
+
+    @staticmethod
+    def conversation_system() -> List[Dict[str, Any]]:
+        return AnthropicClient.conversation_system()
+
+    async def _make_api_call(self, payload: Dict[str, Any], kind: str = 'conversation') -> Dict[str, Any]:
+        """Async counterpart of AnthropicClient._make_api_call"""
+        return await self._post(payload, kind)
+
+    async def _post(self, payload: Dict[str, Any], kind: str) -> Dict[str, Any]:
+        timer = CallTimer(payload, kind)
+        try:
+            # sent streamed, so the first byte is stamped when the headers arrive;
+            # httpx sets response.elapsed only once the body has been read
+            response = await self._send(payload, stream=True)
+        except (httpx.HTTPError, RateLimitExceeded) as e:
+            error = self._error_response(e)
+            timer.finish(error['status_code'])
+            return error
+        timer.first_byte()
+        try:
+            result = json.loads(await response.aread())
+        except (httpx.HTTPError, ValueError) as e:
+            # a body cut off or not JSON (a proxy's error page): the error dict
+            # the sync client returns when requests fails to read or decode it
+            error = _error_dict(e, None)
+            timer.finish(error['status_code'])
+            return error
+        finally:
+            await response.aclose()
+        timer.finish(response.status_code, result)
+        return result
+
+    async def _cached_post(self, payload: Dict[str, Any], kind: str, use_cache: bool) -> Dict[str, Any]:
+        """Async counterpart of AnthropicClient._cached_post"""
+        key = cache_key(payload)
+        if use_cache:
+            cached = await sync_to_async(response_cache.get)(key)
+            if cached is not None:
+                return cached
+
+        response = await self._post(payload, kind)
+        if not response.get('error') and response.get('stop_reason'):
+            await sync_to_async(response_cache.set)(key, kind, payload['model'], response)
+        return response
+
+    async def _cached_stream(self, payload: Dict[str, Any], kind: str, use_cache: bool) -> AsyncIterator[Dict[str, Any]]:
+        """Async counterpart of AnthropicClient._cached_stream"""
+        key = cache_key(payload)
+        if use_cache:
+            cached = await sync_to_async(response_cache.get)(key)
+            if cached is not None:
+                for event in response_events(cached):
+                    yield event
+                return
+
+        streamed = StreamedMessage()
+        async for event in self.stream(payload, kind):
+            streamed.feed(event)
+            yield event
+        if streamed.error is None and streamed.response.get('stop_reason'):
+            await sync_to_async(response_cache.set)(key, kind, payload['model'], streamed.response)
+
+    async def stream(self, payload: Dict[str, Any], kind: str = 'conversation') -> AsyncIterator[Dict[str, Any]]:
+        """Async counterpart of AnthropicClient.stream"""
+        timer = CallTimer(payload, kind, streamed=True)
+        try:
+            response = await self._send(dict(payload, stream=True), stream=True)
+        except (httpx.HTTPError, RateLimitExceeded) as e:
+            error = self._error_response(e)
+            timer.finish(error['status_code'])
+            yield _error_event(error)
+            return
+
+        streamed = StreamedMessage()
+        def observe(event):
+            timer.first_byte()
+            streamed.feed(event)
+            return event
+
+        try:
+            data_lines = []
+            async for line in response.aiter_lines():
+                if line:
+                    if line.startswith('data:'):
+                        data_lines.append(line[5:].strip())
+                    continue
+                # a blank line terminates the event
+                if data_lines:
+                    yield observe(json.loads("\n".join(data_lines)))
+                    data_lines = []
+            if data_lines:
+                yield observe(json.loads("\n".join(data_lines)))
+        finally:
+            timer.finish(response.status_code, streamed.response)
+            await response.aclose()
+
+    async def _send(self, payload: Dict[str, Any], stream: bool = False) -> httpx.Response:
+        """
+        Same retry policy and rate limiting as AnthropicClient._send; a
+        streamed response must be closed by the caller
+        """
+        limiter = self.sync_client.rate_limiter
+        attempt = 0
+        while True:
+            try:
+                if limiter is not None:
+                    await limiter.aacquire(request_cost(payload))
+                request = self.http.build_request('POST', self.base_url, json=payload)
+                response = await self.http.send(request, stream=stream)
+                if limiter is not None:
+                    await limiter.aupdate(response.headers, response.status_code)
+                if response.status_code in RETRYABLE_STATUS_CODES and attempt < self.sync_client.max_retries:
+                    await response.aclose()
+                    if limiter is None or response.status_code != 429:
+                        await asyncio.sleep(self.sync_client._retry_delay(attempt, response))
+                    attempt += 1
+                    continue
+                if response.is_error:
+                    await response.aclose()
+                response.raise_for_status()
+                return response
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                # as in the sync client, read timeouts are not retried
+                if attempt < self.sync_client.max_retries:
+                    await asyncio.sleep(self.sync_client._retry_delay(attempt))
+                    attempt += 1
+                    continue
+                raise
+
+    @staticmethod
+    def _error_response(e: Exception) -> Dict[str, Any]:
+        return _error_dict(e, e.response if isinstance(e, httpx.HTTPStatusError) else None)
+
+
+# httpx pools are bound to the event loop they were created on
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client() -> AsyncAnthropicClient:
+    """
+    Return the AsyncAnthropicClient for the running event loop; under ASGI
+    that is one pooled client per process
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.sync_client is not get_client():
+        client = _async_clients[loop] = AsyncAnthropicClient(get_client())
+    return client
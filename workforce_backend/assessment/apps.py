@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class AssessmentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'assessment'
+
+    def ready(self):
+        from .search import repair_search_index
+        # SQLite drops the search triggers whenever a migration rebuilds a table
+        post_migrate.connect(repair_search_index, sender=self, dispatch_uid='assessment_search_index')
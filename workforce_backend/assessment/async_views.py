@@ -0,0 +1,148 @@
+"""
+Async views for the endpoints that wait on the Anthropic API. Under ASGI a
+request awaiting a 30-60 second generation holds no worker thread, so one
+process serves hundreds of them. DRF views are synchronous, so these are
+plain Django views; async_api_view runs DRF's own request checks for them.
+
+Under WSGI there is no event loop to hand the request to. The views then use
+the synchronous service methods, so streams are sent as they are produced
+rather than collected whole by Django before the first byte.
+"""
+import math
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .renderers import EventStreamRenderer
+from .services import AssessmentService
+from .views import event_stream_response
+
+STREAM_RENDERERS = [EventStreamRenderer, JSONRenderer]
+
+
+def async_api_view(renderer_classes=None):
+    """
+    Serve an async view like a POST-only DRF action: content negotiation,
+    authentication, permission and throttle checks and body parsing run
+    through APIView (off the event loop) with the DEFAULT_* classes, errors
+    are DRF's responses, and Response results are rendered as DRF would
+    """
+    options = {} if renderer_classes is None else {'renderer_classes': renderer_classes}
+
+    def decorator(view):
+        @csrf_exempt
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            api_view = APIView(**options)
+            request, error = await sync_to_async(_initial)(api_view, request, args, kwargs)
+            if error is not None:
+                return error
+            response = await view(request, *args, **kwargs)
+            if isinstance(response, Response):
+                response = api_view.finalize_response(request, response, *args, **kwargs).render()
+            return response
+        return wrapper
+    return decorator
+
+
+def _initial(api_view, request, args, kwargs):
+    # what APIView.dispatch does before calling a handler
+    api_view.args, api_view.kwargs = args, kwargs
+    request = api_view.initialize_request(request, *args, **kwargs)
+    api_view.request = request
+    api_view.headers = api_view.default_response_headers
+    try:
+        api_view.initial(request, *args, **kwargs)
+        if request.method != 'POST':
+            raise exceptions.MethodNotAllowed(request.method)
+        request.data  # parse here, where a ParseError can still become a 400
+    except Exception as exc:
+        response = api_view.finalize_response(request, api_view.handle_exception(exc), *args, **kwargs)
+        return request, response.render()
+    return request, None
+
+
+def _under_asgi(request):
+    return isinstance(request._request, ASGIRequest)
+
+
+async def _call(request, method, async_method, *args, **kwargs):
+    # the async service method under ASGI, the sync one in the WSGI request's thread
+    if _under_asgi(request):
+        return await async_method(*args, **kwargs)
+    return await sync_to_async(method)(*args, **kwargs)
+
+
+def _regenerate(request):
+    return str(request.data.get('regenerate', '')).lower() in ('1', 'true', 'yes')
+
+
+@async_api_view(renderer_classes=STREAM_RENDERERS)
+async def generate_stream(request, pk):
+    service = AssessmentService()
+    use_cache = not _regenerate(request)
+    if _under_asgi(request):
+        return event_stream_response(service.astream_assessment_from_prompt(pk, use_cache=use_cache))
+    return event_stream_response(service.stream_assessment_from_prompt(pk, use_cache=use_cache))
+
+
+@async_api_view()
+async def add_message(request, pk):
+    user_message = request.data.get('message')
+    if not user_message:
+        return Response({'error': 'Message content is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    service = AssessmentService()
+    return _result_response(await _call(
+        request, service.continue_conversation, service.acontinue_conversation, pk, user_message
+    ))
+
+
+def _result_response(result, success_status=status.HTTP_200_OK):
+    # a service result: rate limiting keeps its status, other errors are 400s
+    if result.get('status_code') == 429:
+        headers = {'Retry-After': str(math.ceil(result['retry_after']))} if result.get('retry_after') else None
+        return Response(result, status=status.HTTP_429_TOO_MANY_REQUESTS, headers=headers)
+    if result.get('error'):
+        return Response({'error': result['error']}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(result, status=success_status)
+
+
+@async_api_view()
+async def generate_question(request):
+    """
+    A single question for {role, area, skills, difficulty, question_types};
+    similar banked questions are returned instead of generating when there
+    are any, unless "regenerate" is set
+    """
+    role, area = request.data.get('role'), request.data.get('area')
+    if not role or not area:
+        return Response({'error': 'role and area are required'}, status=status.HTTP_400_BAD_REQUEST)
+    params = {field: request.data.get(field) for field in ('skills', 'difficulty', 'question_types', 'time_limit')}
+    if params['skills'] is not None and not isinstance(params['skills'], list):
+        return Response({'error': 'skills must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+    params = {field: value for field, value in params.items() if value is not None}
+
+    service = AssessmentService()
+    result = await _call(
+        request, service.generate_question, service.agenerate_question, role, area, params, reuse=not _regenerate(request)
+    )
+    created = result.get('source') == 'generated'
+    return _result_response(result, success_status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+@async_api_view(renderer_classes=STREAM_RENDERERS)
+async def add_message_stream(request, pk):
+    user_message = request.data.get('message')
+    if not user_message:
+        return Response({'error': 'Message content is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    service = AssessmentService()
+    if _under_asgi(request):
+        return event_stream_response(service.astream_conversation(pk, user_message))
+    return event_stream_response(service.stream_conversation(pk, user_message))
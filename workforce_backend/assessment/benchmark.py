@@ -0,0 +1,258 @@
+"""
+Offline REST API benchmark
+
+seed() fills the database with realistic volumes; run_endpoint() times one
+endpoint through the Django test client and counts its queries, which must
+stay within the endpoint's max_queries. The benchmark_api command runs every
+entry of ENDPOINTS against a stub Anthropic server and writes the results as
+JSON; the query budget tests run the same list on every test run.
+"""
+import json
+import math
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from users.models import Company, User
+from . import question_bank
+from .models import Assessment, ConversationThread, Message, Prompt, Question
+
+# rows created by seed(scale=1)
+SEED_VOLUMES = {
+    'prompts': 200,  # one assessment each
+    'questions_per_assessment': 8,
+    'conversations': 100,
+    'messages_per_conversation': 30,
+    'companies': 5,
+}
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+
+class Endpoint:
+    """
+    One request to benchmark
+
+    path is formatted with the ids returned by seed(); data is a request
+    body, or a function of the iteration number for bodies that must be
+    unique (registrations, company names). revalidate sends the ETag of an
+    untimed first response in If-None-Match, like a polling client.
+    """
+
+    def __init__(self, name: str, method: str, path: str, max_queries: int,
+                 data: Union[Dict[str, Any], Callable[[int], Dict[str, Any]], None] = None,
+                 status: int = 200, auth: bool = True, revalidate: bool = False):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.max_queries = max_queries
+        self.data = data
+        self.status = status
+        self.auth = auth
+        self.revalidate = revalidate
+
+    def body(self, iteration: int) -> Optional[Dict[str, Any]]:
+        return self.data(iteration) if callable(self.data) else self.data
+
+
+ENDPOINTS = [
+    Endpoint('auth-register', 'POST', '/auth/register/', 2, status=201, auth=False, data=lambda i: {
+        'email': f'candidate-{i}@example.com', 'password': BENCHMARK_PASSWORD, 'full_name': f'Candidate {i}',
+    }),
+    Endpoint('auth-login', 'POST', '/auth/login/', 1, auth=False,
+             data={'email': 'manager@example.com', 'password': BENCHMARK_PASSWORD}),
+    Endpoint('auth-profile', 'GET', '/auth/user-details/', 0),
+    Endpoint('companies-list', 'GET', '/auth/companies/', 1),
+    Endpoint('companies-detail', 'GET', '/auth/companies/{company}/', 1),
+    Endpoint('companies-create', 'POST', '/auth/companies/', 2, status=201, data=lambda i: {
+        'company_name': f'Benchmark Co {i}', 'company_size': '11-50', 'headquarters': 'Remote',
+    }),
+    Endpoint('prompts-list', 'GET', '/assessment/prompts/', 1),
+    Endpoint('prompts-detail', 'GET', '/assessment/prompts/{prompt}/', 2),
+    Endpoint('prompts-detail-revalidate', 'GET', '/assessment/prompts/{prompt}/', 1, status=304, revalidate=True),
+    Endpoint('prompts-create', 'POST', '/assessment/prompts/', 1, status=201, data={
+        'prompt_text': 'Backend Engineer', 'question_types': 'Open-ended questions', 'skills': ['python', 'sql'],
+    }),
+    Endpoint('prompts-generate', 'POST', '/assessment/prompts/{prompt}/generate/', 2, status=202),
+    Endpoint('prompts-generate-stream', 'POST', '/assessment/prompts/{prompt}/generate_stream/', 22,
+             data={'regenerate': True}),
+    Endpoint('assessments-list', 'GET', '/assessment/assessments/', 1),
+    Endpoint('assessments-detail', 'GET', '/assessment/assessments/{assessment}/', 2),
+    Endpoint('assessments-detail-revalidate', 'GET', '/assessment/assessments/{assessment}/', 1, status=304,
+             revalidate=True),
+    Endpoint('assessments-questions', 'GET', '/assessment/assessments/{assessment}/questions/', 3),
+    Endpoint('questions-list', 'GET', '/assessment/questions/', 1),
+    Endpoint('questions-filtered', 'GET', '/assessment/questions/?assessment={assessment}', 1),
+    Endpoint('questions-detail', 'GET', '/assessment/questions/{question}/', 1),
+    Endpoint('questions-generate-banked', 'POST', '/assessment/questions/generate/', 2, data={
+        'role': 'Role 0', 'area': 'Question 1', 'skills': ['communication', 'problem solving', 'sql'],
+        'question_types': 'Open-ended questions',
+    }),
+    Endpoint('questions-generate', 'POST', '/assessment/questions/generate/', 8, status=201, data={
+        'role': 'Site Reliability Engineer', 'area': 'Incident response', 'regenerate': True,
+    }),
+    Endpoint('conversations-list', 'GET', '/assessment/conversations/', 2),
+    Endpoint('conversations-detail', 'GET', '/assessment/conversations/{conversation}/', 2),
+    Endpoint('conversations-messages', 'GET', '/assessment/conversations/{conversation}/messages/', 3),
+    Endpoint('conversations-messages-revalidate', 'GET', '/assessment/conversations/{conversation}/messages/', 1,
+             status=304, revalidate=True),
+    Endpoint('conversations-add-message', 'POST', '/assessment/conversations/{conversation}/add_message/', 7,
+             data={'message': 'How would a candidate approach a flaky integration test?'}),
+    Endpoint('messages-list', 'GET', '/assessment/messages/', 1),
+    Endpoint('search', 'GET', '/assessment/search/?q=trade-offs+scenario', 4),
+    Endpoint('search-messages', 'GET', '/assessment/search/?q=realistic+turn&type=message', 1),
+]
+
+
+def seed(scale: float = 1.0) -> Dict[str, Any]:
+    """
+    Create a manager account, companies, prompts with assessments and their
+    questions, and conversations with messages, in SEED_VOLUMES times scale
+
+    Returns:
+        dict: Ids to format Endpoint paths with, and the manager's token
+    """
+    volumes = {name: max(1, round(count * scale)) for name, count in SEED_VOLUMES.items()}
+
+    user = User(email='manager@example.com', full_name='Hiring Manager')
+    user.set_password(BENCHMARK_PASSWORD)
+    user.save()
+    companies = Company.objects.bulk_create([
+        Company(user=user, company_name=f'Company {i}', headquarters='Berlin', year_founded=2010 + i,
+                team_structure_overview='Cross-functional squads of five to eight engineers. ' * 5)
+        for i in range(volumes['companies'])
+    ])
+
+    prompts = Prompt.objects.bulk_create([
+        Prompt(prompt_text=f'Role {i}', question_types='Open-ended questions',
+               skills=['communication', 'problem solving', 'sql'], company_context=companies[i % len(companies)])
+        for i in range(volumes['prompts'])
+    ])
+    assessments = Assessment.objects.bulk_create([
+        Assessment(prompt=prompt, title=f'{prompt.prompt_text} Assessment', content='Question text. ' * 300,
+                   usage={'input_tokens': 900, 'output_tokens': 1200})
+        for prompt in prompts
+    ])
+    questions = Question.objects.bulk_create([
+        Question(assessment=assessment, position=position, question_type=Question.TYPE_OPEN_ENDED,
+                 dimension='performance', title=f'Question {position}',
+                 text='Describe how you would approach this scenario. ' * 6,
+                 rubric='Strong answers weigh the trade-offs explicitly. ' * 4, time_minutes=10)
+        for assessment in assessments
+        for position in range(1, volumes['questions_per_assessment'] + 1)
+    ], batch_size=500)
+    # the first prompt's assessment as if generated, so its questions are banked
+    question_bank.add_assessment_questions(prompts[0], questions[:volumes['questions_per_assessment']])
+
+    conversations = ConversationThread.objects.bulk_create([
+        ConversationThread(title=f'Conversation {i}', assessment=assessments[i % len(assessments)])
+        for i in range(volumes['conversations'])
+    ])
+    Message.objects.bulk_create([
+        Message(conversation=conversation, message_type='user' if turn % 2 == 0 else 'assistant',
+                content='A realistic turn of a few sentences about the assessment. ' * 12)
+        for conversation in conversations
+        for turn in range(volumes['messages_per_conversation'])
+    ], batch_size=500)
+
+    return {
+        'token': user.generate_jwt(),
+        'company': companies[0].id,
+        'prompt': prompts[0].id,
+        'assessment': assessments[0].id,
+        'question': questions[0].id,
+        'conversation': conversations[0].id,
+        'volumes': volumes,
+    }
+
+
+def run_endpoint(client, endpoint: Endpoint, ids: Dict[str, Any], iterations: int, warmup: int = 1) -> Dict[str, Any]:
+    """
+    Send warmup + iterations requests to endpoint and time the last iterations
+
+    Returns:
+        dict: Latency percentiles, throughput, the most queries any timed
+        request issued and whether that is within the endpoint's budget
+    """
+    path = endpoint.path.format(**ids)
+    headers = {'HTTP_AUTHORIZATION': f"Bearer {ids['token']}"} if endpoint.auth else {}
+    latencies, queries, statuses = [], 0, set()
+    if endpoint.revalidate:
+        headers['HTTP_IF_NONE_MATCH'] = _request(client, endpoint, path, endpoint.body(0), headers)['ETag']
+
+    for iteration in range(warmup + iterations):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = _request(client, endpoint, path, endpoint.body(iteration), headers)
+            elapsed = time.perf_counter() - start
+        if iteration < warmup:
+            continue
+        latencies.append(elapsed)
+        queries = max(queries, len(captured))
+        statuses.add(response.status_code)
+
+    latencies.sort()
+    return {
+        'name': endpoint.name,
+        'method': endpoint.method,
+        'path': endpoint.path,
+        'iterations': iterations,
+        'status_codes': sorted(statuses),
+        'status_ok': statuses == {endpoint.status},
+        'queries': queries,
+        'max_queries': endpoint.max_queries,
+        'within_budget': queries <= endpoint.max_queries,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50': round(_percentile(latencies, 50) * 1000, 3),
+            'p95': round(_percentile(latencies, 95) * 1000, 3),
+            'p99': round(_percentile(latencies, 99) * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3),
+        },
+        'requests_per_second': round(len(latencies) / sum(latencies), 2),
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], max_regression: float) -> List[Dict[str, Any]]:
+    """
+    Compare p50 latency and query counts with a previous run's endpoints
+
+    Returns:
+        list: One row per endpoint present in both runs; regressed is set
+        when p50 grew by more than max_regression percent or queries grew
+    """
+    previous = {result['name']: result for result in baseline}
+    rows = []
+    for result in results:
+        before = previous.get(result['name'])
+        if before is None:
+            continue
+        old_p50, new_p50 = before['latency_ms']['p50'], result['latency_ms']['p50']
+        change = (new_p50 - old_p50) / old_p50 * 100 if old_p50 else 0.0
+        rows.append({
+            'name': result['name'],
+            'p50_before': old_p50,
+            'p50_after': new_p50,
+            'p50_change_pct': round(change, 1),
+            'queries_before': before['queries'],
+            'queries_after': result['queries'],
+            'regressed': change > max_regression or result['queries'] > before['queries'],
+        })
+    return rows
+
+
+def _request(client, endpoint, path, data, headers):
+    if endpoint.method == 'GET':
+        response = client.get(path, **headers)
+    else:
+        response = client.generic(endpoint.method, path, json.dumps(data or {}),
+                                  content_type='application/json', **headers)
+    if response.streaming:
+        # the work of a streaming view happens while its body is consumed
+        b''.join(response)
+    return response
+
+
+def _percentile(values, percent):
+    # nearest rank on sorted values
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Dict, Optional
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import F
+from django.utils import timezone
+from .models import GenerationCacheEntry
+
+# payload keys that change what the model generates; anything else (stream,
+# metadata) must not split the cache
+KEYED_FIELDS = ('model', 'system', 'messages', 'max_tokens', 'temperature', 'top_p', 'top_k', 'stop_sequences', 'tools', 'tool_choice')
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        # trailing whitespace and indentation drift in the prompt templates should still hit
+        return "\n".join(line.rstrip() for line in value.strip().splitlines())
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if k != 'cache_control'}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def cache_key(payload: Dict[str, Any]) -> str:
+    """
+    Content address for a Messages API payload: a hash of the model, the
+    normalized rendered prompt and the sampling params
+    """
+    keyed = {field: _normalize(payload[field]) for field in KEYED_FIELDS if field in payload}
+    canonical = json.dumps(keyed, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for generated responses: a bounded in-process LRU in
+    front of the GenerationCacheEntry table, both honouring a TTL
+
+    The table is the source of truth. An LRU entry remembers the expires_at
+    of the row it was read from or written as, and a hit is only served
+    while that row still exists unchanged, so invalidate(), clear() and
+    rewrites in any process take effect everywhere at once. The check is a
+    single indexed UPDATE (it also counts the hit); the LRU saves loading
+    and decoding the response.
+    """
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = timedelta(seconds=ttl)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = timezone.now()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                del self._entries[key]
+                entry = None
+
+        try:
+            if entry is not None:
+                response, expires_at = entry
+                current = GenerationCacheEntry.objects.filter(key=key, expires_at=expires_at).update(
+                    hit_count=F('hit_count') + 1
+                )
+                if current:
+                    with self._lock:
+                        if key in self._entries:
+                            self._entries.move_to_end(key)
+                    return response
+                # invalidated or rewritten elsewhere
+                self._forget(key)
+
+            row = GenerationCacheEntry.objects.filter(key=key, expires_at__gt=now).only('response', 'expires_at').first()
+            if row is None:
+                return None
+            GenerationCacheEntry.objects.filter(key=key).update(hit_count=F('hit_count') + 1)
+        except DatabaseError:
+            # the cache is an optimisation; a busy database must not fail the generation
+            return None
+        self._remember(key, row.response, row.expires_at)
+        return row.response
+
+    def set(self, key: str, kind: str, model: str, response: Dict[str, Any]) -> None:
+        expires_at = timezone.now() + self.ttl
+        try:
+            GenerationCacheEntry.objects.update_or_create(
+                key=key,
+                defaults={'kind': kind, 'model': model, 'response': response, 'expires_at': expires_at, 'hit_count': 0}
+            )
+        except DatabaseError:
+            pass
+        self._remember(key, response, expires_at)
+
+    def invalidate(self, key: str) -> None:
+        self._forget(key)
+        GenerationCacheEntry.objects.filter(key=key).delete()
+
+    def clear(self, kind: Optional[str] = None, expired_only: bool = False) -> int:
+        """
+        Drop cached responses, optionally only one kind or only expired rows
+
+        Returns:
+            int: Number of database rows removed
+        """
+        entries = GenerationCacheEntry.objects.all()
+        if kind:
+            entries = entries.filter(kind=kind)
+        if expired_only:
+            entries = entries.filter(expires_at__lte=timezone.now())
+        # the LRU does not track kinds, so any targeted clear empties it
+        with self._lock:
+            self._entries.clear()
+        deleted, _ = entries.delete()
+        return deleted
+
+    def _forget(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _remember(self, key, response, expires_at):
+        with self._lock:
+            self._entries[key] = (response, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+response_cache = ResponseCache(
+    max_entries=settings.GENERATION_CACHE_MAX_ENTRIES,
+    ttl=settings.GENERATION_CACHE_TTL,
+)
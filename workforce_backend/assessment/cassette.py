@@ -0,0 +1,301 @@
+"""
+Record/replay transport for the Anthropic clients
+
+With ANTHROPIC_CASSETTE set, AnthropicClient mounts CassetteAdapter on its
+requests session and AsyncAnthropicClient wraps its httpx transport in
+AsyncCassetteTransport. In record mode every exchange goes to the real API
+and is appended to the cassette, a JSON Lines file of status, headers and
+body chunks with their arrival times. In replay mode nothing leaves the
+machine: matching requests are answered from the cassette, each chunk after
+latency_scale times its recorded delay (0 serves instantly), so the whole
+generation pipeline can be load tested repeatably and without an API key.
+
+Requests match on method, path and canonical JSON body; identical requests
+recorded more than once are served in turn, cycling when exhausted. Request
+headers, and with them the API key, are never stored.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+MODE_RECORD = 'record'
+MODE_REPLAY = 'replay'
+
+# describe the recorded bytes, not the replayed ones
+HOP_HEADERS = {'content-length', 'content-encoding', 'transfer-encoding', 'connection'}
+
+
+class Cassette:
+    """Recorded exchanges, keyed by request"""
+
+    def __init__(self, path: str, mode: str = MODE_REPLAY, latency_scale: float = 1.0):
+        if mode not in (MODE_RECORD, MODE_REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._interactions: Dict[str, List[Dict[str, Any]]] = {}
+        self._served: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if mode == MODE_REPLAY:
+            self._load()
+
+    @classmethod
+    def from_settings(cls) -> Optional['Cassette']:
+        """The configured cassette, or None when ANTHROPIC_CASSETTE is unset"""
+        if not settings.ANTHROPIC_CASSETTE:
+            return None
+        return cls(settings.ANTHROPIC_CASSETTE, settings.ANTHROPIC_CASSETTE_MODE,
+                   settings.ANTHROPIC_CASSETTE_LATENCY_SCALE)
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == MODE_REPLAY
+
+    @staticmethod
+    def key(method: str, url: str, body: Optional[bytes]) -> str:
+        parts = urlsplit(url)
+        target = parts.path + (f"?{parts.query}" if parts.query else '')
+        if body:
+            try:
+                body = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':')).encode()
+            except ValueError:
+                pass
+        return hashlib.sha256(method.upper().encode() + b' ' + target.encode() + b'\n' + (body or b'')).hexdigest()
+
+    def play(self, method: str, url: str, body: Optional[bytes]) -> Optional[Dict[str, Any]]:
+        """The next recorded interaction for a request, or None if there is none"""
+        key = self.key(method, url, body)
+        with self._lock:
+            recorded = self._interactions.get(key)
+            if not recorded:
+                return None
+            served = self._served.get(key, 0)
+            self._served[key] = served + 1
+        return recorded[served % len(recorded)]
+
+    def record(self, method: str, url: str, body: Optional[bytes], status: int,
+               headers: Dict[str, str], headers_at: float, chunks: List[List[Any]]) -> None:
+        """Append one finished exchange to the cassette file"""
+        interaction = {
+            'key': self.key(method, url, body),
+            'method': method.upper(),
+            'url': urlsplit(url).path,
+            'request': _json_or_text(body),
+            'status': status,
+            'headers': {name: value for name, value in headers.items() if name.lower() not in HOP_HEADERS},
+            'headers_at': round(headers_at, 4),
+            # latin-1 maps every byte to one character, so chunks split inside
+            # a multi-byte character survive the round trip
+            'chunks': [[round(offset, 4), chunk.decode('latin-1')] for offset, chunk in chunks],
+        }
+        line = json.dumps(interaction) + "\n"
+        with self._lock:
+            self._interactions.setdefault(interaction['key'], []).append(interaction)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def delay(self, recorded: float, started: float) -> float:
+        """Seconds to wait so an event recorded `recorded` seconds in is replayed on schedule"""
+        return max(0.0, started + recorded * self.latency_scale - time.perf_counter())
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Cassette {self.path} does not exist; record it first")
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    interaction = json.loads(line)
+                    self._interactions.setdefault(interaction['key'], []).append(interaction)
+
+
+def _json_or_text(body):
+    if not body:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body.decode('utf-8', 'replace')
+
+
+def _miss(method, url):
+    # shaped like an API error so callers surface it as one
+    message = f"No recorded response for {method} {urlsplit(url).path} with this body"
+    return 404, json.dumps({"type": "error", "error": {"type": "not_found_error", "message": message}}).encode()
+
+
+def _chunks(interaction):
+    return [(offset, text.encode('latin-1')) for offset, text in interaction['chunks']]
+
+
+class CassetteAdapter(BaseAdapter):
+    """requests transport adapter recording through, or replaying instead of, `adapter`"""
+
+    def __init__(self, cassette: Cassette, adapter: BaseAdapter):
+        super().__init__()
+        self.cassette = cassette
+        self.adapter = adapter
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        started = time.perf_counter()
+        if self.cassette.replaying:
+            interaction = self.cassette.play(request.method, request.url, request.body)
+            if interaction is None:
+                status, body = _miss(request.method, request.url)
+                return self._response(request, status, {'content-type': 'application/json'}, _ReplayBody(
+                    [(0, body)], started, self.cassette
+                ))
+            time.sleep(self.cassette.delay(interaction['headers_at'], started))
+            return self._response(request, interaction['status'], interaction['headers'], _ReplayBody(
+                _chunks(interaction), started, self.cassette
+            ))
+
+        # record the body as sent, never compressed
+        request.headers['Accept-Encoding'] = 'identity'
+        response = self.adapter.send(request, stream=True, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+        headers_at = time.perf_counter() - started
+        response.raw = _RecordingBody(response.raw, started, lambda chunks: self.cassette.record(
+            request.method, request.url, request.body, response.status_code, dict(response.headers), headers_at, chunks
+        ))
+        return response
+
+    @staticmethod
+    def _response(request, status, headers, body):
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = body
+        response.reason = 'Replayed'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+class _ReplayBody:
+    """Response body for requests that releases recorded chunks on schedule"""
+
+    def __init__(self, chunks, started, cassette):
+        self._chunks = chunks
+        self._started = started
+        self._cassette = cassette
+
+    def stream(self, amt=None, decode_content=True):
+        while self._chunks:
+            offset, chunk = self._chunks.pop(0)
+            time.sleep(self._cassette.delay(offset, self._started))
+            yield chunk
+
+    def read(self, amt=None, decode_content=True):
+        return b''.join(self.stream())
+
+    def close(self):
+        self._chunks = []
+
+
+class _RecordingBody:
+    """Passes a urllib3 response body through, noting when each chunk arrived"""
+
+    def __init__(self, raw, started, on_done):
+        self._raw = raw
+        self._started = started
+        self._on_done = on_done
+        self._chunks = []
+        self._done = False
+
+    def stream(self, amt=None, decode_content=True):
+        for chunk in self._raw.stream(amt, decode_content=True):
+            self._chunks.append((time.perf_counter() - self._started, chunk))
+            yield chunk
+        self._finish()
+
+    def read(self, amt=None, decode_content=True):
+        return b''.join(self.stream())
+
+    def close(self):
+        self._raw.close()
+
+    def release_conn(self):
+        self._raw.release_conn()
+
+    def _finish(self):
+        # a body abandoned part way is not worth replaying
+        if not self._done:
+            self._done = True
+            self._on_done(self._chunks)
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    """httpx counterpart of CassetteAdapter"""
+
+    def __init__(self, cassette: Cassette, transport: httpx.AsyncBaseTransport):
+        self.cassette = cassette
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        body = await request.aread()
+        url = str(request.url)
+        if self.cassette.replaying:
+            interaction = self.cassette.play(request.method, url, body)
+            if interaction is None:
+                status, content = _miss(request.method, url)
+                return httpx.Response(status, headers={'content-type': 'application/json'}, content=content)
+            await asyncio.sleep(self.cassette.delay(interaction['headers_at'], started))
+            return httpx.Response(interaction['status'], headers=interaction['headers'],
+                                  stream=_AsyncReplayBody(_chunks(interaction), started, self.cassette))
+
+        request.headers['accept-encoding'] = 'identity'
+        response = await self.transport.handle_async_request(request)
+        headers_at = time.perf_counter() - started
+        recording = _AsyncRecordingBody(response.stream, started, lambda chunks: self.cassette.record(
+            request.method, url, body, response.status_code, dict(response.headers), headers_at, chunks
+        ))
+        return httpx.Response(response.status_code, headers=response.headers, stream=recording,
+                              extensions=response.extensions)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class _AsyncReplayBody(httpx.AsyncByteStream):
+    def __init__(self, chunks, started, cassette):
+        self._chunks = chunks
+        self._started = started
+        self._cassette = cassette
+
+    async def __aiter__(self):
+        for offset, chunk in self._chunks:
+            await asyncio.sleep(self._cassette.delay(offset, self._started))
+            yield chunk
+
+
+class _AsyncRecordingBody(httpx.AsyncByteStream):
+    def __init__(self, stream, started, on_done):
+        self._stream = stream
+        self._started = started
+        self._on_done = on_done
+
+    async def __aiter__(self):
+        chunks = []
+        async for chunk in self._stream:
+            chunks.append((time.perf_counter() - self._started, chunk))
+            yield chunk
+        self._on_done(chunks)
+
+    async def aclose(self):
+        await self._stream.aclose()
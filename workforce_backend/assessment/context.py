@@ -0,0 +1,149 @@
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .models import ConversationThread, Message
+
+logger = logging.getLogger(__name__)
+
+# rough English average; only used to keep requests under a budget, not for billing
+CHARS_PER_TOKEN = 4
+
+SUMMARY_INSTRUCTIONS = """You maintain a running summary of a conversation between a hiring manager and an assessment designer.
+Update the existing summary with the new turns below. Keep every decision, requested change and constraint that still applies, the current state of the assessment (questions, weights, timing) and anything the hiring manager rejected. Drop pleasantries and superseded drafts. Reply with the updated summary only."""
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class ConversationContext:
+    """
+    Builds the message history for a conversation turn under a token budget
+
+    Recent turns are sent verbatim; once the history outgrows the budget the
+    oldest turns are folded into ConversationThread.summary, which is sent as
+    system context instead. Folding trims the window down to a fraction of
+    the budget so the summary is only rewritten every few turns. If the
+    summary call fails the folded turns are sent verbatim instead, over
+    budget, and folding is retried on the next turn.
+    """
+
+    def __init__(self, client, budget=None, retain=None):
+        self.client = client
+        self.budget = budget or settings.CONVERSATION_CONTEXT_TOKENS
+        self.retain = retain or settings.CONVERSATION_CONTEXT_RETAIN
+
+    def build(self, conversation, pending=None):
+        """
+        Return (summary, messages) for the next API call. pending is the new,
+        unsaved user Message; it goes after the stored history and is never
+        folded.
+        """
+        history = list(self._history(conversation))
+        if pending is not None:
+            history.append(pending)
+
+        summary = conversation.summary
+        folded, history = self._window(summary, history)
+        if folded:
+            response = self.client._make_api_call(self._summary_payload(conversation, folded), kind='summary')
+            summary, history = self._fold(conversation, summary, folded, history, response)
+        return summary, self._messages(history)
+
+    async def abuild(self, conversation, pending=None):
+        """
+        Async counterpart of build; the client must be an AsyncAnthropicClient
+        """
+        history = [msg async for msg in self._history(conversation)]
+        if pending is not None:
+            history.append(pending)
+
+        summary = conversation.summary
+        folded, history = self._window(summary, history)
+        if folded:
+            response = await self.client._make_api_call(self._summary_payload(conversation, folded), kind='summary')
+            summary, history = await sync_to_async(self._fold)(conversation, summary, folded, history, response)
+        return summary, self._messages(history)
+
+    @staticmethod
+    def _history(conversation):
+        history = Message.objects.filter(conversation=conversation)
+        if conversation.summary_last_message_id:
+            history = history.filter(id__gt=conversation.summary_last_message_id)
+        return history.order_by('time_stamp', 'id').only('id', 'message_type', 'content')
+
+    def _window(self, summary, history):
+        """Split history into (turns to fold, turns to send verbatim)"""
+        sizes = [estimate_tokens(msg.content) for msg in history]
+        if estimate_tokens(summary) + sum(sizes) <= self.budget:
+            return [], history
+        split = self._split_point(history, sizes, int(self.budget * self.retain))
+        return history[:split], history[split:]
+
+    @staticmethod
+    def _messages(history):
+        return [
+            {"role": "user" if msg.message_type == 'user' else "assistant", "content": msg.content}
+            for msg in history
+        ]
+
+    def _split_point(self, history, sizes, target):
+        # walk back from the newest turn; the newest is always kept
+        split = len(history) - 1
+        used = sizes[split]
+        while split > 0 and used + sizes[split - 1] <= target:
+            split -= 1
+            used += sizes[split]
+        # the Messages API needs the window to open with a user turn
+        while split < len(history) - 1 and history[split].message_type != 'user':
+            split += 1
+        return split
+
+    @staticmethod
+    def _summary_payload(conversation, folded):
+        transcript = "\n\n".join(
+            f"{'HIRING MANAGER' if msg.message_type == 'user' else 'ASSISTANT'}: {msg.content}" for msg in folded
+        )
+        return {
+            "model": settings.CONVERSATION_SUMMARY_MODEL,
+            "max_tokens": settings.CONVERSATION_SUMMARY_MAX_TOKENS,
+            "temperature": 0,
+            "system": SUMMARY_INSTRUCTIONS,
+            "messages": [{
+                "role": "user",
+                "content": f"EXISTING SUMMARY:\n{conversation.summary or '(none)'}\n\nNEW TURNS:\n{transcript}"
+            }]
+        }
+
+    def _fold(self, conversation, summary, folded, history, response):
+        """(summary, history) to send once the summary call has returned"""
+        stored = self._store_summary(conversation, folded, response)
+        if stored is None:
+            # never lose turns: send them as they are
+            return summary, folded + history
+        return stored, history
+
+    @staticmethod
+    def _store_summary(conversation, folded, response):
+        """
+        Merge folded turns into the stored summary
+
+        Returns:
+            str: The new summary, or None if summarization failed
+        """
+        if response.get('error'):
+            logger.warning(
+                'Summarizing %d turns of conversation %s failed (%s); sending them unsummarized',
+                len(folded), conversation.id, response.get('message'),
+            )
+            return None
+
+        summary = "".join(item.get('text', '') for item in response.get('content', []) if item.get('type') == 'text')
+        # only advance if no concurrent turn folded first
+        updated = ConversationThread.objects.filter(
+            id=conversation.id, summary_last_message_id=conversation.summary_last_message_id
+        ).update(summary=summary, summary_last_message_id=folded[-1].id)
+        if updated:
+            conversation.summary = summary
+            conversation.summary_last_message_id = folded[-1].id
+        return summary
@@ -0,0 +1,308 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import GenerationBatch, GenerationJob
+from .services import AssessmentService
+
+# seconds allowed on top of the longest generation for storing its result
+STALE_MARGIN = 60
+
+
+def enqueue_generation(prompt, regenerate=False):
+    """
+    Queue an assessment generation for a prompt; a worker picks it up
+    """
+    return GenerationJob.objects.create(prompt=prompt, regenerate=regenerate)
+
+
+def claim_next_job(worker_id):
+    """
+    Atomically claim the oldest queued job for this worker
+
+    Uses SELECT ... FOR UPDATE SKIP LOCKED where the backend supports it so
+    concurrent workers never block on each other; the conditional UPDATE keeps
+    the claim safe on backends without row locks (SQLite).
+
+    Returns:
+        GenerationJob or None if the queue is empty
+    """
+    while True:
+        with transaction.atomic():
+            # batch jobs are run by whichever worker claimed their batch
+            queued = GenerationJob.objects.filter(
+                status=GenerationJob.STATUS_QUEUED, batch__isnull=True
+            ).order_by('created_at', 'id')
+            if connection.features.has_select_for_update_skip_locked:
+                queued = queued.select_for_update(skip_locked=True)
+            job = queued.first()
+            if job is None:
+                return None
+
+            claimed = GenerationJob.objects.filter(
+                id=job.id, status=GenerationJob.STATUS_QUEUED
+            ).update(
+                status=GenerationJob.STATUS_RUNNING,
+                worker=worker_id,
+                started_at=timezone.now(),
+                attempts=F('attempts') + 1,
+            )
+        if claimed:
+            job.refresh_from_db()
+            return job
+        # another worker won the race for this row; try the next one
+
+
+def run_job(job):
+    """
+    Run a claimed job and record its outcome
+    """
+    try:
+        result = AssessmentService().generate_assessment_from_prompt(job.prompt_id, use_cache=not job.regenerate)
+    except Exception as e:
+        result = {'error': str(e)}
+    return _record_outcome(job, result)
+
+
+def _record_outcome(job, result):
+    job.result = result
+    job.finished_at = timezone.now()
+    if result.get('error'):
+        job.status = GenerationJob.STATUS_FAILED
+        job.error = result['error']
+    else:
+        job.status = GenerationJob.STATUS_SUCCEEDED
+        job.assessment_id = result.get('assessment_id')
+    job.save(update_fields=['status', 'result', 'error', 'assessment', 'finished_at', 'updated_at'])
+    return job
+
+
+def max_generation_time():
+    """
+    The longest one generation can legitimately take: waiting out the lease
+    of an identical generation in flight, then every attempt the client
+    makes (rate limiter wait, connect and read timeouts) with the backoff
+    between them, plus STALE_MARGIN. Running jobs younger than this must
+    not be requeued, or the prompt is generated twice.
+
+    Returns:
+        timedelta
+    """
+    rate_limit_wait = settings.ANTHROPIC_RATE_LIMIT_MAX_WAIT if settings.ANTHROPIC_RATE_LIMIT_ENABLED else 0
+    attempt = rate_limit_wait + settings.ANTHROPIC_CONNECT_TIMEOUT + settings.ANTHROPIC_READ_TIMEOUT
+    backoff = settings.ANTHROPIC_RETRY_MAX_BACKOFF + settings.ANTHROPIC_RETRY_BACKOFF
+    return timedelta(seconds=(
+        settings.GENERATION_SINGLE_FLIGHT_LEASE
+        + (settings.ANTHROPIC_MAX_RETRIES + 1) * attempt
+        + settings.ANTHROPIC_MAX_RETRIES * backoff
+        + STALE_MARGIN
+    ))
+
+
+def requeue_stale_jobs(timeout, max_attempts):
+    """
+    Return jobs whose worker died mid-run to the queue, or fail them once
+    they have used up their attempts
+
+    Args:
+        timeout (timedelta): How long a job may stay running; at least
+            max_generation_time()
+        max_attempts (int): Attempts allowed before a job is failed
+    """
+    cutoff = timezone.now() - timeout
+    # Message Batches jobs legitimately run for hours; their batch poll settles them
+    stale = GenerationJob.objects.filter(
+        status=GenerationJob.STATUS_RUNNING, started_at__lt=cutoff
+    ).exclude(batch__mode=GenerationBatch.MODE_MESSAGE_BATCHES)
+    stale.filter(attempts__gte=max_attempts).update(
+        status=GenerationJob.STATUS_FAILED,
+        error='Worker timed out',
+        finished_at=timezone.now(),
+    )
+    requeued = stale.filter(attempts__lt=max_attempts).update(status=GenerationJob.STATUS_QUEUED, worker='')
+
+    # hand batches abandoned by a dead worker to the next one
+    GenerationBatch.objects.filter(
+        mode=GenerationBatch.MODE_CONCURRENT,
+        status=GenerationBatch.STATUS_RUNNING,
+        updated_at__lt=cutoff,
+    ).exclude(jobs__status=GenerationJob.STATUS_RUNNING).update(status=GenerationBatch.STATUS_QUEUED)
+    return requeued
+
+
+def enqueue_batch(prompts, concurrency=None, mode=GenerationBatch.MODE_CONCURRENT, regenerate=False):
+    """
+    Queue one generation job per prompt under a single batch
+
+    Args:
+        prompts (list): Prompt instances to generate assessments for
+        concurrency (int): Generations in flight at once, capped at
+            GENERATION_BATCH_MAX_CONCURRENCY
+        mode (str): GenerationBatch.MODE_CONCURRENT or MODE_MESSAGE_BATCHES
+        regenerate (bool): Bypass the generation cache
+    """
+    concurrency = concurrency or settings.GENERATION_BATCH_CONCURRENCY
+    with transaction.atomic():
+        batch = GenerationBatch.objects.create(
+            mode=mode,
+            concurrency=max(1, min(concurrency, settings.GENERATION_BATCH_MAX_CONCURRENCY)),
+            regenerate=regenerate,
+        )
+        GenerationJob.objects.bulk_create([
+            GenerationJob(prompt=prompt, batch=batch, regenerate=regenerate) for prompt in prompts
+        ])
+    return batch
+
+
+def claim_next_batch():
+    """
+    Claim the oldest queued batch, the same way claim_next_job claims jobs
+
+    Returns:
+        GenerationBatch or None
+    """
+    while True:
+        batch = GenerationBatch.objects.filter(status=GenerationBatch.STATUS_QUEUED).order_by('created_at', 'id').first()
+        if batch is None:
+            return None
+        claimed = GenerationBatch.objects.filter(
+            id=batch.id, status=GenerationBatch.STATUS_QUEUED
+        ).update(status=GenerationBatch.STATUS_RUNNING, updated_at=timezone.now())
+        if claimed:
+            batch.refresh_from_db()
+            return batch
+
+
+def run_batch(batch, worker_id):
+    """
+    Run a claimed batch. Concurrent batches fan out over a thread pool bounded
+    by batch.concurrency; every job saves its own result, so one failure does
+    not affect the rest. Message Batches batches are submitted and settled
+    later by poll_message_batches.
+    """
+    if batch.mode == GenerationBatch.MODE_MESSAGE_BATCHES:
+        return submit_message_batch(batch, worker_id)
+
+    job_ids = list(batch.jobs.filter(status=GenerationJob.STATUS_QUEUED).values_list('id', flat=True))
+    with ThreadPoolExecutor(max_workers=batch.concurrency, thread_name_prefix=f'batch-{batch.id}') as pool:
+        list(pool.map(lambda job_id: _run_batch_job(batch.id, job_id, worker_id), job_ids))
+    _finish_batch(batch)
+    return batch
+
+
+def _run_batch_job(batch_id, job_id, worker_id):
+    try:
+        claimed = GenerationJob.objects.filter(id=job_id, status=GenerationJob.STATUS_QUEUED).update(
+            status=GenerationJob.STATUS_RUNNING,
+            worker=worker_id,
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            run_job(GenerationJob.objects.get(id=job_id))
+            # heartbeat so requeue_stale_jobs leaves a live batch alone
+            GenerationBatch.objects.filter(id=batch_id).update(updated_at=timezone.now())
+    finally:
+        # pool threads each open their own connection
+        connection.close()
+
+
+def _finish_batch(batch):
+    if batch.jobs.filter(status__in=[GenerationJob.STATUS_QUEUED, GenerationJob.STATUS_RUNNING]).exists():
+        return
+    batch.status = GenerationBatch.STATUS_COMPLETED
+    batch.finished_at = timezone.now()
+    batch.save(update_fields=['status', 'finished_at', 'updated_at'])
+
+
+def submit_message_batch(batch, worker_id):
+    """
+    Send every queued job of a batch as one Message Batches API request
+    """
+    service = AssessmentService()
+    jobs = list(batch.jobs.filter(status=GenerationJob.STATUS_QUEUED).select_related('prompt__company_context'))
+    created = service.client.create_message_batch([
+        {"custom_id": f"job-{job.id}", "params": service.assessment_payload(job.prompt)} for job in jobs
+    ])
+
+    now = timezone.now()
+    job_ids = [job.id for job in jobs]
+    if created.get('error'):
+        GenerationJob.objects.filter(id__in=job_ids).update(
+            status=GenerationJob.STATUS_FAILED, error=created.get('message') or 'Batch submission failed', finished_at=now
+        )
+        _finish_batch(batch)
+        return batch
+
+    GenerationJob.objects.filter(id__in=job_ids).update(
+        status=GenerationJob.STATUS_RUNNING, worker=worker_id, started_at=now, attempts=F('attempts') + 1
+    )
+    batch.provider_batch_id = created['id']
+    batch.status = GenerationBatch.STATUS_SUBMITTED
+    batch.polled_at = now
+    batch.save(update_fields=['provider_batch_id', 'status', 'polled_at', 'updated_at'])
+    return batch
+
+
+def poll_message_batches(force=False):
+    """
+    Check submitted Message Batches batches (at most once per
+    MESSAGE_BATCH_POLL_INTERVAL each) and store the results of ended ones
+
+    Returns:
+        int: Number of batches settled
+    """
+    now = timezone.now()
+    due = GenerationBatch.objects.filter(status=GenerationBatch.STATUS_SUBMITTED)
+    if not force:
+        due = due.filter(Q(polled_at__isnull=True) | Q(polled_at__lt=now - timedelta(seconds=settings.MESSAGE_BATCH_POLL_INTERVAL)))
+
+    settled = 0
+    client = AssessmentService().client
+    for batch in due:
+        # whoever moves polled_at first polls this round
+        if not GenerationBatch.objects.filter(id=batch.id, polled_at=batch.polled_at).update(polled_at=now):
+            continue
+        info = client.retrieve_message_batch(batch.provider_batch_id)
+        if info.get('error') or info.get('processing_status') != 'ended':
+            continue
+        if not GenerationBatch.objects.filter(id=batch.id, status=GenerationBatch.STATUS_SUBMITTED).update(
+            status=GenerationBatch.STATUS_RUNNING
+        ):
+            continue
+        try:
+            _collect_message_batch(batch, info['results_url'])
+        except Exception:
+            # results could not be read; retry on the next poll
+            GenerationBatch.objects.filter(id=batch.id).update(status=GenerationBatch.STATUS_SUBMITTED)
+            continue
+        settled += 1
+    return settled
+
+
+def _collect_message_batch(batch, results_url):
+    service = AssessmentService()
+    jobs = {
+        f"job-{job.id}": job
+        for job in batch.jobs.filter(status=GenerationJob.STATUS_RUNNING).select_related('prompt__company_context')
+    }
+    for item in service.client.message_batch_results(results_url):
+        job = jobs.pop(item.get('custom_id'), None)
+        if job is None:
+            continue
+        result = item.get('result', {})
+        if result.get('type') == 'succeeded':
+            try:
+                outcome = service.record_assessment(job.prompt, result['message'])
+            except Exception as e:
+                outcome = {'error': str(e)}
+        else:
+            error = result.get('error', {}).get('error', {}).get('message') if result.get('type') == 'errored' else None
+            outcome = {'error': error or f"Batch request {result.get('type', 'failed')}"}
+        _record_outcome(job, outcome)
+
+    for job in jobs.values():
+        _record_outcome(job, {'error': 'No result returned for this request'})
+    _finish_batch(batch)
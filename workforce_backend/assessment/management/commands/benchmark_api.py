@@ -0,0 +1,156 @@
+import copy
+import json
+import os
+import platform
+import tempfile
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from assessment import anthropic_client
+from assessment.anthropic_client import AnthropicClient
+from assessment.benchmark import ENDPOINTS, compare, run_endpoint, seed
+from assessment.cassette import MODE_RECORD, MODE_REPLAY, Cassette
+from assessment.metrics import llm_metrics
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark every REST endpoint on a throwaway database seeded with realistic volumes, '
+        'against a local stub Anthropic server or a recorded cassette. Reports latency, throughput '
+        'and query counts, fails if an endpoint exceeds its query budget, and writes the results as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per endpoint first')
+        parser.add_argument('--scale', type=float, default=1.0, help='Multiplier for the seeded row counts')
+        parser.add_argument('--endpoint', action='append', dest='endpoints', help='Only run these (repeatable)')
+        parser.add_argument('--cassette', help='Replay upstream calls from this cassette instead of the stub server')
+        parser.add_argument('--record', action='store_true',
+                            help='Record --cassette from the real API (needs ANTHROPIC_API_KEY); replay it '
+                                 'with the same --iterations, --warmup and --scale')
+        parser.add_argument('--latency-scale', type=float, default=1.0,
+                            help='Multiplier for replayed upstream latency; 0 replays instantly')
+        parser.add_argument('--output', help='Write the JSON results to this file')
+        parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+        parser.add_argument('--max-regression', type=float, default=20.0,
+                            help='Percent p50 slowdown against --baseline that fails the run')
+
+    def handle(self, *args, **options):
+        endpoints = ENDPOINTS
+        if options['endpoints']:
+            endpoints = [endpoint for endpoint in ENDPOINTS if endpoint.name in options['endpoints']]
+            unknown = set(options['endpoints']) - {endpoint.name for endpoint in endpoints}
+            if unknown:
+                raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+
+        with tempfile.TemporaryDirectory() as directory:
+            results, volumes = self.run(endpoints, options, directory)
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'iterations': options['iterations'],
+            'warmup': options['warmup'],
+            'volumes': volumes,
+            'endpoints': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+        failures = [
+            f"{result['name']}: {result['queries']} queries (budget {result['max_queries']})"
+            for result in results if not result['within_budget']
+        ] + [
+            f"{result['name']}: status {result['status_codes']}"
+            for result in results if not result['status_ok']
+        ]
+        self.summarize(results)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['endpoints']
+            rows = compare(results, baseline, options['max_regression'])
+            for row in rows:
+                self.stderr.write(
+                    f"{row['name']:<34} p50 {row['p50_before']:9.2f} -> {row['p50_after']:9.2f} ms "
+                    f"({row['p50_change_pct']:+.1f}%), queries {row['queries_before']} -> {row['queries_after']}"
+                    + ('  REGRESSED' if row['regressed'] else '')
+                )
+            failures += [f"{row['name']}: regressed against baseline" for row in rows if row['regressed']]
+
+        if failures:
+            raise CommandError('Benchmark failed:\n  ' + '\n  '.join(failures))
+
+    def run(self, endpoints, options, directory):
+        # connection.settings_dict is settings.DATABASES['default'] itself;
+        # put it back as it was, whatever happens to the throwaway database
+        settings_dict = connection.settings_dict
+        saved_settings = copy.deepcopy(settings_dict)
+        try:
+            return self.run_on_test_db(endpoints, options, directory)
+        finally:
+            settings_dict.clear()
+            settings_dict.update(saved_settings)
+
+    def run_on_test_db(self, endpoints, options, directory):
+        settings_dict = connection.settings_dict
+        if connection.vendor == 'sqlite':
+            # never touch the real or the test suite's database file
+            settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+        old_name = settings_dict['NAME']
+
+        server = None
+        if options['cassette']:
+            mode = MODE_RECORD if options['record'] else MODE_REPLAY
+            upstream = AnthropicClient(cassette=Cassette(options['cassette'], mode, options['latency_scale']))
+            if mode == MODE_REPLAY:
+                # the node's real budget does not apply to replayed calls
+                upstream.rate_limiter = None
+        else:
+            # test support, next to manage.py rather than in the app
+            from tests.support.stub_server import start_stub_server, stub_client
+            server = start_stub_server()
+            upstream = stub_client(server)
+        previous_client = anthropic_client._client
+        anthropic_client._client = upstream
+
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        background = llm_metrics.background
+        llm_metrics.background = False
+        try:
+            ids = seed(options['scale'])
+            client = Client()
+            results = [
+                run_endpoint(client, endpoint, ids, options['iterations'], options['warmup'])
+                for endpoint in endpoints
+            ]
+        finally:
+            llm_metrics.drain()
+            llm_metrics.background = background
+            anthropic_client._client = previous_client
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        return results, ids['volumes']
+
+    def summarize(self, results):
+        # human-readable table on stderr so stdout stays valid JSON
+        for result in results:
+            latency = result['latency_ms']
+            self.stderr.write(
+                f"{result['name']:<34} p50 {latency['p50']:9.2f} ms  p95 {latency['p95']:9.2f} ms  "
+                f"{result['requests_per_second']:8.1f} req/s  "
+                f"{result['queries']:>3}/{result['max_queries']:<3} queries"
+            )
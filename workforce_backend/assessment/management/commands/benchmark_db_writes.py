@@ -0,0 +1,121 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from django.core.management.base import BaseCommand
+from workforce_backend.database import SQLITE_BUSY_TIMEOUT_MS, apply_sqlite_pragmas
+
+SCHEMA = """
+CREATE TABLE conversation (id INTEGER PRIMARY KEY, updated_at REAL);
+CREATE TABLE message (
+    id INTEGER PRIMARY KEY, conversation_id INTEGER, message_type TEXT, content TEXT, time_stamp REAL
+);
+CREATE INDEX message_conversation_idx ON message (conversation_id, time_stamp, id);
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare concurrent SQLite write throughput with the default connection settings '
+        'and with the tuned settings from workforce_backend.database, using a '
+        'continue_conversation-shaped workload on a throwaway database file'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--turns', type=int, default=200, help='Conversation turns per thread')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON')
+
+    def handle(self, *args, **options):
+        results = [
+            self.run(tuned, options['threads'], options['turns'])
+            for tuned in (False, True)
+        ]
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for result in results:
+            self.stdout.write(
+                f"{result['config']:>8}: {result['turns_per_second']:8.1f} turns/s, "
+                f"{result['failed']} failed of {result['attempted']} ({result['seconds']:.2f}s)"
+            )
+        baseline, tuned = results
+        if baseline['turns_per_second']:
+            self.stdout.write(f"speedup: {tuned['turns_per_second'] / baseline['turns_per_second']:.1f}x")
+
+    def run(self, tuned, threads, turns):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.sqlite3')
+            setup = sqlite3.connect(path)
+            setup.executescript(SCHEMA)
+            setup.executemany('INSERT INTO conversation (id, updated_at) VALUES (?, ?)',
+                              [(i, time.time()) for i in range(threads)])
+            setup.commit()
+            setup.close()
+
+            counts = {'completed': 0, 'failed': 0}
+            lock = threading.Lock()
+            started = time.perf_counter()
+            workers = [
+                threading.Thread(target=self.worker, args=(path, tuned, conversation_id, turns, counts, lock))
+                for conversation_id in range(threads)
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            seconds = time.perf_counter() - started
+
+        return {
+            'config': 'tuned' if tuned else 'default',
+            'threads': threads,
+            'attempted': threads * turns,
+            'completed': counts['completed'],
+            'failed': counts['failed'],
+            'seconds': seconds,
+            'turns_per_second': counts['completed'] / seconds,
+        }
+
+    def worker(self, path, tuned, conversation_id, turns, counts, lock):
+        if tuned:
+            connection = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            apply_sqlite_pragmas(connection.cursor())
+            begin = 'BEGIN IMMEDIATE'
+        else:
+            # what Django used before: rollback journal, full sync, deferred transactions
+            connection = sqlite3.connect(path, isolation_level=None)
+            begin = 'BEGIN'
+
+        completed = failed = 0
+        for turn in range(turns):
+            try:
+                connection.execute(begin)
+                # read the history, then store both turns and touch the thread
+                connection.execute(
+                    'SELECT id, message_type, content FROM message WHERE conversation_id = ? ORDER BY time_stamp, id',
+                    (conversation_id,)
+                ).fetchall()
+                now = time.time()
+                connection.execute(
+                    'INSERT INTO message (conversation_id, message_type, content, time_stamp) VALUES (?, ?, ?, ?)',
+                    (conversation_id, 'user', f'turn {turn}', now)
+                )
+                connection.execute(
+                    'INSERT INTO message (conversation_id, message_type, content, time_stamp) VALUES (?, ?, ?, ?)',
+                    (conversation_id, 'assistant', 'x' * 2000, now)
+                )
+                connection.execute('UPDATE conversation SET updated_at = ? WHERE id = ?', (now, conversation_id))
+                connection.execute('COMMIT')
+                completed += 1
+            except sqlite3.OperationalError:
+                if connection.in_transaction:
+                    connection.execute('ROLLBACK')
+                failed += 1
+        connection.close()
+
+        with lock:
+            counts['completed'] += completed
+            counts['failed'] += failed
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from assessment.cache import response_cache
+
+
+class Command(BaseCommand):
+    help = 'Invalidate cached assessment and question generations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=['assessment', 'question'], help='Only clear this kind of entry')
+        parser.add_argument('--expired', action='store_true', help='Only purge entries past their TTL')
+        parser.add_argument('--key', help='Invalidate a single cache key')
+
+    def handle(self, *args, **options):
+        if options['key']:
+            response_cache.invalidate(options['key'])
+            self.stdout.write(f"Invalidated {options['key']}")
+            return
+        deleted = response_cache.clear(kind=options['kind'], expired_only=options['expired'])
+        self.stdout.write(f'Removed {deleted} cache entr{"y" if deleted == 1 else "ies"}')
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from assessment.metrics import prune_calls
+
+
+class Command(BaseCommand):
+    help = 'Delete upstream call records older than the retention period; the /metrics totals are kept'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help=f'Keep this many days of records (default LLM_METRICS_RETENTION_DAYS, '
+                                 f'{settings.LLM_METRICS_RETENTION_DAYS})')
+
+    def handle(self, *args, **options):
+        deleted = prune_calls(options['days'])
+        self.stdout.write(f'Removed {deleted} call record{"" if deleted == 1 else "s"}')
@@ -0,0 +1,15 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from assessment.models import ResponseBlob
+
+
+class Command(BaseCommand):
+    help = 'Delete stored raw responses no assessment or message refers to any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age-hours', type=float, default=1,
+                            help='Keep unreferenced responses stored less than this many hours ago (default 1)')
+
+    def handle(self, *args, **options):
+        deleted = ResponseBlob.prune_unreferenced(timedelta(hours=options['min_age_hours']))
+        self.stdout.write(f'Removed {deleted} stored response{"" if deleted == 1 else "s"}')
@@ -0,0 +1,72 @@
+import os
+import signal
+import socket
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from assessment.jobs import (
+    claim_next_batch, claim_next_job, max_generation_time, poll_message_batches, requeue_stale_jobs, run_batch,
+    run_job,
+)
+
+
+class Command(BaseCommand):
+    help = 'Process queued assessment generation jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--max-jobs', type=int, default=0, help='Exit after this many jobs (0 = no limit)')
+        parser.add_argument(
+            '--stale-after', type=int, default=None,
+            help='Seconds before a running job is considered abandoned and requeued. It must exceed the longest '
+                 'generation (the single-flight lease, plus every client attempt with its rate limit wait, connect '
+                 'and read timeouts, plus retry backoff), or a job still running is generated twice. Default: that '
+                 f'sum plus a margin, currently {int(max_generation_time().total_seconds())}',
+        )
+        parser.add_argument('--max-attempts', type=int, default=3, help='Attempts allowed for an abandoned job')
+        parser.add_argument('--worker-id', default=f'{socket.gethostname()}:{os.getpid()}')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        worker_id = options['worker_id']
+        stale_after = max_generation_time()
+        if options['stale_after'] is not None:
+            if options['stale_after'] < stale_after.total_seconds():
+                self.stderr.write(f'--stale-after {options["stale_after"]} is shorter than the longest generation '
+                                  f'({int(stale_after.total_seconds())}s); slow jobs may run twice')
+            stale_after = timedelta(seconds=options['stale_after'])
+        processed = 0
+        self.stdout.write(f'Generation worker {worker_id} started')
+
+        while not self.stopping:
+            requeue_stale_jobs(stale_after, options['max_attempts'])
+            poll_message_batches()
+
+            batch = claim_next_batch()
+            if batch is not None:
+                batch = run_batch(batch, worker_id)
+                self.stdout.write(f'Batch {batch.id} {batch.status}')
+                continue
+
+            job = claim_next_job(worker_id)
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            job = run_job(job)
+            processed += 1
+            self.stdout.write(f'Job {job.id} {job.status}')
+            if options['max_jobs'] and processed >= options['max_jobs']:
+                break
+
+        self.stdout.write(f'Generation worker {worker_id} stopped after {processed} job(s)')
+
+    def _stop(self, signum, frame):
+        # finish the job in hand, then exit
+        self.stopping = True
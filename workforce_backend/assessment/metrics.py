@@ -0,0 +1,281 @@
+"""
+Per-call latency and token metering for upstream Messages API calls
+
+The clients time each call with CallTimer, which hands the finished row to
+llm_metrics, a write-behind buffer: recording never touches the database, a
+background thread bulk-inserts the rows and adds them to the running
+LLMCallTotals counters in the same transaction. render_metrics turns those
+counters into Prometheus text exposition for the /metrics endpoint, so every
+process's calls show up whichever process is scraped, at the cost of reading
+one row per label set. LLMCall rows themselves are only kept for
+LLM_METRICS_RETENTION_DAYS; prune_calls() (the prune_llm_calls command)
+deletes older ones without touching the counters.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Sequence
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from workforce_backend.timing import add_timing
+from .models import LLMCall, LLMCallTotals
+
+# histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+TTFB_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+TOKEN_FIELDS = ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens')
+# the labels LLMCallTotals keeps one row per combination of
+LABEL_FIELDS = ('model', 'kind', 'streamed', 'status_code', 'stop_reason')
+
+# LLMCall rows deleted per statement when pruning
+PRUNE_BATCH_SIZE = 5000
+
+
+class MetricsBuffer:
+    """
+    Write-behind buffer for LLMCall rows. record() appends in memory; a
+    daemon thread inserts the rows every flush_interval seconds, or sooner
+    once batch_size are waiting. If the database falls behind, the oldest
+    unsaved rows are dropped (and counted) rather than slowing callers down.
+    """
+
+    def __init__(self, flush_interval: float, batch_size: int, max_pending: int, background: bool = True):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.background = background
+        self.dropped = 0
+        self._pending = deque(maxlen=max_pending)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._flush_at_exit = False
+
+    def record(self, **fields) -> None:
+        with self._lock:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append(LLMCall(**fields))
+            full = len(self._pending) >= self.batch_size
+        if self.background:
+            self._ensure_thread()
+            if full:
+                self._wakeup.set()
+
+    def drain(self) -> List[LLMCall]:
+        """Take every pending row out of the buffer"""
+        with self._lock:
+            rows = list(self._pending)
+            self._pending.clear()
+        return rows
+
+    def flush(self) -> int:
+        """
+        Insert the pending rows now
+
+        Returns:
+            int: Rows written
+        """
+        rows = self.drain()
+        if not rows:
+            return 0
+        try:
+            with transaction.atomic():
+                LLMCall.objects.bulk_create(rows, batch_size=self.batch_size)
+                add_to_totals(rows)
+        except DatabaseError:
+            with self._lock:
+                self.dropped += len(rows)
+            return 0
+        return len(rows)
+
+    def _ensure_thread(self):
+        # started lazily, and again in a forked worker (threads do not survive fork)
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f'llm-metrics-{os.getpid()}', daemon=True)
+                self._thread.start()
+                if not self._flush_at_exit:
+                    atexit.register(self.flush)
+                    self._flush_at_exit = True
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                # the thread is idle between flushes; do not hold a connection
+                connection.close()
+
+
+llm_metrics = MetricsBuffer(
+    flush_interval=settings.LLM_METRICS_FLUSH_INTERVAL,
+    batch_size=settings.LLM_METRICS_BATCH_SIZE,
+    max_pending=settings.LLM_METRICS_MAX_PENDING,
+)
+
+
+class CallTimer:
+    """
+    Times one upstream call and records it on finish()
+
+    Usage:
+        timer = CallTimer(payload, 'assessment')
+        ... timer.first_byte() when the first byte/event arrives ...
+        timer.finish(status_code, response)
+    """
+
+    def __init__(self, payload: Dict[str, Any], kind: str, streamed: bool = False):
+        self.model = payload.get('model', '')
+        self.kind = kind
+        self.streamed = streamed
+        self.started_at = timezone.now()
+        self._start = time.perf_counter()
+        self.ttfb: Optional[float] = None
+
+    def first_byte(self, elapsed: Optional[float] = None) -> None:
+        """Mark the first byte; elapsed overrides the measured time (e.g. response.elapsed)"""
+        if self.ttfb is None:
+            self.ttfb = elapsed if elapsed is not None else time.perf_counter() - self._start
+
+    def finish(self, status_code: Optional[int], response: Optional[Dict[str, Any]] = None) -> None:
+        latency = time.perf_counter() - self._start
+        add_timing('llm', latency)
+        if not settings.LLM_METRICS_ENABLED:
+            return
+        response = response or {}
+        usage = response.get('usage') or {}
+        llm_metrics.record(
+            created_at=self.started_at,
+            model=(response.get('model') or self.model)[:100],
+            kind=self.kind,
+            streamed=self.streamed,
+            status_code=status_code,
+            stop_reason=(response.get('stop_reason') or '')[:30],
+            latency_ms=round(latency * 1000),
+            ttfb_ms=round(self.ttfb * 1000) if self.ttfb is not None else None,
+            **{field: usage.get(field) or 0 for field in TOKEN_FIELDS},
+        )
+
+
+def add_to_totals(calls: Sequence[LLMCall]) -> None:
+    """Add calls to the LLMCallTotals rows of their labels"""
+    groups = defaultdict(list)
+    for call in calls:
+        groups[tuple(getattr(call, field) or 0 if field == 'status_code' else getattr(call, field)
+                     for field in LABEL_FIELDS)].append(call)
+
+    with transaction.atomic():
+        for labels, group in groups.items():
+            totals, _ = LLMCallTotals.objects.select_for_update().get_or_create(
+                **dict(zip(LABEL_FIELDS, labels)),
+                defaults={'latency_buckets': [0] * len(LATENCY_BUCKETS), 'ttfb_buckets': [0] * len(TTFB_BUCKETS)},
+            )
+            latencies = [call.latency_ms for call in group]
+            ttfbs = [call.ttfb_ms for call in group if call.ttfb_ms is not None]
+            totals.calls += len(group)
+            totals.latency_ms += sum(latencies)
+            totals.latency_buckets = _add_to_buckets(totals.latency_buckets, LATENCY_BUCKETS, latencies)
+            totals.ttfb_calls += len(ttfbs)
+            totals.ttfb_ms += sum(ttfbs)
+            totals.ttfb_buckets = _add_to_buckets(totals.ttfb_buckets, TTFB_BUCKETS, ttfbs)
+            for field in TOKEN_FIELDS:
+                setattr(totals, field, getattr(totals, field) + sum(getattr(call, field) for call in group))
+            totals.save()
+
+
+def _add_to_buckets(counts, bounds, values_ms):
+    return [count + sum(value <= bound * 1000 for value in values_ms) for count, bound in zip(counts, bounds)]
+
+
+def prune_calls(older_than_days: Optional[int] = None) -> int:
+    """
+    Delete LLMCall rows older than older_than_days (LLM_METRICS_RETENTION_DAYS
+    by default); the counters in LLMCallTotals are unaffected
+
+    Returns:
+        int: Rows deleted
+    """
+    days = settings.LLM_METRICS_RETENTION_DAYS if older_than_days is None else older_than_days
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted = 0
+    # in batches, so the write lock is never held for long
+    while True:
+        ids = list(LLMCall.objects.filter(created_at__lt=cutoff).values_list('id', flat=True)[:PRUNE_BATCH_SIZE])
+        if not ids:
+            return deleted
+        deleted += LLMCall.objects.filter(id__in=ids).delete()[0]
+
+
+def render_metrics() -> str:
+    """Prometheus text exposition of the call counters"""
+    rows = list(LLMCallTotals.objects.all())
+    lines = []
+    _histogram(
+        lines, 'llm_request_duration_seconds', 'Upstream Messages API call latency, including retries',
+        rows, ('model', 'kind', 'status_code'), 'calls', 'latency_ms', 'latency_buckets', LATENCY_BUCKETS,
+    )
+    _histogram(
+        lines, 'llm_time_to_first_byte_seconds', 'Time to the first stream event or the response headers',
+        rows, ('model', 'kind', 'streamed'), 'ttfb_calls', 'ttfb_ms', 'ttfb_buckets', TTFB_BUCKETS,
+    )
+
+    lines += ['# HELP llm_tokens_total Tokens used by upstream calls', '# TYPE llm_tokens_total counter']
+    for (model, kind), group in _group(rows, ('model', 'kind')):
+        for field in TOKEN_FIELDS:
+            labels = _labels(model=model, kind=kind, type=field[:-len('_tokens')])
+            lines.append(f"llm_tokens_total{labels} {sum(getattr(row, field) for row in group)}")
+
+    lines += ['# HELP llm_stop_reasons_total Finished calls by stop reason', '# TYPE llm_stop_reasons_total counter']
+    for (model, stop_reason), group in _group([row for row in rows if row.stop_reason], ('model', 'stop_reason')):
+        lines.append(f"llm_stop_reasons_total{_labels(model=model, stop_reason=stop_reason)} "
+                     f"{sum(row.calls for row in group)}")
+
+    lines += [
+        '# HELP llm_metrics_dropped_total Call records this process dropped before they were stored',
+        '# TYPE llm_metrics_dropped_total counter',
+        f'llm_metrics_dropped_total {llm_metrics.dropped}',
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def _group(rows, label_fields):
+    groups = defaultdict(list)
+    for row in rows:
+        groups[tuple(getattr(row, label) for label in label_fields)].append(row)
+    return sorted(groups.items(), key=lambda item: [str(value) for value in item[0]])
+
+
+def _histogram(lines, name, help_text, rows, label_fields, count_field, sum_field, buckets_field, bounds):
+    lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for values, group in _group(rows, label_fields):
+        count = sum(getattr(row, count_field) for row in group)
+        if not count:
+            continue
+        labels = dict(zip(label_fields, values))
+        if labels.get('status_code') == 0:
+            labels['status_code'] = None  # no response arrived
+        for index, bound in enumerate(bounds):
+            in_bucket = sum(getattr(row, buckets_field)[index] for row in group)
+            lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {in_bucket}")
+        lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {count}")
+        lines.append(f"{name}_sum{_labels(**labels)} {sum(getattr(row, sum_field) for row in group) / 1000}")
+        lines.append(f"{name}_count{_labels(**labels)} {count}")
+
+
+def _labels(**labels):
+    def escape(value):
+        if value is None:
+            return 'none'
+        if isinstance(value, bool):
+            return str(value).lower()
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels.items()) + '}'
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0006_generationcacheentry_generationjob_regenerate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationthread',
+            name='summary',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='conversationthread',
+            name='summary_last_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0007_conversationthread_summary_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assessment',
+            name='usage',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='usage',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0008_assessment_usage_message_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mode', models.CharField(choices=[('concurrent', 'Concurrent requests'), ('message_batches', 'Message Batches API')], default='concurrent', max_length=20)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('submitted', 'Submitted'), ('completed', 'Completed')], default='queued', max_length=10)),
+                ('concurrency', models.IntegerField(default=8)),
+                ('regenerate', models.BooleanField(default=False)),
+                ('provider_batch_id', models.CharField(blank=True, max_length=255)),
+                ('polled_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='assessment.generationbatch'),
+        ),
+    ]
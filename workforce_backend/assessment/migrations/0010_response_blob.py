@@ -0,0 +1,104 @@
+# Generated by Django 5.1.7 on 2026-10-18 15:03
+
+import hashlib
+import json
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+META_FIELDS = ('id', 'model', 'stop_reason')
+
+
+def move_responses_to_blobs(apps, schema_editor):
+    ResponseBlob = apps.get_model('assessment', 'ResponseBlob')
+    blob_ids = {}
+    for model_name in ('Assessment', 'Message'):
+        model = apps.get_model('assessment', model_name)
+        for row in model.objects.only('id', 'raw_response').iterator():
+            response = row.raw_response
+            if not response:
+                continue
+            raw = json.dumps(response, sort_keys=True, separators=(',', ':')).encode('utf-8')
+            digest = hashlib.sha256(raw).hexdigest()
+            if digest not in blob_ids:
+                blob, _ = ResponseBlob.objects.get_or_create(
+                    digest=digest, defaults={'data': zlib.compress(raw, 6), 'size': len(raw)}
+                )
+                blob_ids[digest] = blob.id
+            model.objects.filter(id=row.id).update(
+                response_blob_id=blob_ids[digest],
+                response_meta={field: response[field] for field in META_FIELDS if field in response},
+            )
+
+
+def restore_raw_responses(apps, schema_editor):
+    ResponseBlob = apps.get_model('assessment', 'ResponseBlob')
+    for model_name in ('Assessment', 'Message'):
+        model = apps.get_model('assessment', model_name)
+        for row in model.objects.only('id', 'response_blob_id').iterator():
+            response = {}
+            if row.response_blob_id:
+                blob = ResponseBlob.objects.get(id=row.response_blob_id)
+                response = json.loads(zlib.decompress(bytes(blob.data)))
+            model.objects.filter(id=row.id).update(raw_response=response)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0009_generationbatch_generationjob_batch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResponseBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('data', models.BinaryField()),
+                ('size', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='assessment',
+            name='response_meta',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='response_meta',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='assessment',
+            name='response_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='assessment.responseblob'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='response_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='assessment.responseblob'),
+        ),
+        # raw_response becomes nullable first so the reverse migration can add it back and refill it
+        migrations.AlterField(
+            model_name='assessment',
+            name='raw_response',
+            field=models.JSONField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='raw_response',
+            field=models.JSONField(null=True),
+        ),
+        migrations.RunPython(move_responses_to_blobs, restore_raw_responses),
+        migrations.RemoveField(
+            model_name='assessment',
+            name='raw_response',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='raw_response',
+        ),
+    ]
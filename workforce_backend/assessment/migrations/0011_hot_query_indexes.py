@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0010_response_blob'),
+        ('users', '0002_user_token_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='assessment',
+            index=models.Index(fields=['-created_at', '-id'], name='assessment_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'time_stamp', 'id'], name='message_conversation_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['-time_stamp', '-id'], name='message_time_stamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prompt',
+            index=models.Index(fields=['-created_at', '-id'], name='prompt_created_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-18 15:17
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0012_generationlock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMCall',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('model', models.CharField(max_length=100)),
+                ('kind', models.CharField(max_length=20)),
+                ('streamed', models.BooleanField(default=False)),
+                ('status_code', models.SmallIntegerField(blank=True, null=True)),
+                ('stop_reason', models.CharField(blank=True, max_length=30)),
+                ('latency_ms', models.PositiveIntegerField()),
+                ('ttfb_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('input_tokens', models.PositiveIntegerField(default=0)),
+                ('output_tokens', models.PositiveIntegerField(default=0)),
+                ('cache_creation_input_tokens', models.PositiveIntegerField(default=0)),
+                ('cache_read_input_tokens', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 15:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0013_llmcall'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Question',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField()),
+                ('question_type', models.CharField(choices=[('multiple_choice', 'Multiple choice'), ('situational', 'Situational judgment'), ('open_ended', 'Open-ended'), ('coding', 'Coding challenge')], max_length=20)),
+                ('dimension', models.CharField(choices=[('performance', 'Performance'), ('behavioral', 'Behavioral'), ('cultural_fit', 'Cultural fit')], max_length=20)),
+                ('title', models.CharField(blank=True, max_length=255)),
+                ('text', models.TextField()),
+                ('options', models.JSONField(blank=True, default=list)),
+                ('rubric', models.TextField()),
+                ('time_minutes', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('assessment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='questions', to='assessment.assessment')),
+            ],
+            options={
+                'ordering': ['assessment', 'position'],
+                'constraints': [models.UniqueConstraint(fields=('assessment', 'position'), name='question_position_unique')],
+            },
+        ),
+    ]
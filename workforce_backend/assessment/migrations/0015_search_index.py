@@ -0,0 +1,105 @@
+from django.db import migrations
+
+# External-content FTS5 tables kept in sync by triggers; 'rebuild' indexes
+# the rows that already exist. assessment.search.repair_search_index()
+# recreates these triggers after later migrations rebuild a table.
+SQLITE_FORWARD = [
+    # assessment_assessment
+    "CREATE VIRTUAL TABLE assessment_assessment_fts USING fts5(title, content, "
+    "content='assessment_assessment', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER assessment_assessment_fts_insert AFTER INSERT ON assessment_assessment BEGIN "
+    "INSERT INTO assessment_assessment_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+    "CREATE TRIGGER assessment_assessment_fts_delete AFTER DELETE ON assessment_assessment BEGIN "
+    "INSERT INTO assessment_assessment_fts(assessment_assessment_fts, rowid, title, content) "
+    "VALUES ('delete', old.id, old.title, old.content); END",
+    "CREATE TRIGGER assessment_assessment_fts_update AFTER UPDATE OF title, content ON assessment_assessment BEGIN "
+    "INSERT INTO assessment_assessment_fts(assessment_assessment_fts, rowid, title, content) "
+    "VALUES ('delete', old.id, old.title, old.content); "
+    "INSERT INTO assessment_assessment_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+    "INSERT INTO assessment_assessment_fts(assessment_assessment_fts) VALUES ('rebuild')",
+    # assessment_prompt
+    "CREATE VIRTUAL TABLE assessment_prompt_fts USING fts5(prompt_text, "
+    "content='assessment_prompt', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER assessment_prompt_fts_insert AFTER INSERT ON assessment_prompt BEGIN "
+    "INSERT INTO assessment_prompt_fts(rowid, prompt_text) VALUES (new.id, new.prompt_text); END",
+    "CREATE TRIGGER assessment_prompt_fts_delete AFTER DELETE ON assessment_prompt BEGIN "
+    "INSERT INTO assessment_prompt_fts(assessment_prompt_fts, rowid, prompt_text) "
+    "VALUES ('delete', old.id, old.prompt_text); END",
+    "CREATE TRIGGER assessment_prompt_fts_update AFTER UPDATE OF prompt_text ON assessment_prompt BEGIN "
+    "INSERT INTO assessment_prompt_fts(assessment_prompt_fts, rowid, prompt_text) "
+    "VALUES ('delete', old.id, old.prompt_text); "
+    "INSERT INTO assessment_prompt_fts(rowid, prompt_text) VALUES (new.id, new.prompt_text); END",
+    "INSERT INTO assessment_prompt_fts(assessment_prompt_fts) VALUES ('rebuild')",
+    # assessment_question
+    "CREATE VIRTUAL TABLE assessment_question_fts USING fts5(title, text, "
+    "content='assessment_question', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER assessment_question_fts_insert AFTER INSERT ON assessment_question BEGIN "
+    "INSERT INTO assessment_question_fts(rowid, title, text) VALUES (new.id, new.title, new.text); END",
+    "CREATE TRIGGER assessment_question_fts_delete AFTER DELETE ON assessment_question BEGIN "
+    "INSERT INTO assessment_question_fts(assessment_question_fts, rowid, title, text) "
+    "VALUES ('delete', old.id, old.title, old.text); END",
+    "CREATE TRIGGER assessment_question_fts_update AFTER UPDATE OF title, text ON assessment_question BEGIN "
+    "INSERT INTO assessment_question_fts(assessment_question_fts, rowid, title, text) "
+    "VALUES ('delete', old.id, old.title, old.text); "
+    "INSERT INTO assessment_question_fts(rowid, title, text) VALUES (new.id, new.title, new.text); END",
+    "INSERT INTO assessment_question_fts(assessment_question_fts) VALUES ('rebuild')",
+    # assessment_message
+    "CREATE VIRTUAL TABLE assessment_message_fts USING fts5(content, "
+    "content='assessment_message', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER assessment_message_fts_insert AFTER INSERT ON assessment_message BEGIN "
+    "INSERT INTO assessment_message_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER assessment_message_fts_delete AFTER DELETE ON assessment_message BEGIN "
+    "INSERT INTO assessment_message_fts(assessment_message_fts, rowid, content) "
+    "VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER assessment_message_fts_update AFTER UPDATE OF content ON assessment_message BEGIN "
+    "INSERT INTO assessment_message_fts(assessment_message_fts, rowid, content) "
+    "VALUES ('delete', old.id, old.content); "
+    "INSERT INTO assessment_message_fts(rowid, content) VALUES (new.id, new.content); END",
+    "INSERT INTO assessment_message_fts(assessment_message_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    f"DROP {kind} IF EXISTS {table}_fts{suffix}"
+    for table in ('assessment_assessment', 'assessment_prompt', 'assessment_question', 'assessment_message')
+    for kind, suffix in (('TRIGGER', '_insert'), ('TRIGGER', '_update'), ('TRIGGER', '_delete'), ('TABLE', ''))
+]
+
+# GIN indexes on the weighted tsvector expressions search.py queries with
+POSTGRESQL_FORWARD = [
+    "CREATE INDEX assessment_assessment_search_idx ON assessment_assessment USING GIN (("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(content, '')), 'B')))",
+    "CREATE INDEX assessment_prompt_search_idx ON assessment_prompt USING GIN (("
+    "setweight(to_tsvector('english', coalesce(prompt_text, '')), 'A')))",
+    "CREATE INDEX assessment_question_search_idx ON assessment_question USING GIN (("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(text, '')), 'B')))",
+    "CREATE INDEX assessment_message_search_idx ON assessment_message USING GIN (("
+    "setweight(to_tsvector('english', coalesce(content, '')), 'A')))",
+]
+
+POSTGRESQL_REVERSE = [
+    f"DROP INDEX IF EXISTS {table}_search_idx"
+    for table in ('assessment_assessment', 'assessment_prompt', 'assessment_question', 'assessment_message')
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement, params=None)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0014_question'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRESQL_FORWARD}),
+            run({'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRESQL_REVERSE}),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.7 on 2026-10-18 15:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0015_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BankedQuestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(max_length=255)),
+                ('area', models.CharField(blank=True, max_length=255)),
+                ('skills', models.JSONField(blank=True, default=list)),
+                ('difficulty', models.CharField(choices=[('easy', 'Easy'), ('medium', 'Medium'), ('hard', 'Hard')], max_length=10)),
+                ('question_type', models.CharField(blank=True, choices=[('multiple_choice', 'Multiple choice'), ('situational', 'Situational judgment'), ('open_ended', 'Open-ended'), ('coding', 'Coding challenge')], max_length=20)),
+                ('content', models.TextField()),
+                ('signature', models.BinaryField()),
+                ('reuse_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('question', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='bank_entries', to='assessment.question')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BankedQuestionBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField(db_index=True)),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bands', to='assessment.bankedquestion')),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_updated_at(apps, schema_editor):
+    Assessment = apps.get_model('assessment', 'Assessment')
+    Assessment.objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0016_question_bank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assessment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        # existing assessments have not changed since they were generated
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:10
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+# assessment.metrics bucket bounds in seconds, as of this migration
+LATENCY_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+TTFB_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_FIELDS = ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens')
+
+
+def backfill_totals(apps, schema_editor):
+    """Count the calls recorded so far, so the counters carry on from them"""
+    LLMCall = apps.get_model('assessment', 'LLMCall')
+    LLMCallTotals = apps.get_model('assessment', 'LLMCallTotals')
+
+    def buckets(field, bounds):
+        return {f'{field}_le_{index}': Count('id', filter=Q(**{f'{field}__lte': bound * 1000}))
+                for index, bound in enumerate(bounds)}
+
+    rows = LLMCall.objects.values('model', 'kind', 'streamed', 'status_code', 'stop_reason').annotate(
+        calls=Count('id'),
+        latency_sum=Sum('latency_ms'),
+        ttfb_calls=Count('ttfb_ms'),
+        ttfb_sum=Sum('ttfb_ms'),
+        **{f'{field}_sum': Sum(field) for field in TOKEN_FIELDS},
+        **buckets('latency_ms', LATENCY_BUCKETS),
+        **buckets('ttfb_ms', TTFB_BUCKETS),
+    ).order_by()
+    LLMCallTotals.objects.bulk_create([
+        LLMCallTotals(
+            model=row['model'], kind=row['kind'], streamed=row['streamed'], status_code=row['status_code'] or 0,
+            stop_reason=row['stop_reason'], calls=row['calls'], latency_ms=row['latency_sum'] or 0,
+            latency_buckets=[row[f'latency_ms_le_{index}'] for index in range(len(LATENCY_BUCKETS))],
+            ttfb_calls=row['ttfb_calls'], ttfb_ms=row['ttfb_sum'] or 0,
+            ttfb_buckets=[row[f'ttfb_ms_le_{index}'] for index in range(len(TTFB_BUCKETS))],
+            **{field: row[f'{field}_sum'] or 0 for field in TOKEN_FIELDS},
+        )
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assessment', '0017_assessment_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMCallTotals',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('kind', models.CharField(max_length=20)),
+                ('streamed', models.BooleanField(default=False)),
+                ('status_code', models.SmallIntegerField(default=0)),
+                ('stop_reason', models.CharField(blank=True, max_length=30)),
+                ('calls', models.PositiveBigIntegerField(default=0)),
+                ('latency_ms', models.PositiveBigIntegerField(default=0)),
+                ('latency_buckets', models.JSONField(default=list)),
+                ('ttfb_calls', models.PositiveBigIntegerField(default=0)),
+                ('ttfb_ms', models.PositiveBigIntegerField(default=0)),
+                ('ttfb_buckets', models.JSONField(default=list)),
+                ('input_tokens', models.PositiveBigIntegerField(default=0)),
+                ('output_tokens', models.PositiveBigIntegerField(default=0)),
+                ('cache_creation_input_tokens', models.PositiveBigIntegerField(default=0)),
+                ('cache_read_input_tokens', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('model', 'kind', 'streamed', 'status_code', 'stop_reason'), name='llmcalltotals_labels_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,105 @@
+import hashlib
+from functools import wraps
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+
+class SparseFieldsetMixin:
+    """
+    Supports ?fields=id,title,... on read requests: the serializer renders only
+    those fields and the queryset loads only the matching columns. list_fields
+    is the default projection for list views, so heavy columns are left out
+    unless a client asks for them. field_relations maps serializer fields that
+    are not columns to the relation they read, which is then prefetched.
+    Unknown field names are a 400, so a typo never falls back to every field.
+    """
+    list_fields = None
+    field_relations = {'raw_response': 'response_blob'}
+
+    def get_requested_fields(self):
+        if self.request is None or self.request.method not in SAFE_METHODS:
+            return None
+        allowed = self.get_serializer_class().Meta.fields
+        fields = [field.strip() for field in self.request.query_params.get('fields', '').split(',') if field.strip()]
+        if fields:
+            unknown = [field for field in fields if field not in allowed]
+            if unknown:
+                raise ValidationError({'error': f"Unknown field: {', '.join(unknown)}; use {', '.join(allowed)}"})
+            return fields
+        if self.action == 'list':
+            return self.list_fields
+        return None
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_requested_fields()
+        if fields is None:
+            return queryset
+
+        model_fields = {field.name for field in queryset.model._meta.concrete_fields}
+        columns = {queryset.model._meta.pk.name}
+        # ordering columns are needed for the pagination cursor
+        columns.update(name.lstrip('-') for name in queryset.query.order_by)
+        columns.update(field for field in fields if field in model_fields)
+        relations = [self.field_relations[field] for field in fields if field in self.field_relations]
+        if relations:
+            columns.update(relations)
+            queryset = queryset.prefetch_related(*relations)
+        return queryset.only(*columns)
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+
+
+def conditional(version):
+    """
+    ETag / Last-Modified support for a read-only viewset method
+
+    version(view, request, *args, **kwargs) returns (tag, last_modified) from a
+    lookup that does not load the object, or None when there is nothing to
+    compare (e.g. the object does not exist; the view then answers as usual).
+    A request whose If-None-Match or If-Modified-Since still matches gets a
+    304 without running the view. The ETag also covers the query string, so
+    ?fields= projections are versioned separately.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            current = version(self, request, *args, **kwargs) if request.method in ('GET', 'HEAD') else None
+            if current is None:
+                return method(self, request, *args, **kwargs)
+
+            tag, last_modified = current
+            variant = hashlib.sha1(f"{tag}?{request.META.get('QUERY_STRING', '')}".encode()).hexdigest()[:20]
+            etag = f'W/"{variant}"'
+            timestamp = int(last_modified.timestamp()) if last_modified else None
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is None:
+                response = method(self, request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response['ETag'] = etag
+                if timestamp is not None:
+                    response['Last-Modified'] = http_date(timestamp)
+                # clients may keep the body but must revalidate before using it
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def updated_at_version(model):
+    """A conditional() version of the model row named by the pk URL kwarg, from its updated_at"""
+    def version(view, request, pk=None, **kwargs):
+        try:
+            updated_at = model.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+        except (TypeError, ValueError):
+            return None
+        if updated_at is None:
+            return None
+        return f"{model._meta.model_name}:{pk}:{updated_at.isoformat()}", updated_at
+    return version
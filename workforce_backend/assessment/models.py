@@ -1,6 +1,106 @@
-from django.db import models
+import hashlib
+import json
+import zlib
+from datetime import timedelta
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
 from users.models import Company
 
+
+class ResponseBlob(models.Model):
+    """
+    Content-addressed, zlib-compressed store for raw API responses. The same
+    response referenced from an Assessment and its assistant Message is
+    stored once. References are PROTECTed, so blobs outlive the rows that
+    used them; prune_unreferenced() (the prune_response_blobs command)
+    removes the ones nothing refers to any more.
+    """
+    digest = models.CharField(max_length=64, unique=True) #sha256 of the canonical JSON
+    data = models.BinaryField()
+    size = models.IntegerField() #uncompressed bytes
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def store(cls, response):
+        raw = json.dumps(response, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(raw).hexdigest()
+        blob = cls.objects.filter(digest=digest).only('id', 'digest').first()
+        if blob is not None:
+            return blob
+        try:
+            with transaction.atomic():
+                return cls.objects.create(digest=digest, data=zlib.compress(raw, 6), size=len(raw))
+        except IntegrityError:
+            # stored concurrently by another request
+            return cls.objects.only('id', 'digest').get(digest=digest)
+
+    def load(self):
+        return json.loads(zlib.decompress(bytes(self.data)))
+
+    @classmethod
+    def prune_unreferenced(cls, min_age=timedelta(hours=1), batch_size=1000):
+        """
+        Delete blobs no Assessment or Message refers to. Blobs younger than
+        min_age are kept, since store() returns a blob before the row that
+        references it is saved.
+
+        Returns:
+            int: Blobs deleted
+        """
+        unreferenced = cls.objects.filter(created_at__lt=timezone.now() - min_age).exclude(
+            id__in=Assessment.objects.filter(response_blob__isnull=False).values('response_blob')
+        ).exclude(
+            id__in=Message.objects.filter(response_blob__isnull=False).values('response_blob')
+        )
+        deleted = 0
+        # in batches, so the write lock is never held for long
+        while True:
+            ids = list(unreferenced.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            deleted += unreferenced.filter(id__in=ids).delete()[0]
+
+    def __str__(self):
+        return self.digest
+
+
+class StoredResponseMixin(models.Model):
+    """
+    Keeps only id/model/stop_reason of the raw API response inline; the full
+    payload lives in a ResponseBlob and is loaded on first access to
+    raw_response. Assigning raw_response (also as a create() kwarg) stores the
+    blob on save.
+    """
+    response_blob = models.ForeignKey(ResponseBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    response_meta = models.JSONField(default=dict, blank=True) #id, model and stop_reason of the raw response
+
+    META_FIELDS = ('id', 'model', 'stop_reason')
+
+    class Meta:
+        abstract = True
+
+    @property
+    def raw_response(self):
+        if not hasattr(self, '_raw_response'):
+            self._raw_response = self.response_blob.load() if self.response_blob_id else {}
+        return self._raw_response
+
+    @raw_response.setter
+    def raw_response(self, response):
+        self._raw_response = response or {}
+        self._raw_response_dirty = True
+        self.response_meta = {field: response[field] for field in self.META_FIELDS if response and field in response}
+
+    def prepare_response_blob(self):
+        """Store a newly assigned raw_response; save() calls this, bulk_create callers must"""
+        if getattr(self, '_raw_response_dirty', False):
+            self.response_blob = ResponseBlob.store(self._raw_response) if self._raw_response else None
+            self._raw_response_dirty = False
+
+    def save(self, *args, **kwargs):
+        self.prepare_response_blob()
+        super().save(*args, **kwargs)
+
 class Prompt(models.Model):
     DIFFICULTY_CHOICES = [
         ('easy', 'Easy'),
@@ -23,30 +123,115 @@ class Prompt(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # PromptViewSet lists newest first with a (created_at, id) cursor
+            models.Index(fields=['-created_at', '-id'], name='prompt_created_idx'),
+        ]
+
     def __str__(self):
         return self.prompt_text
     
 
-class Assessment(models.Model):
+class Assessment(StoredResponseMixin):
     prompt = models.ForeignKey(Prompt, on_delete=models.CASCADE, related_name='assessments')
     title = models.CharField(max_length=255)
     content = models.TextField() #stores the formatted assessment
-    raw_response = models.JSONField() #stores the raw response from the API
+    usage = models.JSONField(default=dict, blank=True) #token counts, including prompt-cache reads/writes
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True) #version for conditional GETs; bump it in update() calls
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='assessment_created_idx'),
+        ]
 
     def __str__(self):
         return self.title
-    
+
+class Question(models.Model):
+    """
+    One question of a generated assessment, stored from the structured
+    generation output so clients can fetch questions without the whole
+    assessment text
+    """
+    TYPE_MULTIPLE_CHOICE = 'multiple_choice'
+    TYPE_SITUATIONAL = 'situational'
+    TYPE_OPEN_ENDED = 'open_ended'
+    TYPE_CODING = 'coding'
+    TYPE_CHOICES = [
+        (TYPE_MULTIPLE_CHOICE, 'Multiple choice'),
+        (TYPE_SITUATIONAL, 'Situational judgment'),
+        (TYPE_OPEN_ENDED, 'Open-ended'),
+        (TYPE_CODING, 'Coding challenge'),
+    ]
+    DIMENSION_CHOICES = [
+        ('performance', 'Performance'),
+        ('behavioral', 'Behavioral'),
+        ('cultural_fit', 'Cultural fit'),
+    ]
+    assessment = models.ForeignKey(Assessment, on_delete=models.CASCADE, related_name='questions')
+    position = models.PositiveSmallIntegerField() #1-based order within the assessment
+    question_type = models.CharField(max_length=20, choices=TYPE_CHOICES)
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    title = models.CharField(max_length=255, blank=True)
+    text = models.TextField() #scenario, question and instructions shown to the candidate
+    options = models.JSONField(default=list, blank=True) #answer options of multiple-choice and situational questions
+    rubric = models.TextField() #hidden from the candidate: answer key and evaluation criteria
+    time_minutes = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['assessment', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['assessment', 'position'], name='question_position_unique'),
+        ]
+
+    def __str__(self):
+        return f"Question {self.position} of {self.assessment}"
+
+class BankedQuestion(models.Model):
+    """
+    A generated question in the reusable question bank, with the MinHash
+    signature of the request it answered (see question_bank.py)
+    """
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, null=True, blank=True,
+                                 related_name='bank_entries') #set for questions of generated assessments
+    role = models.CharField(max_length=255)
+    area = models.CharField(max_length=255, blank=True) #assessment area, or the question title
+    skills = models.JSONField(default=list, blank=True)
+    difficulty = models.CharField(max_length=10, choices=Prompt.DIFFICULTY_CHOICES)
+    question_type = models.CharField(max_length=20, choices=Question.TYPE_CHOICES, blank=True) #blank if unknown
+    content = models.TextField() #the question as shown to the hiring manager
+    signature = models.BinaryField() #MinHash of role, area and skills, packed unsigned 32-bit values
+    reuse_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Banked question for {self.role}: {self.area}"
+
+class BankedQuestionBand(models.Model):
+    """
+    Locality-sensitive hashing bucket: entries sharing a band key have
+    identical signature values in that band and are lookup candidates
+    """
+    entry = models.ForeignKey(BankedQuestion, on_delete=models.CASCADE, related_name='bands')
+    key = models.BigIntegerField(db_index=True) #hash of the band number and its signature values
+
+    def __str__(self):
+        return f"Band {self.key} of {self.entry_id}"
+
 class ConversationThread(models.Model):
     title = models.CharField(max_length=255)
     assessment = models.ForeignKey(Assessment, on_delete=models.CASCADE, related_name='conversation_threads')
+    summary = models.TextField(blank=True) #rolling summary of turns that no longer fit the context window
+    summary_last_message_id = models.BigIntegerField(null=True, blank=True) #last message folded into the summary
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.title
 
-class Message(models.Model):
+class Message(StoredResponseMixin):
     MESSAGE_TYPES = [
         ('user', 'User'),
         ('assistant', 'Assistant'),
@@ -54,8 +239,164 @@ class Message(models.Model):
     conversation = models.ForeignKey(ConversationThread, on_delete=models.CASCADE, related_name='messages')
     message_type = models.CharField(max_length=10, choices=MESSAGE_TYPES)
     content = models.TextField()
-    raw_response = models.JSONField() #stores the raw response from the API
+    usage = models.JSONField(default=dict, blank=True) #token counts, including prompt-cache reads/writes
     time_stamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # a conversation's messages in order, and its latest message
+            models.Index(fields=['conversation', 'time_stamp', 'id'], name='message_conversation_idx'),
+            # MessageViewSet's (time_stamp, id) cursor
+            models.Index(fields=['-time_stamp', '-id'], name='message_time_stamp_idx'),
+        ]
+
     def __str__(self):
         return f"{self.message_type} message in {self.conversation}"
+
+class GenerationBatch(models.Model):
+    MODE_CONCURRENT = 'concurrent'
+    MODE_MESSAGE_BATCHES = 'message_batches'
+    MODE_CHOICES = [
+        (MODE_CONCURRENT, 'Concurrent requests'),
+        (MODE_MESSAGE_BATCHES, 'Message Batches API'),
+    ]
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUBMITTED = 'submitted'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUBMITTED, 'Submitted'),
+        (STATUS_COMPLETED, 'Completed'),
+    ]
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES, default=MODE_CONCURRENT)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    concurrency = models.IntegerField(default=8) #max generations in flight at once
+    regenerate = models.BooleanField(default=False)
+    provider_batch_id = models.CharField(max_length=255, blank=True) #Message Batches API id
+    polled_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Generation batch {self.id} ({self.status})"
+
+class GenerationJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    prompt = models.ForeignKey(Prompt, on_delete=models.CASCADE, related_name='generation_jobs')
+    batch = models.ForeignKey(GenerationBatch, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    assessment = models.ForeignKey(Assessment, on_delete=models.SET_NULL, null=True, blank=True, related_name='generation_jobs')
+    result = models.JSONField(default=dict, blank=True) #stores the service result once finished
+    error = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=255, blank=True) #id of the worker that claimed the job
+    regenerate = models.BooleanField(default=False) #bypass the generation cache
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # workers claim the oldest queued job first
+            models.Index(fields=['status', 'created_at'], name='generationjob_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"Generation job {self.id} ({self.status})"
+
+class GenerationCacheEntry(models.Model):
+    KIND_CHOICES = [
+        ('assessment', 'Assessment'),
+        ('question', 'Single question'),
+    ]
+    key = models.CharField(max_length=64, unique=True) #sha256 of model, normalized prompt and sampling params
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    model = models.CharField(max_length=100)
+    response = models.JSONField() #the API response served on a hit
+    hit_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.kind} cache entry {self.key[:12]}"
+
+class GenerationLock(models.Model):
+    """
+    Cross-process single-flight row: whoever inserts the key runs the
+    generation, everyone else waits for its result here
+    """
+    key = models.CharField(max_length=100, unique=True) #prompt id and payload hash
+    owner = models.CharField(max_length=255) #host:pid:thread of the running generation
+    result = models.JSONField(null=True, blank=True) #the service result once finished
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True) #lease while running, result grace period once finished
+
+    def __str__(self):
+        return f"Generation lock {self.key}"
+
+class LLMCall(models.Model):
+    """
+    One upstream Messages API call, written through assessment.metrics and
+    counted in LLMCallTotals; kept for LLM_METRICS_RETENTION_DAYS (see the
+    prune_llm_calls command)
+    """
+    created_at = models.DateTimeField(default=timezone.now, db_index=True) #when the call started
+    model = models.CharField(max_length=100)
+    kind = models.CharField(max_length=20) #assessment, question, conversation or summary
+    streamed = models.BooleanField(default=False)
+    status_code = models.SmallIntegerField(null=True, blank=True) #null if no response arrived
+    stop_reason = models.CharField(max_length=30, blank=True)
+    latency_ms = models.PositiveIntegerField() #whole call, including retries and rate limit waits
+    ttfb_ms = models.PositiveIntegerField(null=True, blank=True) #until the first event (streams) or the response headers
+    input_tokens = models.PositiveIntegerField(default=0)
+    output_tokens = models.PositiveIntegerField(default=0)
+    cache_creation_input_tokens = models.PositiveIntegerField(default=0)
+    cache_read_input_tokens = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.kind} call to {self.model} ({self.latency_ms} ms)"
+
+class LLMCallTotals(models.Model):
+    """
+    Running totals of the LLMCall rows with one set of labels, added to by
+    assessment.metrics as it stores calls. The /metrics endpoint renders these
+    few rows rather than scanning LLMCall, so old calls can be pruned without
+    resetting the counters.
+    """
+    model = models.CharField(max_length=100)
+    kind = models.CharField(max_length=20)
+    streamed = models.BooleanField(default=False)
+    status_code = models.SmallIntegerField(default=0) #0 if no response arrived
+    stop_reason = models.CharField(max_length=30, blank=True)
+    calls = models.PositiveBigIntegerField(default=0)
+    latency_ms = models.PositiveBigIntegerField(default=0) #sum over the calls
+    latency_buckets = models.JSONField(default=list) #calls at or under each metrics.LATENCY_BUCKETS bound
+    ttfb_calls = models.PositiveBigIntegerField(default=0) #calls with a time to first byte
+    ttfb_ms = models.PositiveBigIntegerField(default=0)
+    ttfb_buckets = models.JSONField(default=list) #calls at or under each metrics.TTFB_BUCKETS bound
+    input_tokens = models.PositiveBigIntegerField(default=0)
+    output_tokens = models.PositiveBigIntegerField(default=0)
+    cache_creation_input_tokens = models.PositiveBigIntegerField(default=0)
+    cache_read_input_tokens = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'kind', 'streamed', 'status_code', 'stop_reason'],
+                                    name='llmcalltotals_labels_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.calls} {self.kind} calls to {self.model}"
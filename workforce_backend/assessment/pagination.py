@@ -0,0 +1,22 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Keyset pagination on (created_at, id): each page is an indexed range scan
+    however deep the client pages, unlike OFFSET pagination
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class MessageCursorPagination(CreatedAtCursorPagination):
+    ordering = ('-time_stamp', '-id')
+
+
+class QuestionCursorPagination(CreatedAtCursorPagination):
+    # the unique (assessment, position) index serves the ordering; the cursor
+    # position is read from the instance, so use the column, not the relation
+    ordering = ('assessment_id', 'position')
@@ -0,0 +1,200 @@
+"""
+Reusable question bank
+
+Every generated question is banked with a MinHash signature of the request
+it answered: the words and word pairs of its role, area and skills. A new
+single-question request is hashed the same way and looked up before the
+API is called; banked questions of the same difficulty and type whose
+estimated Jaccard similarity reaches QUESTION_BANK_THRESHOLD are offered
+instead of a fresh generation.
+
+Signatures are NUM_PERM unsigned 32-bit values packed into a binary column.
+Lookups use locality-sensitive hashing: the signature is cut into BANDS
+bands and each band's hash is stored in an indexed table, so only entries
+sharing at least one band with the request are read and compared. With 16
+bands of 4 values a pair at similarity 0.6 shares a band 89% of the time;
+one at 0.3 only 12%.
+"""
+import hashlib
+import random
+import re
+import struct
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from .models import BankedQuestion, BankedQuestionBand, Prompt, Question
+from .structured import render_question
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+# entries sharing a band with the request read per lookup, newest first
+MAX_LSH_CANDIDATES = 200
+
+_PRIME = (1 << 61) - 1
+_MAX_HASH = 0xFFFFFFFF
+# fixed seed: stored signatures stay comparable across processes and releases
+_rng = random.Random(0x5EED)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_PACKED = struct.Struct(f'<{NUM_PERM}I')
+
+STOP_WORDS = {
+    'a', 'an', 'and', 'at', 'for', 'in', 'of', 'on', 'or', 'the', 'to', 'with',
+    'question', 'questions', 'senior', 'junior', 'level',
+}
+
+
+def features(role: str, area: str, skills: Iterable[str]) -> set:
+    """Words and adjacent word pairs of the role, area and each skill"""
+    shingles = set()
+    for text in [role, area, *skills]:
+        words = [word for word in re.findall(r'\w+', str(text or '').lower()) if word not in STOP_WORDS]
+        # crude plural folding, so "API" and "APIs" match
+        words = [word[:-1] if len(word) > 3 and word.endswith('s') else word for word in words]
+        shingles.update(words)
+        shingles.update(f'{first} {second}' for first, second in zip(words, words[1:]))
+    return shingles
+
+
+def signature(role: str, area: str, skills: Iterable[str]) -> List[int]:
+    """MinHash signature of features(role, area, skills)"""
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for shingle in features(role, area, skills)
+    ]
+    if not hashes:
+        return [_MAX_HASH] * NUM_PERM
+    return [min(((a * value + b) % _PRIME) & _MAX_HASH for value in hashes) for a, b in _PERMUTATIONS]
+
+
+def similarity(first: Sequence[int], second: Sequence[int]) -> float:
+    """Estimated Jaccard similarity of the feature sets behind two signatures"""
+    return sum(x == y for x, y in zip(first, second)) / NUM_PERM
+
+
+def band_keys(values: Sequence[int]) -> List[int]:
+    keys = []
+    for band in range(BANDS):
+        rows = struct.pack(f'<H{ROWS}I', band, *values[band * ROWS:(band + 1) * ROWS])
+        keys.append(int.from_bytes(hashlib.blake2b(rows, digest_size=8).digest(), 'big', signed=True))
+    return keys
+
+
+def pack(values: Sequence[int]) -> bytes:
+    return _PACKED.pack(*values)
+
+
+def unpack(data: bytes) -> Tuple[int, ...]:
+    return _PACKED.unpack(bytes(data))
+
+
+def normalize_difficulty(value: Any) -> str:
+    """A Prompt.DIFFICULTY_CHOICES value; unknown or missing is medium"""
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else None
+    value = str(value or '').strip().lower()
+    return value if value in dict(Prompt.DIFFICULTY_CHOICES) else 'medium'
+
+
+def normalize_question_type(value: Any) -> str:
+    """
+    A Question.TYPE_CHOICES value for a question type given in words
+    ("Multiple choice", "Open-ended questions", ...), or '' if unknown
+    """
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else None
+    value = str(value or '').lower()
+    for keyword, question_type in (
+        ('choice', Question.TYPE_MULTIPLE_CHOICE),
+        ('situational', Question.TYPE_SITUATIONAL),
+        ('judgment', Question.TYPE_SITUATIONAL),
+        ('coding', Question.TYPE_CODING),
+        ('code', Question.TYPE_CODING),
+        ('open', Question.TYPE_OPEN_ENDED),
+    ):
+        if keyword in value:
+            return question_type
+    return ''
+
+
+def find(role: str, area: str, skills: Sequence[str], difficulty: str, question_type: str = '',
+         threshold: Optional[float] = None, limit: Optional[int] = None) -> List[Tuple[BankedQuestion, float]]:
+    """
+    Banked questions for a request, most similar first
+
+    Args:
+        role, area, skills: What the question is for
+        difficulty: Normalized difficulty; only the same difficulty matches
+        question_type: Normalized question type; '' matches any type
+        threshold: Least estimated similarity, QUESTION_BANK_THRESHOLD by default
+        limit: Most entries returned, QUESTION_BANK_MAX_CANDIDATES by default
+
+    Returns:
+        list: (entry, similarity) pairs
+    """
+    threshold = settings.QUESTION_BANK_THRESHOLD if threshold is None else threshold
+    limit = settings.QUESTION_BANK_MAX_CANDIDATES if limit is None else limit
+    values = signature(role, area, skills)
+
+    candidates = BankedQuestion.objects.filter(bands__key__in=band_keys(values), difficulty=difficulty)
+    if question_type:
+        candidates = candidates.filter(question_type=question_type)
+    candidates = candidates.distinct().order_by('-created_at', '-id')[:MAX_LSH_CANDIDATES]
+
+    matches = [(entry, similarity(values, unpack(entry.signature))) for entry in candidates]
+    matches = [(entry, score) for entry, score in matches if score >= threshold]
+    matches.sort(key=lambda match: match[1], reverse=True)
+    return matches[:limit]
+
+
+def mark_reused(entries: Sequence[BankedQuestion]) -> None:
+    BankedQuestion.objects.filter(id__in=[entry.id for entry in entries]).update(reuse_count=F('reuse_count') + 1)
+
+
+# no savepoint when already inside the generation's transaction
+@transaction.atomic(savepoint=False)
+def add(entries: Sequence[Dict[str, Any]]) -> List[BankedQuestion]:
+    """
+    Bank questions; each dict has role, area, skills, difficulty,
+    question_type, content and optionally question (a Question row)
+    """
+    banked, bands = [], []
+    for fields in entries:
+        values = signature(fields['role'], fields['area'], fields['skills'])
+        banked.append(BankedQuestion(signature=pack(values), **fields))
+        bands.append(band_keys(values))
+    banked = BankedQuestion.objects.bulk_create(banked)
+    BankedQuestionBand.objects.bulk_create([
+        BankedQuestionBand(entry=entry, key=key) for entry, keys in zip(banked, bands) for key in keys
+    ])
+    return banked
+
+
+def add_assessment_questions(prompt, questions: Sequence[Question]) -> List[BankedQuestion]:
+    """Bank the stored questions of an assessment generated for prompt"""
+    return add([{
+        'question': question,
+        'role': prompt.prompt_text[:255],
+        'area': question.title or question.text[:255],
+        'skills': list(prompt.skills or []),
+        'difficulty': normalize_difficulty(prompt.difficulty),
+        'question_type': question.question_type,
+        'content': render_question(vars(question)),
+    } for question in questions])
+
+
+def describe(entry: BankedQuestion, score: Optional[float] = None) -> Dict[str, Any]:
+    """The JSON form of an entry returned by the question endpoints"""
+    return {
+        'id': entry.id,
+        'question': entry.question_id,
+        'role': entry.role,
+        'area': entry.area,
+        'skills': entry.skills,
+        'difficulty': entry.difficulty,
+        'question_type': entry.question_type,
+        'content': entry.content,
+        'similarity': None if score is None else round(score, 3),
+    }
@@ -0,0 +1,213 @@
+import asyncio
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .context import estimate_tokens
+
+# bucket name -> suffix of its anthropic-ratelimit-<suffix>-limit/-remaining headers
+BUCKET_HEADERS = {
+    'requests': 'requests',
+    'input_tokens': 'input-tokens',
+    'output_tokens': 'output-tokens',
+}
+
+
+class RateLimitExceeded(Exception):
+    """No upstream capacity within the limiter's max_wait"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Anthropic rate limit reached; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def request_cost(payload: Dict[str, Any]) -> int:
+    """Estimated input tokens of a Messages API payload"""
+    return estimate_tokens(json.dumps([payload.get('system'), payload.get('tools'), payload.get('messages')]))
+
+
+class RateLimiter:
+    """
+    Per-minute token buckets for requests, input tokens and output tokens,
+    kept in a small SQLite file so every process on the node draws from one
+    budget. Buckets start at the configured limits and follow the
+    anthropic-ratelimit-* headers of each response; a 429 pauses all callers
+    until its retry-after instead of letting each one retry on its own.
+
+    Callers without capacity wait (up to max_wait) rather than fail. Output
+    tokens are only known afterwards, so a request just needs the output
+    bucket to be non-empty; the headers then report what it used.
+
+    Bucket updates are blocking SQLite transactions behind a thread lock; the
+    async methods run them on worker threads so the event loop never waits
+    on another process's write.
+    """
+
+    def __init__(self, path: str, scope: str, limits: Mapping[str, float], max_wait: float):
+        self.path = path
+        self.scope = scope
+        self.limits = dict(limits)
+        self.max_wait = max_wait
+        self._db = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, api_key: str) -> Optional['RateLimiter']:
+        """The limiter for an API key, or None when ANTHROPIC_RATE_LIMIT_ENABLED is off"""
+        if not settings.ANTHROPIC_RATE_LIMIT_ENABLED:
+            return None
+        return cls(
+            settings.ANTHROPIC_RATE_LIMIT_STORE,
+            # limits are per account, so keys never share buckets
+            scope=hashlib.sha256(api_key.encode()).hexdigest()[:16],
+            limits={
+                'requests': settings.ANTHROPIC_RATE_LIMIT_RPM,
+                'input_tokens': settings.ANTHROPIC_RATE_LIMIT_INPUT_TPM,
+                'output_tokens': settings.ANTHROPIC_RATE_LIMIT_OUTPUT_TPM,
+            },
+            max_wait=settings.ANTHROPIC_RATE_LIMIT_MAX_WAIT,
+        )
+
+    def acquire(self, cost: int) -> None:
+        """
+        Block until a request of cost input tokens fits the budget
+
+        Raises:
+            RateLimitExceeded: If that would take longer than max_wait
+        """
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            wait = self.try_acquire(cost)
+            if wait <= 0:
+                return
+            time.sleep(self._pause(wait, deadline))
+
+    async def aacquire(self, cost: int) -> None:
+        """Async counterpart of acquire"""
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            wait = await sync_to_async(self.try_acquire, thread_sensitive=False)(cost)
+            if wait <= 0:
+                return
+            await asyncio.sleep(self._pause(wait, deadline))
+
+    def try_acquire(self, cost: int) -> float:
+        """
+        Take capacity for one request if available
+
+        Returns:
+            float: 0 if taken, otherwise seconds until it should be
+        """
+        def take(buckets, now):
+            needed = {'requests': 1, 'input_tokens': cost, 'output_tokens': 1}
+            wait = 0.0
+            for name, amount in needed.items():
+                bucket = buckets[name]
+                # a request larger than the whole bucket waits for a full one
+                amount = min(amount, bucket['capacity'])
+                wait = max(wait, bucket['paused_until'] - now,
+                           (amount - bucket['level']) * 60 / bucket['capacity'])
+            if wait > 0:
+                return wait
+            buckets['requests']['level'] -= 1
+            buckets['input_tokens']['level'] -= min(cost, buckets['input_tokens']['capacity'])
+            return 0.0
+
+        return self._update_buckets(take)
+
+    def update(self, headers: Mapping[str, str], status_code: int) -> None:
+        """Adopt the limits and remaining capacity reported by a response"""
+        def adjust(buckets, now):
+            for name, suffix in BUCKET_HEADERS.items():
+                bucket = buckets[name]
+                limit = _header_float(headers, f'anthropic-ratelimit-{suffix}-limit')
+                remaining = _header_float(headers, f'anthropic-ratelimit-{suffix}-remaining')
+                if limit:
+                    bucket['capacity'] = limit
+                # other nodes share the account, so the server's count wins when lower
+                if remaining is not None:
+                    bucket['level'] = min(bucket['level'], remaining)
+            if status_code == 429:
+                paused_until = now + (_header_float(headers, 'retry-after') or 1.0)
+                for bucket in buckets.values():
+                    bucket['paused_until'] = max(bucket['paused_until'], paused_until)
+
+        self._update_buckets(adjust)
+
+    async def aupdate(self, headers: Mapping[str, str], status_code: int) -> None:
+        """Async counterpart of update"""
+        await sync_to_async(self.update, thread_sensitive=False)(headers, status_code)
+
+    def _pause(self, wait, deadline):
+        remaining = deadline - time.monotonic()
+        if wait > remaining:
+            raise RateLimitExceeded(wait)
+        # jitter so queued callers across processes do not wake together
+        return min(wait + random.uniform(0, min(wait, 1.0)), remaining)
+
+    def _connect(self):
+        if self._db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS bucket ('
+                'scope TEXT, name TEXT, capacity REAL, level REAL, updated_at REAL, paused_until REAL, '
+                'PRIMARY KEY (scope, name))'
+            )
+            self._db = db
+        return self._db
+
+    def _update_buckets(self, fn):
+        """
+        Run fn(buckets, now) on the refilled buckets inside one write
+        transaction and store the result
+        """
+        with self._lock:
+            db = self._connect()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                rows = {
+                    name: {'capacity': capacity, 'level': level, 'updated_at': updated_at, 'paused_until': paused_until}
+                    for name, capacity, level, updated_at, paused_until in db.execute(
+                        'SELECT name, capacity, level, updated_at, paused_until FROM bucket WHERE scope = ?',
+                        (self.scope,)
+                    )
+                }
+                buckets = {}
+                for name, limit in self.limits.items():
+                    bucket = rows.get(name) or {'capacity': float(limit), 'level': float(limit),
+                                                'updated_at': now, 'paused_until': 0.0}
+                    elapsed = max(now - bucket['updated_at'], 0)
+                    bucket['level'] = min(bucket['capacity'], bucket['level'] + elapsed * bucket['capacity'] / 60)
+                    bucket['updated_at'] = now
+                    buckets[name] = bucket
+
+                result = fn(buckets, now)
+
+                db.executemany(
+                    'INSERT OR REPLACE INTO bucket (scope, name, capacity, level, updated_at, paused_until) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [(self.scope, name, b['capacity'], b['level'], b['updated_at'], b['paused_until'])
+                     for name, b in buckets.items()]
+                )
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        return result
+
+
+def _header_float(headers, name):
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
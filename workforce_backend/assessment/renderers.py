@@ -0,0 +1,23 @@
+import json
+from rest_framework.renderers import BaseRenderer
+
+
+def format_sse(event, data):
+    """Encode one server-sent event frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets streaming actions negotiate text/event-stream. The actions return a
+    StreamingHttpResponse themselves, so this only renders error responses
+    raised before the stream starts (auth failures, validation errors).
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return format_sse('error', data).encode(self.charset)
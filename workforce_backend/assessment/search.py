@@ -0,0 +1,213 @@
+"""
+Full-text search over assessments, prompts, questions and messages
+
+Each searchable table gets an inverted index maintained by the database
+itself, so rows written through bulk_create or update() are indexed too:
+
+- SQLite: an external-content FTS5 table per source (the text is not stored
+  twice) kept in sync by insert, update and delete triggers, ranked by bm25.
+- PostgreSQL: a GIN index on the source's weighted tsvector expression,
+  ranked by ts_rank; the queries repeat the indexed expression exactly so
+  the planner uses it.
+
+The 0015 migration creates the index; repair_search_index() runs after
+every migrate and restores the triggers SQLite drops when a migration
+rebuilds a table. Searching ranks each source separately, limited, and merges the
+results; scores from different sources are comparable only roughly.
+
+Snippets are HTML: the matched text is escaped and only the <mark> tags
+around matches are markup, so they can be rendered as they are.
+"""
+import html
+import re
+from typing import Any, Dict, List, Optional, Sequence
+from django.db import DEFAULT_DB_ALIAS, NotSupportedError, connection, connections
+
+SNIPPET_START = '<mark>'
+SNIPPET_END = '</mark>'
+SNIPPET_WORDS = 16
+# the database marks matches with these control characters, which are
+# turned into tags only after the snippet text has been escaped
+_MATCH_START = '\x02'
+_MATCH_END = '\x03'
+
+# config used for every tsvector and tsquery on PostgreSQL
+TEXT_SEARCH_CONFIG = 'english'
+
+
+class Source:
+    """
+    One searchable table
+
+    columns are indexed in order, the first weighted highest; title and
+    parent are returned with each hit (parent as `parent_name`).
+    """
+
+    def __init__(self, name: str, table: str, columns: Sequence[str], title: Optional[str] = None,
+                 parent: Optional[str] = None, parent_name: Optional[str] = None):
+        self.name = name
+        self.table = table
+        self.columns = list(columns)
+        self.title = title
+        self.parent = parent
+        self.parent_name = parent_name
+
+    @property
+    def fts_table(self) -> str:
+        return f'{self.table}_fts'
+
+    @property
+    def weights(self) -> List[float]:
+        # bm25 weights, the first column counting double
+        return [2.0] + [1.0] * (len(self.columns) - 1)
+
+    def document(self) -> str:
+        # the indexed tsvector expression; queries must repeat it verbatim
+        labels = 'ABCD'
+        return ' || '.join(
+            f"setweight(to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce({column}, '')), '{labels[index]}')"
+            for index, column in enumerate(self.columns)
+        )
+
+
+SOURCES = [
+    Source('assessment', 'assessment_assessment', ['title', 'content'], title='title',
+           parent='prompt_id', parent_name='prompt'),
+    Source('prompt', 'assessment_prompt', ['prompt_text'], title='prompt_text'),
+    Source('question', 'assessment_question', ['title', 'text'], title='title',
+           parent='assessment_id', parent_name='assessment'),
+    Source('message', 'assessment_message', ['content'], parent='conversation_id', parent_name='conversation'),
+]
+SOURCE_NAMES = [source.name for source in SOURCES]
+
+
+def repair_search_index(using: Optional[str] = None, **kwargs) -> None:
+    """
+    Recreate missing triggers of existing SQLite search tables; connected to
+    post_migrate, since SQLite drops a table's triggers when a migration
+    rebuilds the table
+    """
+    conn = connections[using or DEFAULT_DB_ALIAS]
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        tables = {name for name, in cursor.fetchall()}
+        for source in SOURCES:
+            if source.fts_table in tables:
+                _create_sqlite_triggers(cursor, source)
+
+
+def _create_sqlite_triggers(cursor, source):
+    # the same triggers as the 0015 migration
+    columns = ', '.join(source.columns)
+    new = ', '.join(f'new.{column}' for column in source.columns)
+    old = ', '.join(f'old.{column}' for column in source.columns)
+    remove = f"INSERT INTO {source.fts_table}({source.fts_table}, rowid, {columns}) VALUES ('delete', old.id, {old});"
+    add = f"INSERT INTO {source.fts_table}(rowid, {columns}) VALUES (new.id, {new});"
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {source.fts_table}_insert AFTER INSERT ON {source.table} "
+                   f"BEGIN {add} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {source.fts_table}_delete AFTER DELETE ON {source.table} "
+                   f"BEGIN {remove} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {source.fts_table}_update AFTER UPDATE OF {columns} "
+                   f"ON {source.table} BEGIN {remove} {add} END")
+
+
+def fts_query(query: str) -> str:
+    """
+    An FTS5 MATCH expression for free text: every word must match, quoted
+    so operators and punctuation in the input are never interpreted, and a
+    trailing * makes the last word a prefix
+    """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return ''
+    terms = [f'"{word}"' for word in words]
+    if query.rstrip().endswith('*'):
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search(query: str, types: Optional[Sequence[str]] = None, limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Ranked search over SOURCES
+
+    Args:
+        query: Free text; every word must match
+        types: Source names to search, all by default
+        limit: Most hits returned
+
+    Returns:
+        list: Hits, best first, each with type, id, title, the parent id
+        (prompt, assessment or conversation), an HTML-escaped snippet
+        with the matches wrapped in <mark> and the score
+    """
+    sources = [source for source in SOURCES if types is None or source.name in types]
+    if connection.vendor == 'sqlite':
+        match = fts_query(query)
+        if not match:
+            return []
+        run = _search_sqlite
+    elif connection.vendor == 'postgresql':
+        if not query.strip():
+            return []
+        match, run = query, _search_postgresql
+    else:
+        raise NotSupportedError(f"Full-text search is not available on {connection.vendor}")
+
+    hits = []
+    with connection.cursor() as cursor:
+        for source in sources:
+            hits += run(cursor, source, match, limit)
+    hits.sort(key=lambda hit: hit['score'], reverse=True)
+    return hits[:limit]
+
+
+def _search_sqlite(cursor, source, match, limit):
+    fts = source.fts_table
+    weights = ', '.join(str(weight) for weight in source.weights)
+    cursor.execute(
+        f"SELECT src.id, {_extra_columns(source, 'src')}, "
+        f"snippet({fts}, -1, %s, %s, '…', {SNIPPET_WORDS}), bm25({fts}, {weights}) AS score "
+        f"FROM {fts} JOIN {source.table} src ON src.id = {fts}.rowid "
+        f"WHERE {fts} MATCH %s ORDER BY score LIMIT %s",
+        [_MATCH_START, _MATCH_END, match, limit],
+    )
+    # bm25 is lower for better matches
+    return [_hit(source, row[:-1], -row[-1]) for row in cursor.fetchall()]
+
+
+def _search_postgresql(cursor, source, query, limit):
+    document = source.document()
+    text = " || ' ' || ".join(f"coalesce(src.{column}, '')" for column in source.columns)
+    options = f"StartSel={_MATCH_START}, StopSel={_MATCH_END}, MaxWords={SNIPPET_WORDS}, MinWords=5"
+    # headlines are costly, so only the top rows get one
+    cursor.execute(
+        f"SELECT src.id, {_extra_columns(source, 'src')}, "
+        f"ts_headline('{TEXT_SEARCH_CONFIG}', {text}, top.query, %s), top.score "
+        f"FROM (SELECT id, query, ts_rank({document}, query) AS score "
+        f"      FROM {source.table}, websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', %s) query "
+        f"      WHERE ({document}) @@ query ORDER BY score DESC LIMIT %s) top "
+        f"JOIN {source.table} src ON src.id = top.id ORDER BY top.score DESC",
+        [options, query, limit],
+    )
+    return [_hit(source, row[:-1], row[-1]) for row in cursor.fetchall()]
+
+
+def _extra_columns(source, alias):
+    return ', '.join(f'{alias}.{column}' if column else 'NULL' for column in (source.title, source.parent))
+
+
+def _hit(source, row, score):
+    object_id, title, parent, snippet = row
+    hit = {'type': source.name, 'id': object_id, 'title': title}
+    if source.parent_name:
+        hit[source.parent_name] = parent
+    hit.update(snippet=highlight(snippet), score=float(score))
+    return hit
+
+
+def highlight(snippet: Optional[str]) -> str:
+    """The HTML form of a snippet marked with _MATCH_START and _MATCH_END"""
+    escaped = html.escape(snippet or '')
+    return escaped.replace(_MATCH_START, SNIPPET_START).replace(_MATCH_END, SNIPPET_END)
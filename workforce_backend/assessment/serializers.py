@@ -1,39 +1,118 @@
 from rest_framework import serializers
+from workforce_backend.timing import TimedSerializerMixin
+from .jobs import enqueue_batch
 from .models import (
-    Prompt, Assessment, ConversationThread, Message
+    Prompt, Assessment, Question, ConversationThread, Message, GenerationJob, GenerationBatch
 )
 
-class PromptSerializer(serializers.ModelSerializer):
+class DynamicFieldsModelSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Takes an optional `fields` argument restricting which fields are rendered
+    """
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+class PromptSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Prompt
-        fields = ['id', 'prompt_text', 'time_limit', 'difficulty', 'question_types', 'skills', 'company_context', 'performance_weight', 'behavioral_weight', 'cultural_fit_weight']
+        fields = ['id', 'prompt_text', 'time_limit', 'difficulty', 'question_types', 'skills', 'company_context', 'performance_weight', 'behavioral_weight', 'cultural_fit_weight', 'created_at']
         read_only_fields = ['created_at', 'updated_at']
 
-class AssessmentSerializer(serializers.ModelSerializer):
+class AssessmentSerializer(DynamicFieldsModelSerializer):
+    raw_response = serializers.JSONField(read_only=True) #loaded from the response blob
+
     class Meta:
         model = Assessment
-        fields = ['id', 'prompt', 'title', 'content', 'raw_response']
-        read_only_fields = ['created_at']
+        fields = ['id', 'prompt', 'title', 'content', 'raw_response', 'usage', 'created_at']
+        read_only_fields = ['created_at', 'usage']
+
+class QuestionSerializer(DynamicFieldsModelSerializer):
+    class Meta:
+        model = Question
+        fields = ['id', 'assessment', 'position', 'question_type', 'dimension', 'title', 'text', 'options', 'rubric', 'time_minutes']
+        read_only_fields = fields
 
-class ConversationThreadSerializer(serializers.ModelSerializer):
+class ConversationThreadSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     last_message = serializers.SerializerMethodField()
     message_count = serializers.SerializerMethodField()
+
+    # the raw response is left out so listing threads never loads response blobs
+    LAST_MESSAGE_FIELDS = ['id', 'conversation', 'message_type', 'content', 'usage', 'time_stamp']
     
     class Meta:
         model = ConversationThread
         fields = ['id', 'title', 'assessment', 'created_at', 'updated_at', 'last_message', 'message_count']
     
     def get_last_message(self, obj):
-        last_msg = obj.messages.order_by('-timestamp').first()
+        # ConversationViewSet prefetches the latest message into latest_messages
+        if hasattr(obj, 'latest_messages'):
+            last_msg = obj.latest_messages[0] if obj.latest_messages else None
+        else:
+            last_msg = obj.messages.order_by('-time_stamp', '-id').first()
         if last_msg:
-            return MessageSerializer(last_msg).data
+            return MessageSerializer(last_msg, fields=self.LAST_MESSAGE_FIELDS).data
         return None
     
     def get_message_count(self, obj):
+        # annotated by ConversationViewSet
+        if hasattr(obj, 'message_count'):
+            return obj.message_count
         return obj.messages.count()
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(DynamicFieldsModelSerializer):
+    raw_response = serializers.JSONField(read_only=True) #loaded from the response blob
+
     class Meta:
         model = Message
-        fields = ['id', 'conversation', 'message_type', 'content', 'raw_response']
-        read_only_fields = ['time_stamp']                        
\ No newline at end of file
+        fields = ['id', 'conversation', 'message_type', 'content', 'raw_response', 'usage', 'time_stamp']
+        read_only_fields = ['time_stamp', 'usage']
+
+class GenerationJobSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = GenerationJob
+        fields = ['id', 'prompt', 'status', 'regenerate', 'assessment', 'result', 'error', 'attempts', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
+class GenerationBatchSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+    jobs = GenerationJobSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = GenerationBatch
+        fields = ['id', 'mode', 'status', 'concurrency', 'regenerate', 'provider_batch_id', 'created_at', 'finished_at', 'progress', 'jobs']
+        read_only_fields = fields
+
+    def get_progress(self, obj):
+        # counted from the prefetched jobs, no extra query
+        progress = {choice: 0 for choice, _ in GenerationJob.STATUS_CHOICES}
+        for job in obj.jobs.all():
+            progress[job.status] += 1
+        progress['total'] = sum(progress.values())
+        return progress
+
+
+class GenerationBatchCreateSerializer(serializers.Serializer):
+    prompt_ids = serializers.PrimaryKeyRelatedField(queryset=Prompt.objects.all(), many=True, required=False)
+    prompts = PromptSerializer(many=True, required=False)
+    concurrency = serializers.IntegerField(min_value=1, required=False)
+    mode = serializers.ChoiceField(choices=GenerationBatch.MODE_CHOICES, default=GenerationBatch.MODE_CONCURRENT)
+    regenerate = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if not attrs.get('prompt_ids') and not attrs.get('prompts'):
+            raise serializers.ValidationError('Provide prompt_ids and/or prompts')
+        return attrs
+
+    def create(self, validated_data):
+        prompts = list(validated_data.get('prompt_ids', []))
+        prompts += [Prompt.objects.create(**spec) for spec in validated_data.get('prompts', [])]
+        return enqueue_batch(
+            prompts,
+            concurrency=validated_data.get('concurrency'),
+            mode=validated_data['mode'],
+            regenerate=validated_data['regenerate'],
+        )
@@ -1,88 +1,295 @@
-from .anthropic_client import AnthropicClient
-from .models import Prompt, Assessment, ConversationThread, Message
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.utils import timezone
+from .anthropic_client import cache_marker, get_async_client, get_client, usage_summary, StreamedMessage
+from .cache import cache_key, response_cache
+from . import question_bank
+from .context import ConversationContext
+from .models import Prompt, Assessment, ConversationThread, Message, Question
+from .singleflight import flight_key, single_flight
+from .structured import AssessmentFormatError, StreamingAssessmentRenderer, parse_assessment, render_assessment
 
 class AssessmentService:
     def __init__(self):
-        self.client = AnthropicClient()
+        self.client = get_client()
 
-    def generate_assessment_from_prompt(self, prompt_id):
+    def generate_assessment_from_prompt(self, prompt_id, use_cache=True):
         """
         Generate assessment and store both assessment and conversation
+
+        Pass use_cache=False to regenerate instead of reusing an identical
+        cached generation. An identical generation already in flight is
+        waited for and its result returned instead.
         """
         try:
-            prompt = Prompt.objects.get(id=prompt_id)
-
-            # convert model data to params dictionaary
-            assessment_params = {
-                "time_limit": prompt.time_limit,
-                "difficulty": prompt.difficulty,
-                "question_types": prompt.question_types,
-                "skills": prompt.skills,
-                "company_context": prompt.company_context.company_name if prompt.company_context else None,
-                "weights": {
-                    "performance_weight": prompt.performance_weight,
-                    "behavioral_weight": prompt.behavioral_weight,
-                    "cultural_fit_weight": prompt.cultural_fit_weight
-                }
-            }
+            prompt = Prompt.objects.select_related('company_context').get(id=prompt_id)
+            payload = self.assessment_payload(prompt)
 
-            # call anthropic api
-            response = self.client.generate_assessment(
-                role=prompt.prompt_text,
-                assessment_params=assessment_params
+            return single_flight.run(
+                flight_key(prompt.id, payload), lambda: self._generate_assessment(prompt, payload, use_cache),
+                reuse_result=use_cache,
             )
 
-            if response.get('error'):
-                return {'error': response.get('message')}
-            
-            # extract text from api response
-            assessment_text = ""
-            content = response.get('content', [])
-            for item in content:
-                if item.get('type') == 'text':
-                    assessment_text += item.get('text', '')
-
-            assessment =Assessment.objects.create(
-                prompt=prompt,
-                title=f"Assessment for {prompt.prompt_text}",
-                content=assessment_text,
-                raw_response=response
-            )
+        except Prompt.DoesNotExist:
+            return {'error': 'Prompt not found'}
+        except Exception as e:
+            return {'error': str(e)}
 
-            # create conversation thread and store initial messages
-            conversation = ConversationThread.objects.create(
-                title=f"Assessment Conversation for {prompt.prompt_text}",
-                assessment=assessment
-            )    
+    def _generate_assessment(self, prompt, payload, use_cache):
+        # call anthropic api
+        response = self.client._cached_post(payload, 'assessment', use_cache)
+
+        if response.get('error'):
+            return self._api_error(response)
+
+        return self._save_assessment(prompt, payload, response)
+
+    def stream_assessment_from_prompt(self, prompt_id, use_cache=True):
+        """
+        Streaming variant of generate_assessment_from_prompt
+
+        Yields (event, data) tuples: ('delta', {'text': ...}) for each part of
+        the assessment text as it completes (a section or a question), then a
+        single ('done', {...}) once the assessment and conversation are
+        stored, or ('error', {'error': ...}) on failure. A request coalesced
+        onto an identical one in flight receives its result as a single delta.
+        """
+        try:
+            prompt = Prompt.objects.select_related('company_context').get(id=prompt_id)
+        except Prompt.DoesNotExist:
+            yield 'error', {'error': 'Prompt not found'}
+            return
 
-            #store initial prompt
-            prompt_content = self.client._create_detailed_prompt(prompt.prompt_text, assessment_params)
-            Message.objects.create(
+        try:
+            payload = self.assessment_payload(prompt)
+            key = flight_key(prompt.id, payload)
+            leader = single_flight.claim(key, reuse_result=use_cache)
+            if not leader:
+                result = single_flight.wait(key)
+                if result is not None:
+                    yield from self._replay(result)
+                    return
+
+            result = None
+            try:
+                streamed, rendered = StreamedMessage(), StreamingAssessmentRenderer()
+                for event in self.client._cached_stream(payload, 'assessment', use_cache):
+                    text = streamed.feed(event) + rendered.feed(event)
+                    if text:
+                        yield 'delta', {'text': text}
+
+                if streamed.error is not None:
+                    result = self._api_error(streamed.error)
+                else:
+                    result = self._save_assessment(prompt, payload, streamed.response)
+            finally:
+                if leader:
+                    single_flight.finish(key, result)
+            yield self._outcome(result)
+        except Exception as e:
+            yield 'error', {'error': str(e)}
+
+    async def astream_assessment_from_prompt(self, prompt_id, use_cache=True):
+        """
+        Async counterpart of stream_assessment_from_prompt for the async views;
+        no thread is held while the API generates
+        """
+        try:
+            prompt = await Prompt.objects.select_related('company_context').aget(id=prompt_id)
+        except Prompt.DoesNotExist:
+            yield 'error', {'error': 'Prompt not found'}
+            return
+
+        try:
+            payload = self.assessment_payload(prompt)
+            key = flight_key(prompt.id, payload)
+            leader = await sync_to_async(single_flight.claim)(key, reuse_result=use_cache)
+            if not leader:
+                result = await single_flight.await_result(key)
+                if result is not None:
+                    for event in self._replay(result):
+                        yield event
+                    return
+
+            result = None
+            try:
+                streamed, rendered = StreamedMessage(), StreamingAssessmentRenderer()
+                async for event in get_async_client()._cached_stream(payload, 'assessment', use_cache):
+                    text = streamed.feed(event) + rendered.feed(event)
+                    if text:
+                        yield 'delta', {'text': text}
+
+                if streamed.error is not None:
+                    result = self._api_error(streamed.error)
+                else:
+                    result = await sync_to_async(self._save_assessment)(prompt, payload, streamed.response)
+            finally:
+                if leader:
+                    await sync_to_async(single_flight.finish)(key, result)
+            yield self._outcome(result)
+        except Exception as e:
+            yield 'error', {'error': str(e)}
+
+    def assessment_payload(self, prompt):
+        """
+        The Messages API payload generate_assessment_from_prompt would send
+        """
+        return self.client.assessment_payload(prompt.prompt_text, self._assessment_params(prompt))
+
+    def record_assessment(self, prompt, response):
+        """
+        Store an assessment generated outside this service (e.g. through the
+        Message Batches API)
+        """
+        return self._save_assessment(prompt, self.assessment_payload(prompt), response)
+
+    def _assessment_params(self, prompt):
+        # convert model data to params dictionaary
+        return {
+            "time_limit": prompt.time_limit,
+            "difficulty": prompt.difficulty,
+            "question_types": prompt.question_types,
+            "skills": prompt.skills,
+            "company_context": prompt.company_context.company_name if prompt.company_context else None,
+            "weights": {
+                "performance_weight": prompt.performance_weight,
+                "behavioral_weight": prompt.behavioral_weight,
+                "cultural_fit_weight": prompt.cultural_fit_weight
+            }
+        }
+
+    @transaction.atomic
+    def _save_assessment(self, prompt, payload, response):
+        """
+        Store a generated assessment with its questions, conversation and
+        initial messages in one transaction
+        """
+        try:
+            structured = parse_assessment(response)
+        except AssessmentFormatError as e:
+            # do not serve the unusable response again from the cache
+            response_cache.invalidate(cache_key(payload))
+            return {'error': f"Invalid assessment output: {e}"}
+        assessment_text = render_assessment(structured)
+        usage = usage_summary(response)
+
+        assessment = Assessment.objects.create(
+            prompt=prompt,
+            title=f"Assessment for {prompt.prompt_text}",
+            content=assessment_text,
+            raw_response=response,
+            usage=usage
+        )
+
+        questions = Question.objects.bulk_create([
+            Question(assessment=assessment, **question) for question in structured['questions']
+        ])
+        question_bank.add_assessment_questions(prompt, questions)
+
+        # create conversation thread and store initial messages
+        conversation = ConversationThread.objects.create(
+            title=f"Assessment Conversation for {prompt.prompt_text}",
+            assessment=assessment
+        )
+
+        #store the prompt that was sent and the assistant's response; the
+        #response blob is the one just stored for the assessment
+        Message.objects.bulk_create([
+            Message(
                 conversation=conversation,
                 message_type='user',
-                content=prompt_content
-            ) 
-
-            #store the assistant's response
-            Message.objects.create(
+                content=payload['messages'][-1]['content']
+            ),
+            Message(
                 conversation=conversation,
                 message_type='assistant',
                 content=assessment_text,
-                raw_response=response
-            )   
-
-            return {
-                'success': True,
-                'assessment_id': assessment.id,
-                'conversation_id': conversation.id,
-                'content': assessment_text
-            }
-        
-        except Prompt.DoesNotExist:
-            return {'error': 'Prompt not found'}
+                response_blob=assessment.response_blob,
+                response_meta=assessment.response_meta,
+                usage=usage
+            ),
+        ])
+
+        return {
+            'success': True,
+            'assessment_id': assessment.id,
+            'conversation_id': conversation.id,
+            'content': assessment_text
+        }
+
+    def generate_question(self, role, area, params, reuse=True):
+        """
+        A single question for role and area: banked questions similar enough
+        to the request if there are any, else a newly generated one, which is
+        banked for later requests
+
+        Pass reuse=False to always generate (bypassing the response cache too).
+        """
+        try:
+            request = self._question_request(role, area, params)
+            if reuse:
+                matches = question_bank.find(**request)
+                if matches:
+                    return self._reused_questions(matches)
+
+            response = self.client.generate_single_question(role, area, params, use_cache=reuse)
+            if response.get('error'):
+                return self._api_error(response)
+
+            return self._bank_question(request, response)
+        except Exception as e:
+            return {'error': str(e)}
+
+    async def agenerate_question(self, role, area, params, reuse=True):
+        """
+        Async counterpart of generate_question
+        """
+        try:
+            request = self._question_request(role, area, params)
+            if reuse:
+                matches = await sync_to_async(question_bank.find)(**request)
+                if matches:
+                    return await sync_to_async(self._reused_questions)(matches)
+
+            client = get_async_client()
+            response = await client._cached_post(client.question_payload(role, area, params), 'question', reuse)
+            if response.get('error'):
+                return self._api_error(response)
+
+            return await sync_to_async(self._bank_question)(request, response)
         except Exception as e:
             return {'error': str(e)}
-        
+
+    @staticmethod
+    def _question_request(role, area, params):
+        return {
+            'role': role,
+            'area': area,
+            'skills': [str(skill) for skill in params.get('skills') or []],
+            'difficulty': question_bank.normalize_difficulty(params.get('difficulty')),
+            'question_type': question_bank.normalize_question_type(params.get('question_types')),
+        }
+
+    @staticmethod
+    def _reused_questions(matches):
+        question_bank.mark_reused([entry for entry, _ in matches])
+        return {
+            'success': True,
+            'source': 'bank',
+            'questions': [question_bank.describe(entry, score) for entry, score in matches]
+        }
+
+    def _bank_question(self, request, response):
+        content = self._extract_text(response)
+        if response.get('stop_reason') == 'max_tokens' or not content.strip():
+            return {'error': 'The generated question was empty or cut off'}
+        entry, = question_bank.add([dict(request, role=request['role'][:255], area=request['area'][:255],
+                                         content=content)])
+        return {
+            'success': True,
+            'source': 'generated',
+            'questions': [question_bank.describe(entry)]
+        }
 
     def continue_conversation(self, conversation_id, user_message):
         """
@@ -91,60 +298,182 @@ class AssessmentService:
         try:
             conversation = ConversationThread.objects.get(id=conversation_id)
 
-            #save user message
-            Message.objects.create(
-                conversation=conversation,
-                message_type='user',
-                content=user_message
-            )
-
-            #get conversation history
-            messages_history = []
-            for msg in conversation.messages.all().order_by('time_stamp'):
-                messages_history.append({
-                    "role": "user" if msg.message_type == 'user' else "assistant",
-                    "content": msg.content
-                })
-
-            #call api with conversation history
-            payload = {
-                "model": "claude-3-opus-20240229",
-                "max_tokens": 2000,
-                "temperature": 0.7,
-                "messages": messages_history + [{"role": "user", "content": user_message}]
-            } 
+            #user message is stored together with the reply
+            user_turn = Message(conversation=conversation, message_type='user', content=user_message)
 
             #reuse the client's headers and base_url
-            response = self.client._make_api_call(payload)
+            response = self.client._make_api_call(self._conversation_payload(conversation, user_turn))
 
             if response.get('error'):
-                return {'error': response.get('message')}   
-            
-            #extract response
-            assistant_response = ""
-            content = response.get('content', [])
-            for item in content:
-                if item.get('type') == 'text':
-                    assistant_response += item.get('text', '')
-
-            #save assistant response
-            Message.objects.create(
-                conversation=conversation,
-                message_type='assistant',
-                content=assistant_response,
-                raw_response=response
-            )
+                return self._api_error(response)
 
-            #update conversation timestamp
-            conversation.save()   
+            return self._save_reply(conversation, user_turn, response)
 
-            return {
-                'success': True,
-                'message_id': conversation.messages.last().id,
-                'content': assistant_response
-            }
+        except ConversationThread.DoesNotExist:
+            return {'error': 'Conversation not found'}
+        except Exception as e:
+            return {'error': str(e)}
+
+    def stream_conversation(self, conversation_id, user_message):
+        """
+        Streaming variant of continue_conversation, yielding the same
+        (event, data) tuples as stream_assessment_from_prompt
+        """
+        try:
+            conversation = ConversationThread.objects.get(id=conversation_id)
+        except ConversationThread.DoesNotExist:
+            yield 'error', {'error': 'Conversation not found'}
+            return
+
+        try:
+            #user message is stored together with the reply
+            user_turn = Message(conversation=conversation, message_type='user', content=user_message)
+
+            streamed = StreamedMessage()
+            for event in self.client.stream(self._conversation_payload(conversation, user_turn)):
+                text = streamed.feed(event)
+                if text:
+                    yield 'delta', {'text': text}
+
+            if streamed.error is not None:
+                yield 'error', self._api_error(streamed.error)
+                return
+
+            yield 'done', self._save_reply(conversation, user_turn, streamed.response)
+        except Exception as e:
+            yield 'error', {'error': str(e)}
+
+    async def acontinue_conversation(self, conversation_id, user_message):
+        """
+        Async counterpart of continue_conversation
+        """
+        try:
+            conversation = await ConversationThread.objects.aget(id=conversation_id)
+
+            #user message is stored together with the reply
+            user_turn = Message(conversation=conversation, message_type='user', content=user_message)
+
+            client = get_async_client()
+            response = await client._make_api_call(await self._aconversation_payload(client, conversation, user_turn))
+
+            if response.get('error'):
+                return self._api_error(response)
+
+            return await sync_to_async(self._save_reply)(conversation, user_turn, response)
 
         except ConversationThread.DoesNotExist:
             return {'error': 'Conversation not found'}
         except Exception as e:
-            return {'error': str(e)}   
\ No newline at end of file
+            return {'error': str(e)}
+
+    async def astream_conversation(self, conversation_id, user_message):
+        """
+        Async counterpart of stream_conversation
+        """
+        try:
+            conversation = await ConversationThread.objects.aget(id=conversation_id)
+        except ConversationThread.DoesNotExist:
+            yield 'error', {'error': 'Conversation not found'}
+            return
+
+        try:
+            #user message is stored together with the reply
+            user_turn = Message(conversation=conversation, message_type='user', content=user_message)
+
+            client = get_async_client()
+            streamed = StreamedMessage()
+            async for event in client.stream(await self._aconversation_payload(client, conversation, user_turn)):
+                text = streamed.feed(event)
+                if text:
+                    yield 'delta', {'text': text}
+
+            if streamed.error is not None:
+                yield 'error', self._api_error(streamed.error)
+                return
+
+            yield 'done', await sync_to_async(self._save_reply)(conversation, user_turn, streamed.response)
+        except Exception as e:
+            yield 'error', {'error': str(e)}
+
+    def _conversation_payload(self, conversation, user_turn):
+        #get conversation history followed by the new, not yet stored, user message
+        summary, messages_history = ConversationContext(self.client).build(conversation, pending=user_turn)
+        return self._conversation_request(summary, messages_history)
+
+    async def _aconversation_payload(self, client, conversation, user_turn):
+        summary, messages_history = await ConversationContext(client).abuild(conversation, pending=user_turn)
+        return self._conversation_request(summary, messages_history)
+
+    def _conversation_request(self, summary, messages_history):
+        system = self.client.conversation_system()
+        if summary:
+            system.append({"type": "text", "text": f"Summary of the earlier conversation:\n{summary}"})
+
+        # mark the newest turn so the next turn reads the whole history from the
+        # prompt cache, once the history is long enough to be cached
+        marker = cache_marker(*[block["text"] for block in system], *[msg["content"] for msg in messages_history])
+        if marker:
+            last = messages_history[-1]
+            last["content"] = [{"type": "text", "text": last["content"], **marker}]
+
+        #call api with conversation history
+        return {
+            "model": "claude-3-opus-20240229",
+            "max_tokens": 2000,
+            "temperature": 0.7,
+            "system": system,
+            "messages": messages_history
+        }
+
+    @transaction.atomic
+    def _save_reply(self, conversation, user_turn, response):
+        #extract response
+        assistant_response = self._extract_text(response)
+
+        #save the user turn and assistant response together
+        reply = Message(
+            conversation=conversation,
+            message_type='assistant',
+            content=assistant_response,
+            raw_response=response,
+            usage=usage_summary(response)
+        )
+        reply.prepare_response_blob()
+        Message.objects.bulk_create([user_turn, reply])
+
+        #update conversation timestamp
+        ConversationThread.objects.filter(id=conversation.id).update(updated_at=timezone.now())
+
+        return {
+            'success': True,
+            'message_id': reply.id,
+            'content': assistant_response
+        }
+
+    @staticmethod
+    def _outcome(result):
+        return ('error' if result.get('error') else 'done'), result
+
+    @classmethod
+    def _replay(cls, result):
+        # the leader's finished result, streamed in one chunk
+        if not result.get('error'):
+            yield 'delta', {'text': result.get('content', '')}
+        yield cls._outcome(result)
+
+    @staticmethod
+    def _api_error(error):
+        # rate limiting keeps its status so callers can ask the user to retry later
+        result = {'error': error.get('message')}
+        if error.get('status_code') == 429:
+            result.update(status_code=429, retry_after=error.get('retry_after'))
+        return result
+
+    @staticmethod
+    def _extract_text(response):
+        # extract text from api response
+        text = ""
+        for item in response.get('content', []):
+            if item.get('type') == 'text':
+                text += item.get('text', '')
+        return text
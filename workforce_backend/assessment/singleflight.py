@@ -0,0 +1,173 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+from typing import Any, Callable, Dict, Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import CharField, F, Value
+from django.db.models.functions import Cast, Concat
+from django.utils import timezone
+from .cache import cache_key
+from .models import GenerationLock
+
+
+def flight_key(prompt_id: int, payload: Dict[str, Any]) -> str:
+    """Identical generations share a key: same prompt, same request"""
+    return f"assessment:{prompt_id}:{cache_key(payload)}"
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent generations onto one upstream call
+
+    The first caller for a key becomes the leader and runs the generation;
+    callers arriving while it runs wait and receive the leader's result
+    instead of generating (and storing) a duplicate. Threads of one process
+    wait on an in-memory event; other processes see the GenerationLock row
+    and poll it. A leader that dies is taken over once its lease expires.
+    Finished results stay readable for result_ttl seconds: followers still
+    polling read them there, and identical requests arriving in that window
+    are served them too unless they ask for a fresh result. A fresh claim
+    moves the finished row aside under a key of its own (followers poll the
+    row they joined, not the key) and starts a new flight. A request after
+    the window starts a new flight either way.
+    """
+
+    def __init__(self, lease: int, result_ttl: int, poll_interval: float):
+        self.lease = timedelta(seconds=lease)
+        self.result_ttl = timedelta(seconds=result_ttl)
+        self.poll_interval = poll_interval
+        self._flights: Dict[str, tuple] = {}  # key -> (owner, event) of flights led here
+        self._lock = threading.Lock()
+
+    def run(self, key: str, fn: Callable[[], Dict[str, Any]], reuse_result: bool = True) -> Dict[str, Any]:
+        """
+        Return fn()'s result, running it only if no identical call is in flight
+        (or, with reuse_result, has just finished)
+        """
+        if self.claim(key, reuse_result=reuse_result):
+            result = None
+            try:
+                result = fn()
+                return result
+            finally:
+                self.finish(key, result)
+
+        result = self.wait(key)
+        # the leader failed without a result; generate ourselves
+        return result if result is not None else fn()
+
+    def claim(self, key: str, reuse_result: bool = True) -> bool:
+        """
+        Try to become the leader for key
+
+        Args:
+            key: The flight key
+            reuse_result: Follow a finished, unexpired flight for key (wait()
+                returns its result at once); False starts a new flight instead
+
+        Returns:
+            bool: True if the caller must run the generation and then finish()
+        """
+        with self._lock:
+            if key in self._flights:
+                return False
+            now = timezone.now()
+            owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+            # leases of dead leaders and expired results
+            GenerationLock.objects.filter(expires_at__lte=now).delete()
+            if not reuse_result:
+                GenerationLock.objects.filter(key=key, result__isnull=False).update(
+                    key=Concat(F('key'), Value('#'), Cast('id', CharField()))
+                )
+            try:
+                with transaction.atomic():
+                    GenerationLock.objects.create(key=key, owner=owner, expires_at=now + self.lease)
+            except IntegrityError:
+                return False
+            self._flights[key] = (owner, threading.Event())
+            return True
+
+    def finish(self, key: str, result: Optional[Dict[str, Any]]) -> None:
+        """
+        Publish the leader's result; None (the leader raised) releases the key
+        so waiting callers generate themselves
+        """
+        with self._lock:
+            owner, event = self._flights.pop(key)
+        try:
+            # a lease taken over after expiring belongs to the new leader
+            locks = GenerationLock.objects.filter(key=key, owner=owner)
+            if result is None:
+                locks.delete()
+            else:
+                locks.update(result=result, expires_at=timezone.now() + self.result_ttl)
+        finally:
+            event.set()
+
+    def wait(self, key: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Wait for the leader of key
+
+        Returns:
+            dict: Its result, or None if it finished without one or did not
+            finish within timeout (default: the lease)
+        """
+        deadline = time.monotonic() + (timeout if timeout is not None else self.lease.total_seconds())
+        with self._lock:
+            _, event = self._flights.get(key, (None, None))
+        flight = None
+        while True:
+            done, result, flight = self.poll(key, flight)
+            if done:
+                return result
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            if event is not None:
+                event.wait(min(self.poll_interval, remaining))
+            else:
+                time.sleep(min(self.poll_interval, remaining))
+
+    async def await_result(self, key: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Async counterpart of wait"""
+        deadline = time.monotonic() + (timeout if timeout is not None else self.lease.total_seconds())
+        flight = None
+        while True:
+            done, result, flight = await sync_to_async(self.poll)(key, flight)
+            if done:
+                return result
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            await asyncio.sleep(min(self.poll_interval, remaining))
+
+    def poll(self, key: str, flight: Optional[int] = None):
+        """
+        Args:
+            key: The flight key
+            flight: The GenerationLock id returned by the previous poll; the
+                row is followed even if a fresh claim moves it off key
+
+        Returns:
+            tuple: (done, result, flight); done once the leader published a
+            result or gave up
+        """
+        locks = GenerationLock.objects.filter(expires_at__gt=timezone.now())
+        locks = locks.filter(key=key) if flight is None else locks.filter(id=flight)
+        lock = locks.only('result').first()
+        if lock is None:
+            return True, None, None
+        return lock.result is not None, lock.result, lock.id
+
+
+single_flight = SingleFlight(
+    lease=settings.GENERATION_SINGLE_FLIGHT_LEASE,
+    result_ttl=settings.GENERATION_SINGLE_FLIGHT_RESULT_TTL,
+    poll_interval=settings.GENERATION_SINGLE_FLIGHT_POLL_INTERVAL,
+)
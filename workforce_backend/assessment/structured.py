@@ -0,0 +1,524 @@
+"""
+Structured assessment output
+
+Assessments are generated through the record_assessment tool, so the model
+returns JSON rather than free text. parse_assessment validates that JSON
+into the fields stored on Question rows; render_assessment turns it back
+into the sectioned text kept in Assessment.content and used by follow-up
+conversation turns. StreamingAssessmentRenderer does the same while the
+tool input is still streaming, releasing text as the model writes it.
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional
+from .models import Question
+
+TOOL_NAME = 'record_assessment'
+
+QUESTION_TYPES = [value for value, _ in Question.TYPE_CHOICES]
+DIMENSIONS = [value for value, _ in Question.DIMENSION_CHOICES]
+
+ASSESSMENT_TOOL = {
+    "name": TOOL_NAME,
+    "description": "Record the finished assessment. Every field is shown to the hiring manager; "
+                   "only the question text and options are shown to candidates.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "overview": {
+                "type": "string",
+                "description": "Brief summary of the assessment, the skills tested and how it relates to the role",
+            },
+            "questions": {
+                "type": "array",
+                "minItems": 1,
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "title": {"type": "string", "description": "Brief descriptive title"},
+                        "type": {"type": "string", "enum": QUESTION_TYPES},
+                        "dimension": {"type": "string", "enum": DIMENSIONS,
+                                      "description": "What the question primarily assesses"},
+                        # before the body, so the question's heading can be streamed ahead of its text
+                        "time_minutes": {"type": "integer", "minimum": 1},
+                        "text": {"type": "string",
+                                 "description": "Scenario, question and instructions, as shown to the candidate"},
+                        "options": {"type": "array", "items": {"type": "string"},
+                                    "description": "Answer options of multiple-choice and situational questions"},
+                        "rubric": {"type": "string",
+                                   "description": "Correct answer, sample strong answer or ranking of the options, "
+                                                  "and what poor, acceptable and excellent answers look like"},
+                    },
+                    "required": ["type", "dimension", "time_minutes", "text", "rubric"],
+                },
+            },
+            "evaluation_guidelines": {"type": "string"},
+            "time_allocation": {"type": "string", "description": "How candidates should use their time"},
+        },
+        "required": ["overview", "questions", "evaluation_guidelines", "time_allocation"],
+    },
+}
+
+# forces the tool, so the whole response is its input
+TOOL_CHOICE = {"type": "tool", "name": TOOL_NAME}
+
+SECTIONS = [
+    ('overview', 'ASSESSMENT OVERVIEW'),
+    ('questions', 'ASSESSMENT QUESTIONS'),
+    ('evaluation_guidelines', 'EVALUATION GUIDELINES'),
+    ('time_allocation', 'TIME ALLOCATION'),
+]
+
+
+class AssessmentFormatError(ValueError):
+    """The generation did not produce a valid record_assessment call"""
+
+
+def parse_assessment(response: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate the record_assessment input of a Messages API response
+
+    Returns:
+        dict: overview, evaluation_guidelines, time_allocation and questions,
+        each question with the fields of a Question row
+
+    Raises:
+        AssessmentFormatError: If the tool was not called, the output was cut
+            off, or a field is missing or invalid
+    """
+    if response.get('stop_reason') == 'max_tokens':
+        raise AssessmentFormatError("the output was cut off at max_tokens")
+    data = next((
+        block.get('input') for block in response.get('content', [])
+        if block.get('type') == 'tool_use' and block.get('name') == TOOL_NAME
+    ), None)
+    if not isinstance(data, dict):
+        raise AssessmentFormatError(f"the response has no {TOOL_NAME} call")
+
+    questions = data.get('questions')
+    if not isinstance(questions, list) or not questions:
+        raise AssessmentFormatError("questions must be a non-empty list")
+    return {
+        'overview': _text(data, 'overview'),
+        'questions': [_question(question, position) for position, question in enumerate(questions, 1)],
+        'evaluation_guidelines': _text(data, 'evaluation_guidelines'),
+        'time_allocation': _text(data, 'time_allocation'),
+    }
+
+
+def _question(data, position):
+    if not isinstance(data, dict):
+        raise AssessmentFormatError(f"question {position} is not an object")
+    question_type = _choice(data, 'type', QUESTION_TYPES, position)
+    options = data.get('options') or []
+    if not isinstance(options, list) or not all(isinstance(option, str) for option in options):
+        raise AssessmentFormatError(f"question {position}: options must be a list of strings")
+    try:
+        time_minutes = int(data.get('time_minutes'))
+    except (TypeError, ValueError):
+        raise AssessmentFormatError(f"question {position}: time_minutes must be a whole number of minutes")
+    if time_minutes < 1:
+        raise AssessmentFormatError(f"question {position}: time_minutes must be positive")
+    return {
+        'position': position,
+        'question_type': question_type,
+        'dimension': _choice(data, 'dimension', DIMENSIONS, position),
+        'title': str(data.get('title') or '').strip()[:255],
+        'text': _text(data, 'text', position),
+        'options': [option.strip() for option in options],
+        'rubric': _text(data, 'rubric', position),
+        'time_minutes': time_minutes,
+    }
+
+
+def _text(data, field, position=None):
+    value = data.get(field)
+    if not isinstance(value, str) or not value.strip():
+        where = f"question {position}: " if position else ''
+        raise AssessmentFormatError(f"{where}{field} must be a non-empty string")
+    return value.strip()
+
+
+def _choice(data, field, choices, position):
+    # tolerate "Multiple choice" / "cultural-fit" for the enum values
+    value = re.sub(r'[\s-]+', '_', str(data.get(field) or '').strip().lower())
+    if value not in choices:
+        raise AssessmentFormatError(f"question {position}: {field} must be one of {', '.join(choices)}")
+    return value
+
+
+def render_assessment(assessment: Dict[str, Any]) -> str:
+    """
+    The sectioned text form of a parsed assessment; sections missing from a
+    partial assessment are left out
+    """
+    parts = []
+    for field, heading in SECTIONS:
+        if field not in assessment:
+            continue
+        if field == 'questions':
+            body = "\n\n".join(
+                f"{question['position']}. {render_question(question)}" for question in assessment['questions']
+            )
+        else:
+            body = assessment[field]
+        parts.append(f"{heading}:\n{body}")
+    return "\n\n".join(parts)
+
+
+def render_question(question: Dict[str, Any]) -> str:
+    """The text form of one parsed question (or a Question row's fields), unnumbered"""
+    lines = [_heading(question), question['text']]
+    lines += [f"{_option_label(index)}{option}" for index, option in enumerate(question['options'])]
+    lines.append(f"{RUBRIC_LABEL}{question['rubric']}")
+    return "\n".join(lines)
+
+
+RUBRIC_LABEL = 'Evaluation criteria: '
+
+
+def _heading(question):
+    details = ', '.join([
+        dict(Question.TYPE_CHOICES)[question['question_type']],
+        dict(Question.DIMENSION_CHOICES)[question['dimension']],
+        f"{question['time_minutes']} minutes",
+    ])
+    return f"{question['title'] or 'Question'} ({details})"
+
+
+def _option_label(index):
+    return f"   {chr(ord('A') + index)}) "
+
+
+
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+# string content ending in an escape that is not complete yet, or in a high
+# surrogate whose low half may follow; only an odd run of backslashes escapes
+_PARTIAL_ESCAPE = re.compile(r'(\\+)(u[0-9a-fA-F]{0,3})?$')
+_HIGH_SURROGATE = re.compile(r'(\\+)u[dD][89abAB][0-9a-fA-F]{2}$')
+
+
+def _decodable(raw):
+    # length of the longest prefix of raw string content that decodes alone
+    end = len(raw)
+    for pattern in (_PARTIAL_ESCAPE, _HIGH_SURROGATE):
+        match = pattern.search(raw, 0, end)
+        if match and len(match.group(1)) % 2:
+            end = match.start() + len(match.group(1)) - 1
+    return end
+
+
+class IncrementalJSON:
+    """
+    Incremental parser for a JSON document that arrives in pieces
+
+    feed() scans only the new text, keeping its state between calls, and
+    returns what the text completed as (kind, path, value) events, path
+    being the keys and indexes that lead to the value:
+
+    - ('start', path, opener) when an object ('{'), array ('[') or string
+      ('"') value begins
+    - ('text', path, chunk) for each decoded piece of a string value, as
+      soon as it arrives
+    - ('value', path, value) when a string, number, true, false or null
+      value is finished
+    - ('end', path, None) when an object or array is closed
+
+    Object keys are not events; they are the last item of their value's
+    path. Malformed input sets failed and ends the events.
+    """
+
+    def __init__(self):
+        self.complete = False
+        self.failed = False
+        # one [opener, current key or index, expecting a key] per open container
+        self._stack: List[list] = []
+        self._raw: Optional[List[str]] = None  # undecoded content of the open string
+        self._decoded: List[str] = []
+        self._escape = False
+        self._is_key = False
+        self._token: Optional[List[str]] = None  # the open number or literal
+
+    @property
+    def path(self) -> tuple:
+        return tuple(entry[1] for entry in self._stack)
+
+    def feed(self, chunk: str) -> List[tuple]:
+        events = []
+        index, length = 0, len(chunk)
+        while index < length and not self.failed:
+            if self._raw is not None:
+                if self._escape:
+                    self._raw.append(chunk[index])
+                    self._escape = False
+                    index += 1
+                    continue
+                match = _STRING_SPECIAL.search(chunk, index)
+                end = match.start() if match else length
+                self._raw.append(chunk[index:end])
+                if match is None:
+                    break
+                index = end + 1
+                if chunk[end] == '\\':
+                    self._raw.append('\\')
+                    self._escape = True
+                else:
+                    self._end_string(events)
+                continue
+
+            ch = chunk[index]
+            index += 1
+            if self._token is not None:
+                if ch not in ',]}' and not ch.isspace():
+                    self._token.append(ch)
+                    continue
+                self._end_token(events)
+            if ch.isspace() or ch == ':':
+                continue
+            if ch == ',':
+                if not self._stack:
+                    self.failed = True
+                else:
+                    self._stack[-1][2] = self._stack[-1][0] == '{'
+            elif ch in '}]':
+                if not self._stack or self._stack[-1][0] != ('{' if ch == '}' else '['):
+                    self.failed = True
+                    continue
+                self._stack.pop()
+                events.append(('end', self.path, None))
+                self._end_value()
+            elif ch == '"':
+                self._is_key = bool(self._stack) and self._stack[-1][2]
+                if not self._is_key:
+                    self._begin(events, ch)
+                self._raw, self._decoded = [], []
+            elif ch in '{[':
+                self._begin(events, ch)
+                self._stack.append([ch, -1, ch == '{'])
+            else:
+                self._begin(events)
+                self._token = [ch]
+        if self._raw is not None and not self._is_key and not self.failed:
+            self._flush(events, final=False)
+        return events if not self.failed else []
+
+    def _begin(self, events, opener=None):
+        if self.complete:
+            self.failed = True
+            return
+        if self._stack and self._stack[-1][0] == '[':
+            self._stack[-1][1] += 1
+        if opener is not None:
+            events.append(('start', self.path, opener))
+
+    def _flush(self, events, final):
+        raw = ''.join(self._raw)
+        end = len(raw) if final else _decodable(raw)
+        try:
+            text = json.loads(f'"{raw[:end]}"')
+        except ValueError:
+            self.failed = True
+            return
+        self._raw = [raw[end:]]
+        if text:
+            self._decoded.append(text)
+            events.append(('text', self.path, text))
+
+    def _end_string(self, events):
+        if self._is_key:
+            try:
+                self._stack[-1][1] = json.loads('"' + ''.join(self._raw) + '"')
+            except ValueError:
+                self.failed = True
+            self._stack[-1][2] = False
+            self._raw = None
+            return
+        self._flush(events, final=True)
+        self._raw = None
+        events.append(('value', self.path, ''.join(self._decoded)))
+        self._end_value()
+
+    def _end_token(self, events):
+        token, self._token = ''.join(self._token), None
+        try:
+            value = json.loads(token)
+        except ValueError:
+            self.failed = True
+            return
+        events.append(('value', self.path, value))
+        self._end_value()
+
+    def _end_value(self):
+        if not self._stack:
+            self.complete = True
+
+
+_SECTION_FIELDS = [field for field, _ in SECTIONS]
+_HEADINGS = dict(SECTIONS)
+# the body of a question, in rendering order; options may be left out
+_BODY = ['text', 'options', 'rubric']
+
+
+class StreamingAssessmentRenderer:
+    """
+    Renders the record_assessment input while it streams
+
+    feed() takes each stream event and returns the text it adds: section
+    text, question text, options and rubrics are released as the model
+    writes them, so the concatenated output equals render_assessment of
+    the finished call. A question's heading needs its title, type,
+    dimension and time, which the schema puts before the body; a question
+    written in another order is released whole once it closes.
+
+    Each section and question is checked against its final rendering as it
+    closes. If the two disagree (the model strayed from schema order),
+    nothing more is released and the final result carries the full text.
+    """
+
+    def __init__(self):
+        self._json = IncrementalJSON()
+        self._released = False
+        self._section = -1  # index in SECTIONS of the latest section begun
+        self._separator = ''
+        self._unit: List[str] = []  # text released for the open section or question
+        self._question: Optional[Dict[str, Any]] = None
+        self._string: Optional[list] = None  # [text begun, held trailing whitespace]
+        self._stopped = False
+
+    def feed(self, event: Dict[str, Any]) -> str:
+        delta = event.get('delta') or {}
+        if event.get('type') != 'content_block_delta' or delta.get('type') != 'input_json_delta':
+            return ''
+        out = []
+        for kind, path, value in self._json.feed(delta.get('partial_json', '')):
+            if self._stopped:
+                break
+            if path and path[0] in _SECTION_FIELDS:
+                if path[0] == 'questions' and len(path) > 1:
+                    self._question_event(kind, path[1:], value, out)
+                else:
+                    self._section_event(kind, path, value, out)
+        return ''.join(out)
+
+    def _section_event(self, kind, path, value, out):
+        field = path[0]
+        if len(path) > 1:
+            return
+        if kind == 'start':
+            index = _SECTION_FIELDS.index(field)
+            if index <= self._section or (field != 'questions' and value != '"'):
+                self._stopped = True
+                return
+            self._section = index
+            if field != 'questions':
+                self._begin_unit()
+                self._emit(out, f"{_HEADINGS[field]}:\n")
+                self._string = [False, '']
+        elif kind == 'text':
+            self._stream(out, value)
+        elif kind == 'value' and field != 'questions':
+            self._close_unit(out, f"{_HEADINGS[field]}:\n{value.strip()}")
+
+    def _question_event(self, kind, path, value, out):
+        if len(path) == 1:
+            if kind == 'start' and value == '{':
+                self._begin_unit()
+                self._question = {'position': path[0] + 1, 'fields': {}, 'stage': -1, 'whole': False}
+            elif kind == 'end' and self._question is not None:
+                self._close_question(out)
+            else:
+                self._stopped = True
+            return
+
+        question, field = self._question, path[1]
+        if len(path) == 2:
+            if kind == 'start' and field in _BODY:
+                self._begin_body(question, field, value, out)
+            elif kind == 'text' and field in ('text', 'rubric') and not question['whole']:
+                self._stream(out, value)
+            elif kind == 'value':
+                question['fields'][field] = value
+        elif len(path) == 3 and field == 'options':
+            if kind == 'start' and value == '"' and not question['whole']:
+                self._emit(out, f"\n{_option_label(path[2])}")
+                self._string = [False, '']
+            elif kind == 'text' and not question['whole']:
+                self._stream(out, value)
+            elif kind == 'value':
+                question['fields']['options'].append(value)
+
+    def _begin_body(self, question, field, opener, out):
+        stage = _BODY.index(field)
+        if field == 'options':
+            question['fields']['options'] = []
+        in_order = stage > question['stage'] and (stage == 0 or question['stage'] >= 0)
+        question['stage'] = stage
+        if question['whole'] or not in_order or opener != ('[' if field == 'options' else '"'):
+            question['whole'] = True
+            return
+        if field == 'text':
+            heading = self._question_heading(question)
+            if heading is None:
+                question['whole'] = True
+                return
+            self._emit(out, f"{self._question_lead(question)}{heading}\n")
+            self._string = [False, '']
+        elif field == 'rubric':
+            self._emit(out, f"\n{RUBRIC_LABEL}")
+            self._string = [False, '']
+
+    def _question_heading(self, question):
+        # normalized exactly like parse_assessment, with a placeholder body
+        try:
+            normalized = _question(dict(question['fields'], text='-', rubric='-', options=[]), question['position'])
+        except AssessmentFormatError:
+            return None
+        return _heading(normalized)
+
+    @staticmethod
+    def _question_lead(question):
+        heading = f"{_HEADINGS['questions']}:\n" if question['position'] == 1 else ''
+        return f"{heading}{question['position']}. "
+
+    def _close_question(self, out):
+        question, self._question = self._question, None
+        try:
+            normalized = _question(question['fields'], question['position'])
+        except AssessmentFormatError:
+            self._stopped = True
+            return
+        self._close_unit(out, self._question_lead(question) + render_question(normalized))
+
+    def _stream(self, out, chunk):
+        # string values are rendered stripped: leading whitespace is dropped,
+        # trailing whitespace held back until more text follows it
+        begun, held = self._string
+        if not begun:
+            chunk = chunk.lstrip()
+            if not chunk:
+                return
+        text = held + chunk
+        kept = text.rstrip()
+        self._string = [True, text[len(kept):]]
+        if kept:
+            self._emit(out, kept)
+
+    def _begin_unit(self):
+        self._separator = '\n\n' if self._released else ''
+        self._unit = []
+
+    def _emit(self, out, text):
+        if not self._unit:
+            text = self._separator + text
+        self._unit.append(text)
+        out.append(text)
+
+    def _close_unit(self, out, text):
+        expected, sent = self._separator + text, ''.join(self._unit)
+        self._string = None
+        if not expected.startswith(sent):
+            self._stopped = True
+            return
+        out.append(expected[len(sent):])
+        self._released = True
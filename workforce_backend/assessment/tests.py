@@ -1,3 +1,1551 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
+import httpx
+import requests
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connection, connections, transaction
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import QuerySet
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework.throttling import UserRateThrottle
+from rest_framework.views import APIView
+from users.models import Company, User
+from workforce_backend.database import SQLITE_BUSY_TIMEOUT_MS, SQLITE_PRAGMAS
+from workforce_backend.timing import _record_query
+from tests.support.stub_server import STUB_ASSESSMENT, StubAnthropicHandler, start_stub_server, stub_client
+from asgiref.sync import async_to_sync
+from . import anthropic_client
+from .anthropic_client import CONVERSATION_SYSTEM_PROMPT, AnthropicClient, AsyncAnthropicClient
+from .benchmark import ENDPOINTS, run_endpoint, seed
+from .cassette import Cassette
+from .context import ConversationContext
+from .jobs import (
+    claim_next_batch, claim_next_job, enqueue_batch, enqueue_generation, max_generation_time,
+    poll_message_batches, requeue_stale_jobs, run_batch, run_job,
+)
+from .metrics import llm_metrics
+from .ratelimit import RateLimitExceeded, RateLimiter
+from .singleflight import SingleFlight
+from . import question_bank
+from .cache import ResponseCache, cache_key, response_cache
+from .models import (
+    Prompt, Assessment, Question, BankedQuestion, ConversationThread, Message, GenerationBatch, GenerationJob, GenerationCacheEntry,
+    LLMCall, LLMCallTotals, ResponseBlob
+)
+from .renderers import format_sse
+from .services import AssessmentService
+from .structured import TOOL_NAME, StreamingAssessmentRenderer, parse_assessment, render_assessment
 
-# Create your tests here.
+
+class StubAnthropicMixin:
+    """Points the shared AnthropicClient at a local stub server"""
+
+    def setUp(self):
+        super().setUp()
+        self.server = start_stub_server()
+        self._previous_client = anthropic_client._client
+        anthropic_client._client = stub_client(self.server)
+        # call metrics are flushed explicitly by the tests that read them
+        llm_metrics.background = False
+        llm_metrics.drain()
+        # the in-process cache outlives each test's database rows
+        response_cache.clear()
+
+    def tearDown(self):
+        llm_metrics.background = True
+        anthropic_client._client = self._previous_client
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def make_prompts(self, roles):
+        return [
+            Prompt.objects.create(prompt_text=role, question_types='Open-ended questions', skills=['communication'])
+            for role in roles
+        ]
+
+
+class BatchGenerationApiTests(StubAnthropicMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        user = User(email='manager@example.com')
+        user.set_password('secret')
+        user.save()
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {user.generate_jwt()}')
+
+    def test_create_batch_from_ids_and_specs(self):
+        prompt, = self.make_prompts(['Data Analyst'])
+        response = self.api.post('/assessment/batches/', {
+            'prompt_ids': [prompt.id],
+            'prompts': [{'prompt_text': 'Support Lead', 'question_types': 'Open-ended questions'}],
+            'concurrency': 1000,
+        }, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['progress']['queued'], 2)
+        self.assertEqual(response.data['concurrency'], 32)
+
+    def test_batch_requires_prompts(self):
+        response = self.api.post('/assessment/batches/', {}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_message_batches_mode(self):
+        prompts = self.make_prompts(['Data Analyst', 'FAIL Engineer', 'Product Manager'])
+        batch = GenerationBatch.objects.get(id=self.api.post('/assessment/batches/', {
+            'prompt_ids': [p.id for p in prompts], 'mode': 'message_batches'
+        }, format='json').data['id'])
+
+        batch = run_batch(claim_next_batch(), 'test-worker')
+        self.assertEqual(batch.status, GenerationBatch.STATUS_SUBMITTED)
+        self.assertEqual(poll_message_batches(force=True), 1)
+
+        batch.refresh_from_db()
+        self.assertEqual(batch.status, GenerationBatch.STATUS_COMPLETED)
+        statuses = dict(batch.jobs.values_list('prompt__prompt_text', 'status'))
+        self.assertEqual(statuses, {
+            'Data Analyst': GenerationJob.STATUS_SUCCEEDED,
+            'FAIL Engineer': GenerationJob.STATUS_FAILED,
+            'Product Manager': GenerationJob.STATUS_SUCCEEDED,
+        })
+        self.assertEqual(Assessment.objects.count(), 2)
+
+
+class ConcurrentBatchTests(StubAnthropicMixin, TransactionTestCase):
+    def test_failures_are_isolated(self):
+        prompts = self.make_prompts([f'Role {i}' for i in range(6)] + ['FAIL Role'])
+        enqueue_batch(prompts, concurrency=3)
+
+        batch = run_batch(claim_next_batch(), 'test-worker')
+
+        self.assertEqual(batch.status, GenerationBatch.STATUS_COMPLETED)
+        self.assertEqual(batch.jobs.filter(status=GenerationJob.STATUS_SUCCEEDED).count(), 6)
+        self.assertEqual(batch.jobs.filter(status=GenerationJob.STATUS_FAILED).count(), 1)
+        self.assertEqual(Assessment.objects.count(), 6)
+
+
+class GenerationJobTests(StubAnthropicMixin, TestCase):
+    def test_claims_oldest_standalone_job_once(self):
+        first, second, batched = self.make_prompts(['Data Analyst', 'Support Lead', 'Product Manager'])
+        enqueue_batch([batched])
+        jobs = [enqueue_generation(first), enqueue_generation(second)]
+
+        job = claim_next_job('worker-a')
+        self.assertEqual((job.id, job.status, job.worker, job.attempts), (jobs[0].id, 'running', 'worker-a', 1))
+        self.assertIsNotNone(job.started_at)
+        self.assertEqual(claim_next_job('worker-b').id, jobs[1].id)
+        # batch jobs belong to whoever claims their batch
+        self.assertIsNone(claim_next_job('worker-c'))
+
+    def test_claim_skips_a_job_taken_between_select_and_update(self):
+        first, second = [enqueue_generation(prompt) for prompt in self.make_prompts(['Data Analyst', 'Support Lead'])]
+        select = QuerySet.first
+
+        def raced(queryset):
+            job = select(queryset)
+            if job is not None and job.id == first.id:
+                # another worker claims the row after we read it
+                GenerationJob.objects.filter(id=job.id).update(status=GenerationJob.STATUS_RUNNING, worker='worker-b')
+            return job
+
+        with mock.patch.object(QuerySet, 'first', raced):
+            job = claim_next_job('worker-a')
+        self.assertEqual(job.id, second.id)
+        first.refresh_from_db()
+        self.assertEqual((first.worker, first.attempts), ('worker-b', 0))
+
+    def test_run_job_records_success_and_failure(self):
+        good, bad = [enqueue_generation(prompt) for prompt in self.make_prompts(['Data Analyst', 'FAIL Engineer'])]
+
+        job = run_job(claim_next_job('worker-a'))
+        self.assertEqual(job.id, good.id)
+        self.assertEqual(job.status, GenerationJob.STATUS_SUCCEEDED)
+        self.assertEqual(job.assessment_id, job.result['assessment_id'])
+        self.assertIsNotNone(job.finished_at)
+
+        job = run_job(claim_next_job('worker-a'))
+        self.assertEqual(job.id, bad.id)
+        self.assertEqual(job.status, GenerationJob.STATUS_FAILED)
+        self.assertTrue(job.error)
+        self.assertIsNone(job.assessment_id)
+
+    def test_stale_jobs_are_requeued_until_out_of_attempts(self):
+        prompts = self.make_prompts(['Retry', 'Exhausted', 'Fresh', 'Provider batch'])
+        long_ago = timezone.now() - datetime.timedelta(hours=1)
+        retry, exhausted, fresh = [
+            GenerationJob.objects.create(prompt=prompt, status=GenerationJob.STATUS_RUNNING, worker='dead',
+                                         attempts=attempts, started_at=started_at)
+            for prompt, attempts, started_at in zip(prompts, (1, 3, 1), (long_ago, long_ago, timezone.now()))
+        ]
+        provider = enqueue_batch(prompts[3:], mode=GenerationBatch.MODE_MESSAGE_BATCHES)
+        provider.jobs.update(status=GenerationJob.STATUS_RUNNING, attempts=1, started_at=long_ago)
+
+        self.assertEqual(requeue_stale_jobs(datetime.timedelta(minutes=10), max_attempts=3), 1)
+        statuses = dict(GenerationJob.objects.values_list('prompt__prompt_text', 'status'))
+        self.assertEqual(statuses, {'Retry': 'queued', 'Exhausted': 'failed', 'Fresh': 'running',
+                                    'Provider batch': 'running'})
+        retry.refresh_from_db()
+        exhausted.refresh_from_db()
+        self.assertEqual(retry.worker, '')
+        self.assertEqual(exhausted.error, 'Worker timed out')
+        # the requeued job is claimable again and counts its attempts
+        self.assertEqual(claim_next_job('worker-a').attempts, 2)
+    @override_settings(GENERATION_SINGLE_FLIGHT_LEASE=300, ANTHROPIC_MAX_RETRIES=3, ANTHROPIC_RATE_LIMIT_ENABLED=True,
+                       ANTHROPIC_RATE_LIMIT_MAX_WAIT=30, ANTHROPIC_CONNECT_TIMEOUT=5, ANTHROPIC_READ_TIMEOUT=120,
+                       ANTHROPIC_RETRY_BACKOFF=1, ANTHROPIC_RETRY_MAX_BACKOFF=30)
+    def test_running_jobs_are_left_alone_for_the_longest_generation(self):
+        # lease + 4 attempts of (wait + connect + read) + 3 backoffs + margin
+        self.assertEqual(max_generation_time(), datetime.timedelta(seconds=300 + 4 * 155 + 3 * 31 + 60))
+        prompt, = self.make_prompts(['Data Analyst'])
+        slow = GenerationJob.objects.create(prompt=prompt, status=GenerationJob.STATUS_RUNNING, worker='busy',
+                                            attempts=1, started_at=timezone.now() - datetime.timedelta(minutes=15))
+        out, err = io.StringIO(), io.StringIO()
+
+        call_command('run_generation_worker', '--once', stdout=out, stderr=err)
+        slow.refresh_from_db()
+        self.assertEqual((slow.status, slow.worker), (GenerationJob.STATUS_RUNNING, 'busy'))
+        self.assertEqual(err.getvalue(), '')
+
+        call_command('run_generation_worker', '--once', '--stale-after', '600', stdout=out, stderr=err)
+        self.assertIn('shorter than the longest generation', err.getvalue())
+        slow.refresh_from_db()
+        self.assertEqual(slow.attempts, 2)  # requeued and run again
+
+
+class GenerationWorkerTests(StubAnthropicMixin, TransactionTestCase):
+    """Workers and batch jobs run on threads with their own connections, so rows must be committed"""
+
+    def test_concurrent_workers_never_claim_a_job_twice(self):
+        jobs = [enqueue_generation(prompt) for prompt in self.make_prompts([f'Role {i}' for i in range(12)])]
+        claims = {}
+
+        def work(worker_id):
+            try:
+                claimed = []
+                while (job := claim_next_job(worker_id)) is not None:
+                    claimed.append(job.id)
+                claims[worker_id] = claimed
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, args=(f'worker-{i}',)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        claimed = [job_id for ids in claims.values() for job_id in ids]
+        self.assertEqual(len(claims), 4)
+        self.assertEqual(sorted(claimed), [job.id for job in jobs])
+        self.assertFalse(GenerationJob.objects.filter(attempts__gt=1).exists())
+
+    def test_worker_drains_the_queue_and_exits(self):
+        prompts = self.make_prompts(['Data Analyst', 'FAIL Engineer', 'Support Lead', 'Product Manager'])
+        jobs = [enqueue_generation(prompt) for prompt in prompts[:3]]
+        batch = enqueue_batch(prompts[3:])
+        out = io.StringIO()
+
+        call_command('run_generation_worker', '--max-jobs', '1', '--worker-id', 'worker-a', stdout=out)
+        # the batch is taken before standalone jobs
+        batch.refresh_from_db()
+        self.assertEqual(batch.status, GenerationBatch.STATUS_COMPLETED)
+        self.assertEqual(GenerationJob.objects.filter(status=GenerationJob.STATUS_QUEUED).count(), 2)
+
+        call_command('run_generation_worker', '--once', '--worker-id', 'worker-a', stdout=out)
+        statuses = [GenerationJob.objects.get(id=job.id).status for job in jobs]
+        self.assertEqual(statuses, ['succeeded', 'failed', 'succeeded'])
+        self.assertIn('stopped after 2 job(s)', out.getvalue())
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        # two worker processes sharing the table
+        self.cache = ResponseCache(max_entries=2, ttl=60)
+        self.other = ResponseCache(max_entries=2, ttl=60)
+        self.response = {'id': 'msg_1', 'content': [{'type': 'text', 'text': 'Cached'}]}
+
+    def hits(self, key):
+        return GenerationCacheEntry.objects.get(key=key).hit_count
+
+    def test_miss_then_hits_from_either_tier(self):
+        self.assertIsNone(self.cache.get('k'))
+        self.cache.set('k', 'assessment', 'claude-test', self.response)
+
+        with self.assertNumQueries(1):  # the row check; the response comes from memory
+            self.assertEqual(self.cache.get('k'), self.response)
+        with self.assertNumQueries(2):  # not in this process's LRU yet
+            self.assertEqual(self.other.get('k'), self.response)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.other.get('k'), self.response)
+        self.assertEqual(self.hits('k'), 3)
+
+    def test_lru_is_bounded(self):
+        for key in ('a', 'b', 'c'):
+            self.cache.set(key, 'question', 'claude-test', {'id': key})
+        self.assertEqual(list(self.cache._entries), ['b', 'c'])
+        self.assertEqual(self.cache.get('a'), {'id': 'a'})  # still in the table
+
+    def test_expired_entries_are_not_served(self):
+        self.cache.set('k', 'assessment', 'claude-test', self.response)
+        later = timezone.now() + datetime.timedelta(seconds=61)
+        with mock.patch('assessment.cache.timezone.now', return_value=later):
+            self.assertIsNone(self.cache.get('k'))
+            self.assertIsNone(self.other.get('k'))
+        self.assertNotIn('k', self.cache._entries)
+
+    def test_invalidation_reaches_other_processes(self):
+        self.cache.set('k', 'assessment', 'claude-test', self.response)
+        self.other.get('k')
+        self.assertIn('k', self.other._entries)
+
+        self.cache.invalidate('k')
+        self.assertIsNone(self.other.get('k'))
+        self.assertNotIn('k', self.other._entries)
+
+        self.cache.set('k', 'assessment', 'claude-test', self.response)
+        self.other.get('k')
+        call_command('clear_generation_cache', '--kind', 'assessment', stdout=io.StringIO())
+        self.assertIsNone(self.other.get('k'))
+
+    def test_rewrites_replace_remembered_responses(self):
+        self.cache.set('k', 'assessment', 'claude-test', self.response)
+        self.other.get('k')
+        with mock.patch('assessment.cache.timezone.now', return_value=timezone.now() + datetime.timedelta(seconds=1)):
+            self.cache.set('k', 'assessment', 'claude-test', {'id': 'msg_2'})
+        self.assertEqual(self.other.get('k'), {'id': 'msg_2'})
+
+
+class SummaryClient:
+    """Stands in for the Anthropic clients in ConversationContext: answers summary calls with a script"""
+
+    def __init__(self, *summaries):
+        self.summaries = list(summaries)
+        self.payloads = []
+
+    def _make_api_call(self, payload, kind='conversation'):
+        self.payloads.append(payload)
+        summary = self.summaries.pop(0)
+        if summary is None:
+            return {'error': True, 'message': 'overloaded', 'status_code': 529}
+        return {'content': [{'type': 'text', 'text': summary}]}
+
+
+class AsyncSummaryClient(SummaryClient):
+    async def _make_api_call(self, payload, kind='conversation'):
+        return super()._make_api_call(payload, kind)
+
+
+class ConversationContextTests(TestCase):
+    # 40 characters is 11 estimated tokens; a budget of 50 holds four turns
+    TURN = 'x' * 39
+
+    def setUp(self):
+        prompt = Prompt.objects.create(prompt_text='Data Analyst', question_types='Open-ended questions')
+        assessment = Assessment.objects.create(prompt=prompt, title='A', content='')
+        self.conversation = ConversationThread.objects.create(title='C', assessment=assessment)
+        self.turns = [
+            Message.objects.create(conversation=self.conversation, message_type=message_type,
+                                   content=f'{index}{self.TURN}')
+            for index, message_type in enumerate(['user', 'assistant'] * 3)
+        ]
+
+    def pending(self, content='latest question'):
+        return Message(conversation=self.conversation, message_type='user', content=content)
+
+    def build(self, client, conversation=None, pending=None):
+        context = ConversationContext(client, budget=50, retain=0.6)
+        return context.build(conversation or self.conversation, pending=pending or self.pending())
+
+    def test_history_within_budget_is_sent_verbatim(self):
+        client = SummaryClient()
+        summary, messages = ConversationContext(client, budget=1000).build(self.conversation, self.pending())
+        self.assertEqual(summary, '')
+        self.assertEqual([m['content'] for m in messages], [t.content for t in self.turns] + ['latest question'])
+        self.assertEqual([m['role'] for m in messages[:2]], ['user', 'assistant'])
+        self.assertEqual(client.payloads, [])
+
+    def test_oldest_turns_are_folded_into_the_summary(self):
+        client = SummaryClient('S1')
+        summary, messages = self.build(client)
+
+        self.assertEqual(summary, 'S1')
+        # the window opens with a user turn and ends with the pending one, once
+        self.assertEqual([m['content'] for m in messages], [self.turns[4].content, self.turns[5].content,
+                                                            'latest question'])
+        self.assertIn(self.turns[3].content, client.payloads[0]['messages'][0]['content'])
+        self.assertNotIn(self.turns[4].content, client.payloads[0]['messages'][0]['content'])
+        self.conversation.refresh_from_db()
+        self.assertEqual((self.conversation.summary, self.conversation.summary_last_message_id),
+                         ('S1', self.turns[3].id))
+
+        # the next turn starts from the summary and never repeats folded turns
+        summary, messages = self.build(SummaryClient())
+        self.assertEqual(summary, 'S1')
+        self.assertEqual(messages[0]['content'], self.turns[4].content)
+
+    def test_the_latest_turn_is_kept_even_alone_over_budget(self):
+        summary, messages = self.build(SummaryClient('S1'), pending=self.pending('y' * 400))
+        self.assertEqual(messages, [{'role': 'user', 'content': 'y' * 400}])
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summary_last_message_id, self.turns[-1].id)
+
+    def test_failed_summary_sends_the_turns_unsummarized(self):
+        with self.assertLogs('assessment.context', 'WARNING') as logs:
+            summary, messages = self.build(SummaryClient(None))
+        self.assertIn('overloaded', logs.output[0])
+        self.assertEqual(summary, '')
+        self.assertEqual([m['content'] for m in messages], [t.content for t in self.turns] + ['latest question'])
+        self.conversation.refresh_from_db()
+        self.assertEqual((self.conversation.summary, self.conversation.summary_last_message_id), ('', None))
+
+        # folding is retried on the next turn
+        summary, _ = self.build(SummaryClient('S1'))
+        self.assertEqual(summary, 'S1')
+
+    def test_concurrent_folds_do_not_overwrite_each_other(self):
+        stale = ConversationThread.objects.get(id=self.conversation.id)
+        self.build(SummaryClient('S1'))
+
+        summary, messages = self.build(SummaryClient('S2'), conversation=stale)
+        # this request still gets a summary covering what it folded
+        self.assertEqual(summary, 'S2')
+        self.assertEqual(messages[-1]['content'], 'latest question')
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summary, 'S1')
+
+    def test_async_build_matches(self):
+        client = AsyncSummaryClient('S1')
+        context = ConversationContext(client, budget=50, retain=0.6)
+        summary, messages = async_to_sync(context.abuild)(self.conversation, pending=self.pending())
+        self.assertEqual(summary, 'S1')
+        self.assertEqual([m['content'] for m in messages], [self.turns[4].content, self.turns[5].content,
+                                                            'latest question'])
+
+        failed = ConversationContext(AsyncSummaryClient(None), budget=50, retain=0.6)
+        with self.assertLogs('assessment.context', 'WARNING'):
+            summary, messages = async_to_sync(failed.abuild)(self.conversation, pending=self.pending('y' * 400))
+        self.assertEqual(summary, 'S1')
+        self.assertEqual(len(messages), 3)
+
+
+class GenerationPersistenceTests(StubAnthropicMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = AssessmentService()
+        self.prompt, = self.make_prompts(['Data Analyst'])
+
+    def test_assessment_is_stored_atomically(self):
+        result = self.service.generate_assessment_from_prompt(self.prompt.id, use_cache=False)
+
+        assessment = Assessment.objects.get(id=result['assessment_id'])
+        user_turn, reply = Message.objects.filter(conversation_id=result['conversation_id']).order_by('id')
+        self.assertIn('"Data Analyst"', user_turn.content)
+        self.assertEqual(reply.response_blob_id, assessment.response_blob_id)
+
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=RuntimeError('disk full')):
+            result = self.service.generate_assessment_from_prompt(self.prompt.id, use_cache=False)
+        self.assertEqual(result, {'error': 'disk full'})
+        self.assertEqual(Assessment.objects.count(), 1)
+        self.assertEqual(ConversationThread.objects.count(), 1)
+
+    def test_unreferenced_response_blobs_are_pruned(self):
+        kept = Assessment.objects.get(id=self.service.generate_assessment_from_prompt(self.prompt.id)['assessment_id'])
+        dropped = Assessment.objects.get(
+            id=self.service.generate_assessment_from_prompt(self.prompt.id, use_cache=False)['assessment_id']
+        )
+        replaced = Message.objects.get(conversation__assessment=kept, message_type='assistant')
+        replaced.raw_response = {'id': 'msg_edited'}
+        replaced.save()
+        dropped.raw_response = {'id': 'msg_dropped'}
+        dropped.save()
+        dropped.delete()
+        self.assertEqual(ResponseBlob.objects.count(), 3)
+
+        # blobs just stored may be about to be referenced
+        call_command('prune_response_blobs', stdout=io.StringIO())
+        self.assertEqual(ResponseBlob.objects.count(), 3)
+
+        ResponseBlob.objects.update(created_at=timezone.now() - datetime.timedelta(hours=2))
+        out = io.StringIO()
+        call_command('prune_response_blobs', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Removed 1 stored response')
+        self.assertEqual(set(ResponseBlob.objects.values_list('id', flat=True)),
+                         {kept.response_blob_id, replaced.response_blob_id})
+        self.assertEqual(Assessment.objects.get(id=kept.id).raw_response, kept.raw_response)
+
+    def test_turn_is_stored_only_with_its_reply(self):
+        conversation_id = self.service.generate_assessment_from_prompt(self.prompt.id)['conversation_id']
+
+        self.assertIn('error', self.service.continue_conversation(conversation_id, 'FAIL this turn'))
+        self.assertEqual(Message.objects.filter(conversation_id=conversation_id).count(), 2)
+
+        result = self.service.continue_conversation(conversation_id, 'Add a SQL question')
+        turns = list(Message.objects.filter(conversation_id=conversation_id).order_by('time_stamp', 'id'))
+        self.assertEqual([m.message_type for m in turns], ['user', 'assistant', 'user', 'assistant'])
+        self.assertEqual(turns[2].content, 'Add a SQL question')
+        self.assertEqual(result['message_id'], turns[3].id)
+
+
+class PromptPayloadTests(StubAnthropicMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = AssessmentService()
+        self.client = anthropic_client.get_client()
+
+    def test_conversation_turns_have_their_own_instructions(self):
+        payload = self.service._conversation_request('They want SQL only.', [
+            {'role': 'user', 'content': 'Create an assessment'},
+            {'role': 'assistant', 'content': 'ASSESSMENT OVERVIEW: ...'},
+            {'role': 'user', 'content': 'Drop question 2'},
+        ])
+        self.assertNotIn('tools', payload)
+        self.assertEqual([block['text'] for block in payload['system']], [
+            CONVERSATION_SYSTEM_PROMPT, 'Summary of the earlier conversation:\nThey want SQL only.'
+        ])
+        self.assertNotIn(TOOL_NAME, json.dumps(payload['system']))
+        # far below the cacheable minimum, so nothing is marked
+        self.assertNotIn('cache_control', json.dumps(payload))
+        self.assertEqual(payload['messages'][-1], {'role': 'user', 'content': 'Drop question 2'})
+
+    def test_long_conversations_mark_the_newest_turn(self):
+        history = [{'role': 'user', 'content': 'Create an assessment'},
+                   {'role': 'assistant', 'content': 'Question text. ' * 400},
+                   {'role': 'user', 'content': 'Drop question 2'}]
+        payload = self.service._conversation_request('', history)
+        self.assertEqual(payload['messages'][-1]['content'], [
+            {'type': 'text', 'text': 'Drop question 2', 'cache_control': {'type': 'ephemeral'}}
+        ])
+        self.assertEqual(json.dumps(payload).count('cache_control'), 1)
+
+    def test_assessment_prompt_is_marked_only_when_cacheable(self):
+        params = {'time_limit': 30, 'question_types': ['Open-ended questions']}
+        assessment = self.client.assessment_payload('Data Analyst', params)
+        question = self.client.question_payload('Data Analyst', 'SQL joins', params)
+        self.assertEqual(assessment['tools'][0]['name'], TOOL_NAME)
+        self.assertIn(TOOL_NAME, assessment['system'][0]['text'])
+        self.assertNotIn('cache_control', json.dumps([assessment, question]))
+
+        # the tool definition counts towards the assessment prefix
+        with mock.patch.object(anthropic_client, 'PROMPT_CACHE_MIN_TOKENS', 700):
+            assessment = self.client.assessment_payload('Data Analyst', params)
+            question = self.client.question_payload('Data Analyst', 'SQL joins', params)
+        self.assertEqual(assessment['system'][0]['cache_control'], {'type': 'ephemeral'})
+        self.assertNotIn('cache_control', question['system'][0])
+
+
+class StructuredAssessmentTests(StubAnthropicMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = AssessmentService()
+        self.prompt, = self.make_prompts(['Data Analyst'])
+        user = User(email='manager@example.com')
+        user.set_password('secret')
+        user.save()
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {user.generate_jwt()}')
+
+    def test_questions_are_stored_and_served(self):
+        result = self.service.generate_assessment_from_prompt(self.prompt.id, use_cache=False)
+
+        self.assertTrue(result['content'].startswith('ASSESSMENT OVERVIEW:\nStub\n\nASSESSMENT QUESTIONS:\n1. '))
+        questions = Question.objects.filter(assessment_id=result['assessment_id'])
+        self.assertEqual([(q.position, q.question_type, q.dimension, q.time_minutes) for q in questions],
+                         [(1, 'multiple_choice', 'performance', 5), (2, 'open_ended', 'behavioral', 10)])
+        self.assertEqual(questions[0].options, ['GROUP BY', 'OVER (PARTITION BY ...)'])
+
+        response = self.api.get(f"/assessment/assessments/{result['assessment_id']}/questions/")
+        self.assertEqual([q['title'] for q in response.data], ['Window functions', 'Disagreement'])
+        response = self.api.get('/assessment/questions/', {'dimension': 'behavioral', 'fields': 'id,text'})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'text'})
+
+    def test_invalid_output_is_rejected_and_not_cached(self):
+        invalid = dict(STUB_ASSESSMENT, questions=[dict(STUB_ASSESSMENT['questions'][0], dimension='luck')])
+        message = StubAnthropicHandler._message
+
+        def patched(params):
+            response = message(params)
+            response['content'][0]['input'] = invalid
+            return response
+
+        with mock.patch.object(StubAnthropicHandler, '_message', staticmethod(patched)):
+            result = self.service.generate_assessment_from_prompt(self.prompt.id)
+        self.assertEqual(result, {'error': 'Invalid assessment output: question 1: dimension must be one of '
+                                           'performance, behavioral, cultural_fit'})
+        self.assertFalse(Assessment.objects.exists())
+        self.assertFalse(Question.objects.exists())
+        key = cache_key(self.service.assessment_payload(self.prompt))
+        self.assertIsNone(response_cache.get(key))
+        self.assertFalse(GenerationCacheEntry.objects.filter(key=key).exists())
+
+    def test_streamed_sections_add_up_to_the_stored_content(self):
+        events = list(self.service.stream_assessment_from_prompt(self.prompt.id, use_cache=False))
+        self.assertEqual(events[-1][0], 'done')
+        streamed = ''.join(data['text'] for event, data in events if event == 'delta')
+        self.assertEqual(streamed, events[-1][1]['content'])
+
+    def feed_in_pieces(self, document, rng):
+        renderer, released, offset = StreamingAssessmentRenderer(), [], 0
+        while offset < len(document):
+            step = rng.randint(1, 12)
+            released.append(renderer.feed({'type': 'content_block_delta', 'delta': {
+                'type': 'input_json_delta', 'partial_json': document[offset:offset + step],
+            }}))
+            offset += step
+            yield offset, ''.join(released)
+
+    def test_renderer_streams_text_that_adds_up_to_the_rendering(self):
+        assessment = json.loads(json.dumps(STUB_ASSESSMENT).replace('Stub', '  Stub \\u00e9\\" \\ud83d\\ude00 '))
+        response = {'content': [{'type': 'tool_use', 'name': 'record_assessment', 'input': assessment}]}
+        expected = render_assessment(parse_assessment(response))
+        # heading fields last: those questions are released whole, the rest still streams
+        reordered = dict(assessment, questions=[
+            {field: question[field] for field in sorted(question, key=lambda field: field == 'time_minutes')}
+            for question in assessment['questions']
+        ])
+        rng = random.Random(7)
+        for document in (json.dumps(assessment, indent=1), json.dumps(reordered), json.dumps(assessment)):
+            for _ in range(10):
+                for _, released in self.feed_in_pieces(document, rng):
+                    self.assertTrue(expected.startswith(released))
+                self.assertEqual(released, expected)
+
+    def test_renderer_releases_question_text_before_the_question_closes(self):
+        document = json.dumps(STUB_ASSESSMENT)
+        cut = document.index('ranks rows')
+        for offset, released in self.feed_in_pieces(document, random.Random(3)):
+            if offset >= cut + 12:
+                break
+        self.assertIn('5 minutes)\nWhich clause ranks', released)
+        self.assertNotIn('GROUP BY', released)
+
+
+class QuestionBankTests(StubAnthropicMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = AssessmentService()
+        self.params = {'skills': ['SQL', 'Python'], 'difficulty': 'Hard', 'question_types': 'Open-ended questions'}
+
+    def test_signatures_estimate_overlap(self):
+        first = question_bank.signature('Data Analyst', 'Window functions in SQL', ['SQL', 'Python'])
+        self.assertEqual(question_bank.unpack(question_bank.pack(first)), tuple(first))
+        close = question_bank.signature('Senior Data Analyst', 'SQL window functions', ['sql', 'python'])
+        unrelated = question_bank.signature('Support Lead', 'Handling an angry customer', ['empathy'])
+        self.assertGreaterEqual(question_bank.similarity(first, close), 0.6)
+        self.assertLess(question_bank.similarity(first, unrelated), 0.2)
+        self.assertEqual(question_bank.normalize_question_type('Situational judgment'), 'situational')
+
+    def test_similar_requests_reuse_banked_questions(self):
+        generated = self.service.generate_question('Data Analyst', 'Window functions in SQL', self.params)
+        self.assertEqual(generated['source'], 'generated')
+        self.assertEqual(llm_metrics.flush(), 1)
+
+        reused = self.service.generate_question('Senior Data Analyst', 'SQL window functions', self.params)
+        self.assertEqual(reused['source'], 'bank')
+        self.assertEqual(reused['questions'][0]['id'], generated['questions'][0]['id'])
+        self.assertEqual(llm_metrics.flush(), 0)
+        self.assertEqual(BankedQuestion.objects.get().reuse_count, 1)
+
+        # another difficulty, an unrelated area or an explicit regeneration all generate
+        easy = dict(self.params, difficulty='easy')
+        self.assertEqual(self.service.generate_question('Data Analyst', 'Window functions in SQL', easy)['source'],
+                         'generated')
+        self.assertEqual(self.service.generate_question('Data Analyst', 'Stakeholder updates', self.params)['source'],
+                         'generated')
+        self.assertEqual(self.service.generate_question('Data Analyst', 'SQL window functions', self.params,
+                                                        reuse=False)['source'], 'generated')
+        self.assertEqual(llm_metrics.flush(), 3)
+
+    def test_assessment_questions_are_banked(self):
+        prompt, = self.make_prompts(['Data Analyst'])
+        self.service.generate_assessment_from_prompt(prompt.id, use_cache=False)
+        self.assertEqual(BankedQuestion.objects.filter(question__isnull=False).count(), 2)
+
+        user = User(email='manager@example.com')
+        user.set_password('secret')
+        user.save()
+        response = self.client.post('/assessment/questions/generate/', {
+            'role': 'Data Analyst', 'area': 'Window functions', 'skills': ['communication'], 'difficulty': 'medium',
+            'question_types': 'Multiple choice',
+        }, content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {user.generate_jwt()}')
+        self.assertEqual(response.status_code, 200)
+        question, = response.json()['questions']
+        self.assertTrue(question['content'].startswith('Window functions (Multiple choice, Performance, 5 minutes)'))
+        self.assertEqual(question['question_type'], 'multiple_choice')
+
+
+class AsyncViewTests(StubAnthropicMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        user = User(email='manager@example.com')
+        user.set_password('secret')
+        user.save()
+        self.api = AsyncClient()
+        self.auth = {'authorization': f'Bearer {user.generate_jwt()}'}
+        self.prompt, = self.make_prompts(['Data Analyst'])
+
+    async def test_generate_stream_then_add_message(self):
+        response = await self.api.post(f'/assessment/prompts/{self.prompt.id}/generate_stream/', headers=self.auth)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn('event: delta', body)
+        done = json.loads(body.split('event: done\ndata: ')[1].split('\n')[0])
+
+        url = f"/assessment/conversations/{done['conversation_id']}/add_message/"
+        response = await self.api.post(
+            url, {'message': 'Add a SQL question'}, content_type='application/json', headers=self.auth
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await Message.objects.filter(conversation_id=done['conversation_id']).acount(), 4)
+
+        response = await self.api.post(url, {}, content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 400)
+
+    async def test_requires_authentication(self):
+        # exactly what the DRF viewsets answer
+        for headers in ({}, {'authorization': 'Bearer not-a-token'}):
+            viewset_response = await self.api.get('/assessment/prompts/', headers=headers)
+            response = await self.api.post(f'/assessment/conversations/{self.prompt.id}/add_message/', headers=headers)
+            self.assertEqual(response.status_code, viewset_response.status_code)
+            self.assertEqual(response.json(), viewset_response.json())
+            response = await self.api.post(f'/assessment/prompts/{self.prompt.id}/generate_stream/', headers=headers)
+            self.assertEqual(response.status_code, viewset_response.status_code)
+            self.assertEqual(response.content.decode(), format_sse('error', viewset_response.json()))
+
+    async def test_asgi_streams_from_async_generators(self):
+        response = await self.api.post(f'/assessment/prompts/{self.prompt.id}/generate_stream/', headers=self.auth)
+        self.assertTrue(response.is_async)
+        self.assertIn('event: done', b''.join([chunk async for chunk in response.streaming_content]).decode())
+
+    def test_wsgi_streams_from_sync_generators(self):
+        # an async iterator would be collected whole before the first byte under WSGI
+        auth = {'HTTP_AUTHORIZATION': self.auth['authorization']}
+        response = self.client.post(f'/assessment/prompts/{self.prompt.id}/generate_stream/', **auth)
+        self.assertFalse(response.is_async)
+        body = b''.join(response.streaming_content).decode()
+        self.assertIn('event: delta', body)
+        done = json.loads(body.split('event: done\ndata: ')[1].split('\n')[0])
+
+        url = f"/assessment/conversations/{done['conversation_id']}/add_message_stream/"
+        response = self.client.post(url, {'message': 'Add a SQL question'}, content_type='application/json', **auth)
+        self.assertFalse(response.is_async)
+        self.assertIn('event: done', b''.join(response.streaming_content).decode())
+        response = self.client.post(
+            f"/assessment/conversations/{done['conversation_id']}/add_message/",
+            {'message': 'One more'}, content_type='application/json', **auth,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Message.objects.filter(conversation_id=done['conversation_id']).count(), 6)
+
+    async def test_errors_are_rendered_like_drf_actions(self):
+        url = f'/assessment/conversations/{self.prompt.id}/add_message_stream/'
+        response = await self.api.post(url, {}, content_type='application/json',
+                                       headers={**self.auth, 'accept': 'text/event-stream'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.content.decode(), format_sse('error', {'error': 'Message content is required'}))
+
+        response = await self.api.post(url, '{', content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 400)
+        response = await self.api.get(url, headers=self.auth)
+        self.assertEqual(response.status_code, 405)
+
+    async def test_throttle_classes_apply(self):
+        class OnePerMinute(UserRateThrottle):
+            rate = '1/min'
+
+        cache.clear()
+        url = f'/assessment/conversations/{self.prompt.id}/add_message/'
+        with mock.patch.object(APIView, 'throttle_classes', [OnePerMinute]):
+            first = await self.api.post(url, {}, content_type='application/json', headers=self.auth)
+            second = await self.api.post(url, {}, content_type='application/json', headers=self.auth)
+        self.assertEqual(first.status_code, 400)
+        self.assertEqual(second.status_code, 429)
+        self.assertIn('Retry-After', second)
+
+
+class ScriptedAdapter(requests.adapters.BaseAdapter):
+    """
+    Transport answering each request with the next (status, headers) or
+    (status, headers, body) step, or raising the next exception
+    """
+
+    def __init__(self, script):
+        super().__init__()
+        self.script = list(script)
+        self.calls = 0
+
+    def send(self, request, **kwargs):
+        self.calls += 1
+        step = self.script.pop(0)
+        if isinstance(step, Exception):
+            raise step
+        status, headers, *body = step
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        response._content = body[0] if body else json.dumps(
+            {'id': 'msg_1', 'content': []} if status == 200 else {'error': {}}
+        ).encode()
+        response.request = request
+        response.url = request.url
+        response.elapsed = datetime.timedelta(milliseconds=5)
+        return response
+
+    def close(self):
+        pass
+
+
+@override_settings(ANTHROPIC_RETRY_BACKOFF=1, ANTHROPIC_RETRY_MAX_BACKOFF=8)
+class RetryTests(TestCase):
+    payload = {'model': 'claude-test', 'max_tokens': 10, 'messages': [{'role': 'user', 'content': 'Hi'}]}
+
+    def setUp(self):
+        sleep = mock.patch('assessment.anthropic_client.time.sleep')
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+        # the longest wait the jitter allows
+        uniform = mock.patch('assessment.anthropic_client.random.uniform', side_effect=lambda low, high: high)
+        uniform.start()
+        self.addCleanup(uniform.stop)
+
+    def post(self, *script, max_retries=3):
+        client = AnthropicClient(api_key='test', max_retries=max_retries, api_base='http://anthropic.test')
+        client.rate_limiter = None
+        self.adapter = ScriptedAdapter(script)
+        client.session.mount('http://', self.adapter)
+        return client._post(self.payload, 'assessment')
+
+    def delays(self):
+        return [call.args[0] for call in self.sleep.call_args_list]
+
+    def test_retries_overload_and_server_errors_with_capped_backoff(self):
+        result = self.post((529, {}), (500, {}), (503, {}), (200, {}))
+        self.assertEqual(result['id'], 'msg_1')
+        self.assertEqual(self.adapter.calls, 4)
+        self.assertEqual(self.delays(), [1, 2, 4])
+
+        client = AnthropicClient(api_key='test')
+        self.assertEqual([client._retry_delay(attempt) for attempt in (3, 4, 10)], [8, 8, 8])
+
+    def test_retry_after_is_honoured_and_capped(self):
+        self.post((429, {'retry-after': '2'}), (429, {'retry-after': '600'}), (429, {'retry-after': 'soon'}),
+                  (200, {}))
+        # server value plus up to one backoff unit of jitter, at most the cap; unparseable falls back to backoff
+        self.assertEqual(self.delays(), [3, 9, 4])
+
+    def test_gives_up_after_max_retries(self):
+        result = self.post((502, {}), (502, {}), (502, {}), max_retries=2)
+        self.assertEqual(self.adapter.calls, 3)
+        self.assertEqual((result['error'], result['status_code']), (True, 502))
+
+    def test_client_errors_are_not_retried(self):
+        for status in (400, 401, 404, 413):
+            result = self.post((status, {}))
+            self.assertEqual(self.adapter.calls, 1)
+            self.assertEqual(result['status_code'], status)
+        self.assertEqual(self.delays(), [])
+
+    def test_connection_failures_are_retried_but_read_timeouts_are_not(self):
+        result = self.post(requests.exceptions.ConnectTimeout('connect'),
+                           requests.exceptions.ConnectionError('reset'), (200, {}))
+        self.assertEqual(result['id'], 'msg_1')
+        self.assertEqual(self.adapter.calls, 3)
+
+        result = self.post(requests.exceptions.ReadTimeout('slow'), (200, {}))
+        self.assertEqual(self.adapter.calls, 1)
+        self.assertEqual((result['error'], result['status_code']), (True, None))
+
+    def test_rate_limited_retries_wait_in_the_limiter(self):
+        limiter = mock.Mock()
+        client = AnthropicClient(api_key='test', max_retries=1, api_base='http://anthropic.test')
+        client.rate_limiter = limiter
+        client.session.mount('http://', ScriptedAdapter([(429, {'retry-after': '5'}), (200, {})]))
+        self.assertEqual(client._post(self.payload, 'assessment')['id'], 'msg_1')
+        self.assertEqual(limiter.acquire.call_count, 2)
+        self.assertEqual(self.delays(), [])
+
+
+class CassetteTests(StubAnthropicMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'calls.jsonl')
+        self.payload = {'model': 'claude-test', 'max_tokens': 100, 'messages': [{'role': 'user', 'content': 'Data Analyst'}]}
+
+    def make_client(self, mode, latency_scale=1.0, api_base=None):
+        client = AnthropicClient(
+            api_key='test', max_retries=0, cassette=Cassette(self.path, mode, latency_scale),
+            api_base=api_base or f'http://127.0.0.1:{self.server.server_port}',
+        )
+        client.rate_limiter = None
+        return client
+
+    def test_replay_serves_recorded_calls_without_network(self):
+        recorder = self.make_client('record')
+        recorded = recorder._post(self.payload, 'assessment')
+        recorded_events = list(recorder.stream(self.payload))
+
+        # nothing listens on the discard port, so a replay that hit the network would fail
+        replayer = self.make_client('replay', latency_scale=0, api_base='http://127.0.0.1:9')
+        self.assertEqual(replayer._post(dict(reversed(self.payload.items())), 'assessment'), recorded)
+        self.assertEqual(list(replayer.stream(self.payload)), recorded_events)
+        # identical calls cycle through the recordings
+        self.assertEqual(replayer._post(self.payload, 'assessment'), recorded)
+
+        missing = replayer._post(dict(self.payload, max_tokens=5), 'assessment')
+        self.assertEqual(missing['status_code'], 404)
+
+    def test_async_recording_replays_with_scaled_latency(self):
+        StubAnthropicHandler.delay = 0.3
+        self.addCleanup(setattr, StubAnthropicHandler, 'delay', 0)
+        recorded = async_to_sync(AsyncAnthropicClient(self.make_client('record'))._post)(self.payload, 'assessment')
+
+        for scale, slower_than in ((1.0, 0.25), (0.0, 0)):
+            replayer = self.make_client('replay', latency_scale=scale, api_base='http://127.0.0.1:9')
+            start = time.perf_counter()
+            self.assertEqual(replayer._post(self.payload, 'assessment'), recorded)
+            elapsed = time.perf_counter() - start
+            self.assertGreaterEqual(elapsed, slower_than)
+            if not slower_than:
+                self.assertLess(elapsed, 0.25)
+
+
+class RateLimiterTests(StubAnthropicMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'ratelimit.sqlite3')
+
+    def make_limiter(self, max_wait=0):
+        limits = {'requests': 2, 'input_tokens': 1000, 'output_tokens': 1000}
+        return RateLimiter(self.path, scope='test', limits=limits, max_wait=max_wait)
+
+    def test_budget_is_shared_between_limiters(self):
+        first, second = self.make_limiter(), self.make_limiter()
+        self.assertEqual(first.try_acquire(10), 0)
+        self.assertEqual(second.try_acquire(10), 0)
+        # 2 requests per minute: the next slot opens in ~30s
+        self.assertAlmostEqual(first.try_acquire(10), 30, delta=1)
+        with self.assertRaises(RateLimitExceeded):
+            second.acquire(10)
+
+    def test_follows_response_headers(self):
+        limiter = self.make_limiter()
+        limiter.update({
+            'anthropic-ratelimit-requests-limit': '600',
+            'anthropic-ratelimit-input-tokens-limit': '60000',
+            'anthropic-ratelimit-input-tokens-remaining': '0',
+        }, 200)
+        # 60000 tokens/minute refill 1000 per second
+        self.assertAlmostEqual(limiter.try_acquire(500), 0.5, delta=0.1)
+
+        limiter.update({'retry-after': '20'}, 429)
+        self.assertAlmostEqual(limiter.try_acquire(1), 20, delta=1)
+
+    def test_concurrent_async_acquires_never_block_the_event_loop(self):
+        limiter = self.make_limiter()
+        limiter._connect()
+        # another process holds the bucket table's write lock for a while
+        other = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self.addCleanup(other.close)
+        other.execute('BEGIN IMMEDIATE')
+        release = threading.Timer(0.3, other.execute, ['COMMIT'])
+        release.start()
+        self.addCleanup(release.join)
+
+        async def run():
+            ticks = 0
+
+            async def heartbeat():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            beat = asyncio.ensure_future(heartbeat())
+            outcomes = await asyncio.gather(*[limiter.aacquire(10) for _ in range(4)], return_exceptions=True)
+            await limiter.aupdate({'retry-after': '60'}, 429)
+            beat.cancel()
+            return ticks, outcomes
+
+        ticks, outcomes = async_to_sync(run)()
+        # the loop kept running while the acquires waited on the lock
+        self.assertGreater(ticks, 10)
+        # two requests a minute: two callers get through, two are turned away
+        self.assertEqual(sum(outcome is None for outcome in outcomes), 2)
+        self.assertEqual(sum(isinstance(outcome, RateLimitExceeded) for outcome in outcomes), 2)
+        self.assertAlmostEqual(limiter.try_acquire(10), 60, delta=1)  # paused by the 429
+
+    def test_exhausted_budget_is_reported_as_rate_limited(self):
+        prompt, = self.make_prompts(['Data Analyst'])
+        limiter = anthropic_client._client.rate_limiter = self.make_limiter()
+        limiter.update({'anthropic-ratelimit-requests-remaining': '0'}, 200)
+
+        result = AssessmentService().generate_assessment_from_prompt(prompt.id, use_cache=False)
+        self.assertEqual(result['status_code'], 429)
+        self.assertAlmostEqual(result['retry_after'], 30, delta=1)
+        self.assertFalse(Assessment.objects.exists())
+
+
+class SingleFlightTests(StubAnthropicMixin, TransactionTestCase):
+    def test_concurrent_identical_generations_share_one_call(self):
+        prompt, = self.make_prompts(['Data Analyst'])
+        StubAnthropicHandler.delay = 0.5
+        self.addCleanup(setattr, StubAnthropicHandler, 'delay', 0)
+
+        results = []
+        def generate():
+            results.append(AssessmentService().generate_assessment_from_prompt(prompt.id, use_cache=False))
+            connection.close()
+        threads = [threading.Thread(target=generate) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(Assessment.objects.count(), 1)
+        self.assertEqual({result['assessment_id'] for result in results}, {Assessment.objects.get().id})
+
+    def test_followers_in_other_processes_read_the_lock_row(self):
+        leader, follower = SingleFlight(60, 0.2, 0.01), SingleFlight(60, 0.2, 0.01)
+        self.assertTrue(leader.claim('key'))
+        self.assertFalse(follower.claim('key'))
+        self.assertIsNone(follower.wait('key', timeout=0.05))
+
+        leader.finish('key', {'assessment_id': 7})
+        # a request arriving while the result is fresh does not wipe it from
+        # followers still polling; it is served the result as well
+        late = SingleFlight(60, 0.2, 0.01)
+        self.assertFalse(late.claim('key'))
+        self.assertEqual(follower.wait('key'), {'assessment_id': 7})
+        self.assertEqual(late.wait('key'), {'assessment_id': 7})
+
+        # once the result expires the next request starts a new flight
+        time.sleep(0.25)
+        self.assertTrue(late.claim('key'))
+
+    def test_fresh_claims_leave_the_finished_result_to_its_followers(self):
+        leader, follower, fresh = (SingleFlight(60, 10, 0.01) for _ in range(3))
+        self.assertTrue(leader.claim('key'))
+        self.assertFalse(follower.claim('key'))
+        self.assertEqual(follower.poll('key')[:2], (False, None))
+        flight = follower.poll('key')[2]
+        leader.finish('key', {'assessment_id': 7})
+
+        # a regeneration starts its own flight without taking the result away
+        self.assertTrue(fresh.claim('key', reuse_result=False))
+        self.assertEqual(follower.poll('key', flight)[:2], (True, {'assessment_id': 7}))
+        self.assertFalse(follower.claim('key'))
+        fresh.finish('key', {'assessment_id': 8})
+        self.assertEqual(follower.wait('key'), {'assessment_id': 8})
+
+
+@override_settings(METRICS_TOKEN='scrape-token')
+class CallMetricsTests(StubAnthropicMixin, TestCase):
+    def scrape(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def record(self, age_days=0, **fields):
+        call = LLMCall.objects.create(**{
+            'model': 'claude-3-opus-20240229', 'kind': 'assessment', 'status_code': 200, 'latency_ms': 800,
+            'stop_reason': 'end_turn', 'input_tokens': 10, 'output_tokens': 5, **fields,
+        })
+        LLMCall.objects.filter(id=call.id).update(created_at=timezone.now() - datetime.timedelta(days=age_days))
+        return call
+
+    def test_calls_are_recorded_and_exposed(self):
+        prompt, failing = self.make_prompts(['Data Analyst', 'FAIL Engineer'])
+        service = AssessmentService()
+        service.generate_assessment_from_prompt(prompt.id, use_cache=False)
+        service.generate_assessment_from_prompt(failing.id, use_cache=False)
+        self.assertFalse(LLMCall.objects.exists())  # written behind, not inline
+
+        self.assertEqual(llm_metrics.flush(), 2)
+        call = LLMCall.objects.get(status_code=200)
+        self.assertEqual((call.kind, call.input_tokens, call.output_tokens, call.stop_reason),
+                         ('assessment', 10, 5, 'tool_use'))
+        self.assertIsNotNone(call.ttfb_ms)
+
+        body = self.scrape()
+        labels = 'model="claude-3-opus-20240229",kind="assessment"'
+        self.assertIn(f'llm_request_duration_seconds_count{{{labels},status_code="200"}} 1', body)
+        self.assertIn(f'llm_request_duration_seconds_bucket{{{labels},status_code="400",le="+Inf"}} 1', body)
+        self.assertIn(f'llm_tokens_total{{{labels},type="output"}} 5', body)
+
+    def async_client_answering(self, body, delay=0.0):
+        async def content():
+            await asyncio.sleep(delay)
+            yield body
+
+        client = AsyncAnthropicClient(stub_client(self.server))
+        client.sync_client.rate_limiter = None
+        client.http = httpx.AsyncClient(transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, content=content())
+        ))
+        return client
+
+    def test_async_calls_stamp_the_first_byte_when_headers_arrive(self):
+        payload = {'model': 'claude-test', 'max_tokens': 10, 'messages': [{'role': 'user', 'content': 'Hi'}]}
+        body = json.dumps({'id': 'msg_1', 'content': [], 'stop_reason': 'end_turn', 'usage': {}}).encode()
+        client = self.async_client_answering(body, delay=0.3)
+        self.assertEqual(async_to_sync(client._post)(payload, 'assessment')['id'], 'msg_1')
+        call, = llm_metrics.drain()
+        self.assertGreaterEqual(call.latency_ms, 300)
+        self.assertLess(call.ttfb_ms, 200)
+
+    def test_async_calls_report_bodies_that_are_not_json(self):
+        payload = {'model': 'claude-test', 'max_tokens': 10, 'messages': [{'role': 'user', 'content': 'Hi'}]}
+        client = self.async_client_answering(b'<html>Bad gateway</html>')
+        error = async_to_sync(client._post)(payload, 'assessment')
+
+        # the sync client's error for the same body
+        sync_client = stub_client(self.server)
+        sync_client.rate_limiter = None
+        sync_client.session.mount('http://', ScriptedAdapter([(200, {}, b'<html>Bad gateway</html>')]))
+        expected = sync_client._post(payload, 'assessment')
+        self.assertEqual((error['error'], error['status_code']), (expected['error'], expected['status_code']))
+        self.assertTrue(error['message'])
+
+    @override_settings(METRICS_TOKEN='')
+    def test_endpoint_is_disabled_without_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_wrong_token_is_unauthorized(self):
+        for headers in ({}, {'HTTP_AUTHORIZATION': 'Bearer guess'}):
+            response = self.client.get('/metrics', **headers)
+            self.assertEqual(response.status_code, 401)
+            self.assertTrue(response['WWW-Authenticate'].startswith('Bearer'))
+
+    def test_totals_accumulate_per_label_set(self):
+        llm_metrics.drain()
+        for latency_ms in (300, 800, 45000):
+            llm_metrics.record(model='m', kind='assessment', status_code=200, latency_ms=latency_ms,
+                               ttfb_ms=200, stop_reason='end_turn', input_tokens=10, output_tokens=5)
+        llm_metrics.record(model='m', kind='assessment', status_code=None, latency_ms=1000)
+        self.assertEqual(llm_metrics.flush(), 4)
+        self.assertEqual(LLMCallTotals.objects.count(), 2)
+        totals = LLMCallTotals.objects.get(status_code=200)
+        self.assertEqual((totals.calls, totals.latency_ms, totals.ttfb_calls, totals.output_tokens),
+                         (3, 46100, 3, 15))
+        # cumulative counts per bound of LATENCY_BUCKETS
+        self.assertEqual(totals.latency_buckets, [1, 2, 2, 2, 2, 2, 2, 3, 3])
+
+        body = self.scrape()
+        self.assertIn('llm_request_duration_seconds_bucket{model="m",kind="assessment",status_code="200",le="1"} 2',
+                      body)
+        self.assertIn('llm_request_duration_seconds_count{model="m",kind="assessment",status_code="none"} 1', body)
+        self.assertIn('llm_time_to_first_byte_seconds_count{model="m",kind="assessment",streamed="false"} 3', body)
+        self.assertIn('llm_stop_reasons_total{model="m",stop_reason="end_turn"} 3', body)
+
+    def test_pruning_keeps_recent_calls_and_the_totals(self):
+        llm_metrics.drain()
+        llm_metrics.record(model='m', kind='question', status_code=200, latency_ms=500, output_tokens=7)
+        llm_metrics.flush()
+        LLMCall.objects.update(created_at=timezone.now() - datetime.timedelta(days=40))
+        recent = self.record(age_days=2)
+
+        out = io.StringIO()
+        with override_settings(LLM_METRICS_RETENTION_DAYS=30):
+            call_command('prune_llm_calls', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Removed 1 call record')
+        self.assertEqual(list(LLMCall.objects.values_list('id', flat=True)), [recent.id])
+        self.assertIn('llm_tokens_total{model="m",kind="question",type="output"} 7', self.scrape())
+
+        call_command('prune_llm_calls', days=1, stdout=io.StringIO())
+        self.assertFalse(LLMCall.objects.exists())
+
+
+class QueryBudgetTests(StubAnthropicMixin, TestCase):
+    """
+    Every endpoint benchmarked by benchmark_api stays within its query
+    budget. Several rows per list keep N+1 queries visible.
+    """
+
+    def test_endpoints_stay_within_query_budgets(self):
+        ids = seed(scale=0.4)
+        for endpoint in ENDPOINTS:
+            with self.subTest(endpoint.name):
+                result = run_endpoint(self.client, endpoint, ids, iterations=2)
+                self.assertTrue(result['status_ok'], result['status_codes'])
+                self.assertLessEqual(result['queries'], endpoint.max_queries)
+
+
+class ConversationFixtureMixin:
+    def setUp(self):
+        user = User(email='manager@example.com')
+        user.set_password('secret')
+        user.save()
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {user.generate_jwt()}')
+
+    def make_conversations(self, count):
+        prompt = Prompt.objects.create(prompt_text='Data Analyst', question_types='Open-ended questions')
+        for i in range(count):
+            assessment = Assessment.objects.create(prompt=prompt, title=f'A{i}', content='')
+            conversation = ConversationThread.objects.create(title=f'C{i}', assessment=assessment)
+            for turn in ('first', 'second', f'last {i}'):
+                Message.objects.create(conversation=conversation, message_type='user', content=turn)
+
+
+class ConversationListingTests(ConversationFixtureMixin, TestCase):
+    def test_query_count_is_independent_of_page_size(self):
+        self.make_conversations(2)
+        self.api.get('/assessment/conversations/')  # warm the auth cache
+        with self.assertNumQueries(2):
+            self.api.get('/assessment/conversations/')
+
+        self.make_conversations(10)
+        with self.assertNumQueries(2):
+            response = self.api.get('/assessment/conversations/')
+
+        self.assertEqual(len(response.data), 12)
+        self.assertTrue(all(item['message_count'] == 3 for item in response.data))
+        self.assertTrue(all(item['last_message']['content'].startswith('last') for item in response.data))
+
+
+class ServerTimingMiddlewareTests(ConversationFixtureMixin, TestCase):
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=1)
+    def test_sampled_requests_report_server_timing(self):
+        self.make_conversations(3)
+        with self.assertLogs('request_timing', 'INFO') as logs:
+            response = self.api.get('/assessment/conversations/')
+
+        timing = response['Server-Timing']
+        self.assertIn('total;dur=', timing)
+        self.assertIn('db;dur=', timing)
+        self.assertIn('serialize;dur=', timing)
+        self.assertNotIn('llm', timing)
+
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['view'], 'conversationthread-list')
+        self.assertGreaterEqual(line['db_queries'], 2)
+        self.assertEqual(line['response_bytes'], len(response.content))
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=1)
+    def test_db_metric_counts_every_query_through_the_execute_wrapper(self):
+        self.make_conversations(2)
+        with self.assertLogs('request_timing', 'INFO') as logs, CaptureQueriesContext(connection) as queries:
+            response = self.api.get('/assessment/conversations/')
+
+        self.assertIn(_record_query, connection.execute_wrappers)
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['db_queries'], len(queries))
+        self.assertIn(f'desc="{len(queries)} queries"', response['Server-Timing'])
+
+    def test_unsampled_requests_have_no_server_timing(self):
+        response = self.api.get('/assessment/conversations/')
+        self.assertNotIn('Server-Timing', response)
+
+
+class ListPaginationTests(TestCase):
+    def setUp(self):
+        user = User(email='manager@example.com')
+        user.set_password('secret')
+        user.save()
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {user.generate_jwt()}')
+        self.prompt = Prompt.objects.create(prompt_text='Data Analyst', question_types='Open-ended questions')
+
+    def walk(self, url, params):
+        pages, ids = 0, []
+        response = self.api.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200, response.data)
+            pages += 1
+            ids += [item['id'] for item in response.data['results']]
+            if not response.data['next']:
+                return pages, ids
+            response = self.api.get(response.data['next'])
+
+    def test_cursor_pages_cover_every_row_once_newest_first(self):
+        assessments = [Assessment.objects.create(prompt=self.prompt, title=f'A{i}', content='') for i in range(5)]
+        # same created_at: the id breaks the tie
+        Assessment.objects.update(created_at=assessments[0].created_at)
+        pages, ids = self.walk('/assessment/assessments/', {'page_size': 2})
+        self.assertEqual(pages, 3)
+        self.assertEqual(ids, [assessment.id for assessment in reversed(assessments)])
+
+    def test_lists_leave_out_heavy_columns_unless_asked(self):
+        Assessment.objects.create(prompt=self.prompt, title='A', content='Question text. ' * 100)
+        self.api.get('/assessment/assessments/')  # warm the auth cache
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get('/assessment/assessments/')
+        item, = response.data['results']
+        self.assertEqual(set(item), {'id', 'prompt', 'title', 'usage', 'created_at'})
+        self.assertFalse(any('"content"' in query['sql'] for query in queries.captured_queries))
+
+        item, = self.api.get('/assessment/assessments/', {'fields': 'id,content'}).data['results']
+        self.assertEqual(set(item), {'id', 'content'})
+        detail = self.api.get(f"/assessment/assessments/{item['id']}/").data
+        self.assertIn('raw_response', detail)
+
+    def test_unknown_fields_are_rejected(self):
+        for index in range(3):
+            Assessment.objects.create(prompt=self.prompt, title=f'A{index}', content='Question text. ' * 100)
+        for fields in ('bogus', 'id,bogus'):
+            response = self.api.get('/assessment/assessments/', {'fields': fields})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Unknown field: bogus', response.data['error'])
+        response = self.api.get(f'/assessment/assessments/{Assessment.objects.first().id}/', {'fields': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+
+        # an empty list is no list: the default projection
+        item = self.api.get('/assessment/assessments/', {'fields': ','}).data['results'][0]
+        self.assertEqual(set(item), {'id', 'prompt', 'title', 'usage', 'created_at'})
+
+    def test_question_fields_and_filters(self):
+        assessment = Assessment.objects.create(prompt=self.prompt, title='A', content='')
+        other = Assessment.objects.create(prompt=self.prompt, title='B', content='')
+        Question.objects.bulk_create([
+            Question(assessment=other, position=1, question_type='coding', dimension='performance',
+                     text='Write a query.', rubric='Correct joins'),
+            Question(assessment=assessment, position=2, question_type='open_ended', dimension='behavioral',
+                     text='Describe a conflict.', rubric='Owns the outcome', time_minutes=10),
+            Question(assessment=assessment, position=1, question_type='multiple_choice', dimension='performance',
+                     title='Joins', text='Which join keeps unmatched rows?', options=['INNER', 'LEFT'],
+                     rubric='LEFT', time_minutes=2),
+        ])
+
+        pages, ids = self.walk('/assessment/questions/', {'page_size': 1})
+        self.assertEqual(pages, 3)
+        ordered = Question.objects.order_by('assessment_id', 'position')
+        self.assertEqual(ids, [question.id for question in ordered])
+
+        results = self.api.get('/assessment/questions/', {'assessment': assessment.id}).data['results']
+        self.assertEqual([item['position'] for item in results], [1, 2])
+        self.assertEqual(results[0], {
+            'id': results[0]['id'], 'assessment': assessment.id, 'position': 1, 'question_type': 'multiple_choice',
+            'dimension': 'performance', 'title': 'Joins', 'text': 'Which join keeps unmatched rows?',
+            'options': ['INNER', 'LEFT'], 'rubric': 'LEFT', 'time_minutes': 2,
+        })
+        self.assertEqual(results[1]['options'], [])
+        results = self.api.get('/assessment/questions/', {'question_type': 'coding'}).data['results']
+        self.assertEqual([item['assessment'] for item in results], [other.id])
+        results = self.api.get('/assessment/questions/', {'dimension': 'performance', 'fields': 'id'}).data['results']
+        self.assertEqual(len(results), 2)
+
+    def test_question_positions_are_unique_per_assessment(self):
+        assessment = Assessment.objects.create(prompt=self.prompt, title='A', content='')
+        Question.objects.create(assessment=assessment, position=1, question_type='coding',
+                                dimension='performance', text='Q', rubric='R')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Question.objects.create(assessment=assessment, position=1, question_type='coding',
+                                    dimension='performance', text='Q', rubric='R')
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        user = User(email='manager@example.com')
+        user.set_password('secret')
+        user.save()
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {user.generate_jwt()}')
+        self.prompt = Prompt.objects.create(prompt_text='Backend Engineer', question_types='Open-ended questions')
+        self.assessment = Assessment.objects.create(
+            prompt=self.prompt, title='Rate limiting assessment', content='Design a rate limiter for an API gateway.'
+        )
+        self.conversation = ConversationThread.objects.create(title='C', assessment=self.assessment)
+
+    def search(self, **params):
+        response = self.api.get('/assessment/search/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [(hit['type'], hit['id']) for hit in response.data['results']]
+
+    def test_index_follows_bulk_writes_updates_and_deletes(self):
+        message, = Message.objects.bulk_create([
+            Message(conversation=self.conversation, message_type='user', content='Ask about caching layers')
+        ])
+        self.assertEqual(self.search(q='caching'), [('message', message.id)])
+
+        Message.objects.filter(id=message.id).update(content='Ask about sharding')
+        self.assertEqual(self.search(q='caching'), [])
+        self.assertEqual(self.search(q='shard'), [('message', message.id)])  # stemmed
+
+        message.delete()
+        self.assertEqual(self.search(q='sharding'), [])
+
+    def test_ranking_snippets_and_filters(self):
+        Question.objects.create(assessment=self.assessment, position=1, question_type='open_ended',
+                                dimension='performance', title='Token buckets', text='Explain rate limiting.',
+                                rubric='Mentions burst size', time_minutes=5)
+
+        response = self.api.get('/assessment/search/', {'q': 'rate limit*'})
+        results = response.data['results']
+        self.assertEqual([hit['type'] for hit in results], ['assessment', 'question'])  # title matches rank first
+        self.assertEqual(results[0]['prompt'], self.prompt.id)
+        self.assertIn('<mark>limiting</mark>', results[0]['snippet'])
+        self.assertEqual(results[1]['assessment'], self.assessment.id)
+
+        self.assertEqual(self.search(q='rate', type='question'), [('question', results[1]['id'])])
+        self.assertEqual(self.search(q='backend engineer'), [('prompt', self.prompt.id)])
+        self.assertEqual(self.search(q='"NEAR( AND -'), [])  # operators are not interpreted
+
+    def test_snippets_escape_stored_markup(self):
+        Message.objects.create(conversation=self.conversation, message_type='user',
+                               content='<img src=x onerror=alert(1)> caching & <b>sharding</b>')
+        hit, = self.api.get('/assessment/search/', {'q': 'caching'}).data['results']
+        self.assertEqual(
+            hit['snippet'],
+            '&lt;img src=x onerror=alert(1)&gt; <mark>caching</mark> &amp; &lt;b&gt;sharding&lt;/b&gt;',
+        )
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.api.get('/assessment/search/').status_code, 400)
+        self.assertEqual(self.api.get('/assessment/search/', {'q': 'rate', 'type': 'user'}).status_code, 400)
+        self.assertEqual(self.api.get('/assessment/search/', {'q': 'rate', 'limit': 'all'}).status_code, 400)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        user = User(email='manager@example.com')
+        user.set_password('secret')
+        user.save()
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {user.generate_jwt()}')
+        self.prompt = Prompt.objects.create(prompt_text='Data Analyst', question_types='Open-ended questions')
+        self.assessment = Assessment.objects.create(prompt=self.prompt, title='A', content='Question text. ' * 100,
+                                                    raw_response={'id': 'msg_1', 'content': []})
+        self.conversation = ConversationThread.objects.create(title='C', assessment=self.assessment)
+        Message.objects.create(conversation=self.conversation, message_type='user', content='first')
+
+    def assertNotModified(self, url, **headers):
+        with self.assertNumQueries(1):  # the version lookup; the user is cached
+            response = self.api.get(url, **headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        return response
+
+    def test_assessment_detail(self):
+        url = f'/assessment/assessments/{self.assessment.id}/'
+        response = self.api.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        self.assertEqual(self.assertNotModified(url, HTTP_IF_NONE_MATCH=etag)['ETag'], etag)
+        self.assertNotModified(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        # a projection is a different representation
+        response = self.api.get(url, {'fields': 'id,title'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        self.assessment.title = 'Renamed'
+        self.assessment.save()
+        response = self.api.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.api.get('/assessment/assessments/0/', HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+    def test_prompt_detail(self):
+        url = f'/assessment/prompts/{self.prompt.id}/'
+        etag = self.api.get(url)['ETag']
+        self.assertNotModified(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_conversation_messages(self):
+        url = f'/assessment/conversations/{self.conversation.id}/messages/'
+        etag = self.api.get(url)['ETag']
+        self.assertNotModified(url, HTTP_IF_NONE_MATCH=etag)
+
+        Message.objects.create(conversation=self.conversation, message_type='assistant', content='reply')
+        response = self.api.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+
+
+class QueryPlanTests(TestCase):
+    """
+    Runs EXPLAIN on every query the hot endpoints issue and fails if one of
+    the listed tables is read with a full table scan
+    """
+
+    def setUp(self):
+        self.user = User(email='manager@example.com')
+        self.user.set_password('secret')
+        self.user.save()
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {self.user.generate_jwt()}')
+
+        Company.objects.create(user=self.user, company_name='Acme')
+        prompt = Prompt.objects.create(prompt_text='Data Analyst', question_types='Open-ended questions')
+        assessment = Assessment.objects.create(prompt=prompt, title='A', content='')
+        self.conversation = ConversationThread.objects.create(title='C', assessment=assessment)
+        for turn in ('first', 'second'):
+            Message.objects.create(conversation=self.conversation, message_type='user', content=turn)
+
+    def full_scans(self, sql, tables):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # tiny test tables would always be seq scanned otherwise
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}')
+                plan = [row[0] for row in cursor.fetchall()]
+                return [line for line in plan for table in tables if f'Seq Scan on {table}' in line]
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = [row[-1] for row in cursor.fetchall()]
+            return [line for line in plan for table in tables if line.strip() == f'SCAN {table}']
+
+    def assertIndexBacked(self, url, tables):
+        self.api.get(url)  # warm the auth cache so only the endpoint's queries are captured
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get(url)
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            if query['sql'].startswith('SELECT'):
+                self.assertEqual(self.full_scans(query['sql'], tables), [], query['sql'])
+
+    def test_prompt_list(self):
+        self.assertIndexBacked('/assessment/prompts/', ['assessment_prompt'])
+
+    def test_assessment_list(self):
+        self.assertIndexBacked('/assessment/assessments/', ['assessment_assessment'])
+
+    def test_message_list(self):
+        self.assertIndexBacked('/assessment/messages/', ['assessment_message'])
+
+    def test_conversation_messages(self):
+        self.assertIndexBacked(f'/assessment/conversations/{self.conversation.id}/messages/', ['assessment_message'])
+
+    def test_conversation_list(self):
+        # threads themselves are listed in full; their messages must come from the index
+        self.assertIndexBacked('/assessment/conversations/', ['assessment_message'])
+
+    def test_company_list(self):
+        self.assertIndexBacked('/auth/companies/', ['users_company'])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite connection settings')
+class SQLiteConnectionTests(TransactionTestCase):
+    def test_new_connections_get_the_pragmas(self):
+        fresh = connections.create_connection(DEFAULT_DB_ALIAS)
+        try:
+            with fresh.cursor() as cursor:
+                values = {}
+                for name, _ in SQLITE_PRAGMAS:
+                    cursor.execute(f'PRAGMA {name}')
+                    values[name] = cursor.fetchone()[0]
+        finally:
+            fresh.close()
+        self.assertEqual(values['journal_mode'], 'wal')
+        self.assertEqual(values['busy_timeout'], SQLITE_BUSY_TIMEOUT_MS)
+        self.assertEqual(values['synchronous'], 1)  # NORMAL
+        self.assertEqual(values['temp_store'], 2)  # MEMORY
+
+    def test_transactions_take_the_write_lock_at_begin(self):
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                Prompt.objects.exists()
+        self.assertEqual(queries.captured_queries[0]['sql'], 'BEGIN IMMEDIATE')
@@ -1,16 +1,28 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import (
-    PromptViewSet, AssessmentViewSet, 
-    ConversationViewSet, MessageViewSet
+    PromptViewSet, AssessmentViewSet, QuestionViewSet,
+    ConversationViewSet, MessageViewSet, GenerationJobViewSet, GenerationBatchViewSet,
+    SearchViewSet
 )
 
 router = DefaultRouter()
 router.register(r'prompts', PromptViewSet)
 router.register(r'assessments', AssessmentViewSet)
+router.register(r'questions', QuestionViewSet)
 router.register(r'conversations', ConversationViewSet)
 router.register(r'messages', MessageViewSet)
+router.register(r'jobs', GenerationJobViewSet)
+router.register(r'batches', GenerationBatchViewSet)
+router.register(r'search', SearchViewSet, basename='search')
 
 urlpatterns = [
+    # async views for the endpoints that wait on the Anthropic API
+    path('prompts/<int:pk>/generate_stream/', async_views.generate_stream, name='prompt-generate-stream'),
+    path('questions/generate/', async_views.generate_question, name='question-generate'),
+    path('conversations/<int:pk>/add_message/', async_views.add_message, name='conversationthread-add-message'),
+    path('conversations/<int:pk>/add_message_stream/', async_views.add_message_stream,
+         name='conversationthread-add-message-stream'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -1,48 +1,133 @@
-from rest_framework import viewsets, status
+import hmac
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from django.db import transaction
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import Prompt, Assessment, ConversationThread, Message
+from .jobs import enqueue_generation
+from .metrics import llm_metrics, render_metrics
+from .mixins import SparseFieldsetMixin, conditional, updated_at_version
+from .models import Prompt, Assessment, Question, ConversationThread, Message, GenerationJob, GenerationBatch
 from .serializers import (
-    PromptSerializer, AssessmentSerializer,
-    ConversationThreadSerializer, MessageSerializer
+    PromptSerializer, AssessmentSerializer, QuestionSerializer,
+    ConversationThreadSerializer, MessageSerializer, GenerationJobSerializer,
+    GenerationBatchSerializer, GenerationBatchCreateSerializer
 )
-from .services import AssessmentService
+from .pagination import CreatedAtCursorPagination, MessageCursorPagination, QuestionCursorPagination
+from .renderers import format_sse
+from .search import SOURCE_NAMES, search
 
-class PromptViewSet(viewsets.ModelViewSet):
-    queryset = Prompt.objects.all().order_by('-created_at')
+
+def event_stream_response(events):
+    """
+    Wrap a service's (event, data) generator, sync or async, in a server-sent
+    events response. Async generators stream only under ASGI; WSGI servers
+    get the whole body at once, so WSGI requests must pass a sync one.
+    """
+    if hasattr(events, '__aiter__'):
+        async def frames():
+            async for event, data in events:
+                yield format_sse(event, data)
+        body = frames()
+    else:
+        body = (format_sse(event, data) for event, data in events)
+
+    response = StreamingHttpResponse(body, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # stop nginx from buffering the stream
+    return response
+
+
+class PromptViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
+    queryset = Prompt.objects.all().order_by('-created_at', '-id')
     serializer_class = PromptSerializer
+    pagination_class = CreatedAtCursorPagination
 
+    @conditional(updated_at_version(Prompt))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
-class AssessmentViewSet(viewsets.ModelViewSet):
-    queryset = Assessment.objects.all().order_by('-created_at')
+    @action(detail=True, methods=['post'])
+    def generate(self, request, pk=None):
+        regenerate = str(request.data.get('regenerate', '')).lower() in ('1', 'true', 'yes')
+        job = enqueue_generation(self.get_object(), regenerate=regenerate)
+        return Response(GenerationJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class AssessmentViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
+    queryset = Assessment.objects.all().order_by('-created_at', '-id')
     serializer_class = AssessmentSerializer
+    pagination_class = CreatedAtCursorPagination
+    # content and raw_response are multi-kilobyte; request them with ?fields=
+    list_fields = ['id', 'prompt', 'title', 'usage', 'created_at']
+
+    @conditional(updated_at_version(Assessment))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=True, methods=['get'])
+    @conditional(updated_at_version(Assessment))  # questions never change after generation
+    def questions(self, request, pk=None):
+        assessment = self.get_object()
+        serializer = QuestionSerializer(assessment.questions.order_by('position'), many=True)
+        return Response(serializer.data)
+
+class QuestionViewSet(SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Question.objects.all().order_by('assessment', 'position')
+    serializer_class = QuestionSerializer
+    pagination_class = QuestionCursorPagination
+
+    def get_queryset(self):
+        # ?assessment=, ?question_type= and ?dimension= narrow the list
+        queryset = super().get_queryset()
+        for field in ('assessment', 'question_type', 'dimension'):
+            value = self.request.query_params.get(field)
+            if value:
+                queryset = queryset.filter(**{field: value})
+        return queryset
 
 class ConversationViewSet(viewsets.ModelViewSet):
     queryset = ConversationThread.objects.all()
     serializer_class = ConversationThreadSerializer
-    
-    @action(detail=True, methods=['post'])
-    def add_message(self, request, pk=None):
-        user_message = request.data.get('message')
-        if not user_message:
-            return Response(
-                {'error': 'Message content is required'}, 
-                status=status.HTTP_400_BAD_REQUEST
+
+    def get_queryset(self):
+        # message count and latest message for every thread in two queries total
+        latest_message = Message.objects.filter(
+            id=Subquery(
+                Message.objects.filter(conversation=OuterRef('conversation'))
+                .order_by('-time_stamp', '-id')
+                .values('id')[:1]
             )
-        
-        service = AssessmentService()
-        result = service.continue_conversation(pk, user_message)
-        
-        if result.get('error'):
-            return Response({'error': result['error']}, status=status.HTTP_400_BAD_REQUEST)
-            
-        return Response(result)
-    
+        )
+        return ConversationThread.objects.annotate(
+            message_count=Count('messages')
+        ).prefetch_related(
+            Prefetch('messages', queryset=latest_message, to_attr='latest_messages')
+        )
+
+    # add_message and add_message_stream are async views, see async_views.py
+
+    def _messages_version(self, request, pk=None):
+        # messages are append-only, so the newest one versions the list
+        try:
+            latest = Message.objects.filter(conversation_id=pk).order_by('-time_stamp', '-id').values_list(
+                'id', 'time_stamp'
+            ).first()
+        except (TypeError, ValueError):
+            return None
+        if latest is None:
+            return None
+        return f"conversation:{pk}:messages:{latest[0]}", latest[1]
+
     @action(detail=True, methods=['get'])
+    @conditional(_messages_version)
     def messages(self, request, pk=None):
         try:
             conversation = ConversationThread.objects.get(pk=pk)
-            messages = conversation.messages.all().order_by('timestamp')
+            messages = conversation.messages.all().order_by('time_stamp').prefetch_related('response_blob')
             serializer = MessageSerializer(messages, many=True)
             return Response(serializer.data)
         except ConversationThread.DoesNotExist:
@@ -51,6 +136,70 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-class MessageViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Message.objects.all()
-    serializer_class = MessageSerializer
\ No newline at end of file
+class MessageViewSet(SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Message.objects.all().order_by('-time_stamp', '-id')
+    serializer_class = MessageSerializer
+    pagination_class = MessageCursorPagination
+    list_fields = ['id', 'conversation', 'message_type', 'content', 'usage', 'time_stamp']
+
+class SearchViewSet(viewsets.ViewSet):
+    """
+    GET ?q=...: ranked full-text search over assessments, prompts, questions
+    and messages; narrow it with ?type=assessment,message and ?limit=
+    """
+    max_limit = 100
+
+    def list(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        types = None
+        if request.query_params.get('type'):
+            types = request.query_params['type'].split(',')
+            unknown = set(types) - set(SOURCE_NAMES)
+            if unknown:
+                return Response(
+                    {'error': f"Unknown type: {', '.join(sorted(unknown))}; use {', '.join(SOURCE_NAMES)}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), self.max_limit)
+        except ValueError:
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({'query': query, 'results': search(query, types, limit)})
+
+class GenerationJobViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = GenerationJob.objects.all().order_by('-created_at')
+    serializer_class = GenerationJobSerializer
+
+class GenerationBatchViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = GenerationBatch.objects.all().prefetch_related('jobs').order_by('-created_at')
+    serializer_class = GenerationBatchSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = GenerationBatchCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            batch = serializer.save()
+        batch = self.get_queryset().get(pk=batch.pk)
+        return Response(GenerationBatchSerializer(batch).data, status=status.HTTP_202_ACCEPTED)
+
+
+@require_GET
+def metrics(request):
+    """
+    Prometheus scrape endpoint for upstream call latency and token usage
+    """
+    if not settings.METRICS_TOKEN:
+        # disabled until a token is configured
+        return HttpResponse(status=403)
+    expected = f'Bearer {settings.METRICS_TOKEN}'
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+        response = HttpResponse(status=401)
+        response['WWW-Authenticate'] = 'Bearer realm="metrics"'
+        return response
+    # include this process's calls that are still waiting in the buffer
+    llm_metrics.flush()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,115 @@
+"""
+Local stand-in for the Anthropic API, used by the tests and by the
+benchmark_api command so neither needs network access or an API key.
+Test support only: it lives outside the assessment app and is not shipped
+with it.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from assessment.anthropic_client import AnthropicClient, response_events
+from assessment.structured import TOOL_NAME
+
+# the record_assessment input the stub returns for every assessment
+STUB_ASSESSMENT = {
+    "overview": "Stub",
+    "questions": [
+        {"title": "Window functions", "type": "multiple_choice", "dimension": "performance", "time_minutes": 5,
+         "text": "Which clause ranks rows within a group?", "options": ["GROUP BY", "OVER (PARTITION BY ...)"],
+         "rubric": "B"},
+        {"title": "Disagreement", "type": "open_ended", "dimension": "behavioral", "time_minutes": 10,
+         "text": "Describe a time you disagreed with a stakeholder.", "rubric": "Listens, then decides with data."},
+    ],
+    "evaluation_guidelines": "Weigh reasoning over recall.",
+    "time_allocation": "5 and 10 minutes.",
+}
+
+
+class StubAnthropicHandler(BaseHTTPRequestHandler):
+    """
+    Minimal stand-in for the Messages (including streaming) and Message
+    Batches APIs. Any prompt whose role mentions FAIL is rejected.
+    """
+    batches = {}
+    delay = 0  # seconds each Messages API call takes
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    @staticmethod
+    def _message(params):
+        message = {
+            "id": "msg_stub", "type": "message", "role": "assistant", "model": params['model'],
+            "content": [{"type": "text", "text": "ASSESSMENT OVERVIEW:\nStub"}],
+            "stop_reason": "end_turn", "usage": {"input_tokens": 10, "output_tokens": 5},
+        }
+        if params.get('tool_choice', {}).get('name') == TOOL_NAME:
+            message.update(stop_reason="tool_use", content=[{
+                "type": "tool_use", "id": "toolu_stub", "name": TOOL_NAME, "input": STUB_ASSESSMENT,
+            }])
+        return message
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['content-length'])))
+        if self.path == '/v1/messages/batches':
+            batch_id = f"msgbatch_{len(self.batches) + 1}"
+            self.batches[batch_id] = body['requests']
+            return self._send_json(200, {"id": batch_id, "processing_status": "in_progress"})
+        time.sleep(self.delay)
+        if 'FAIL' in json.dumps(body['messages']):
+            return self._send_json(400, {"type": "error", "error": {"type": "invalid_request_error", "message": "bad"}})
+        if body.get('stream'):
+            return self._send_events(response_events(self._message(body)))
+        return self._send_json(200, self._message(body))
+
+    def _send_events(self, events):
+        data = "".join(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n" for event in events).encode()
+        self.send_response(200)
+        self.send_header('content-type', 'text/event-stream')
+        self.send_header('content-length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        base = f"http://{self.headers['host']}"
+        batch_id = self.path.split('/')[4]
+        if self.path.endswith('/results'):
+            lines = []
+            for item in self.batches[batch_id]:
+                if 'FAIL' in json.dumps(item['params']['messages']):
+                    result = {"type": "errored", "error": {"type": "error", "error": {"type": "invalid_request_error", "message": "bad"}}}
+                else:
+                    result = {"type": "succeeded", "message": self._message(item['params'])}
+                lines.append(json.dumps({"custom_id": item['custom_id'], "result": result}))
+            data = "\n".join(lines).encode()
+            self.send_response(200)
+            self.send_header('content-length', str(len(data)))
+            self.end_headers()
+            return self.wfile.write(data)
+        return self._send_json(200, {
+            "id": batch_id, "processing_status": "ended",
+            "results_url": f"{base}/v1/messages/batches/{batch_id}/results",
+        })
+
+
+def start_stub_server():
+    """Serve StubAnthropicHandler on a free local port from a daemon thread"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubAnthropicHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stub_client(server):
+    """An AnthropicClient for the stub server, without retries or rate limiting"""
+    client = AnthropicClient(api_key='test', api_base=f'http://127.0.0.1:{server.server_port}', max_retries=0)
+    client.rate_limiter = None
+    return client
@@ -1,8 +1,83 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
 from django.http import JsonResponse
 from rest_framework import authentication
 from rest_framework import exceptions
 from .models import User
 
+
+class UserCache:
+    """
+    Short-lived per-process cache of active users keyed by (user id, token
+    version), so authenticated requests skip the user lookup. Entries are
+    evicted by the signals in users.signals when a saved user's email,
+    password, active flag or token version may have changed; other processes
+    pick the change up within the TTL. Queryset updates send no signals and
+    must evict the users they change themselves.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, token_version):
+        key = (user_id, token_version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        # a copy, so one request cannot mutate another's request.user
+        return copy.copy(user)
+
+    def set(self, user):
+        with self._lock:
+            self._entries[(user.id, user.token_version)] = (copy.copy(user), time.monotonic() + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def evict(self, user_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == user_id]:
+                del self._entries[key]
+
+
+user_cache = UserCache(ttl=settings.AUTH_USER_CACHE_TTL, max_entries=settings.AUTH_USER_CACHE_MAX_ENTRIES)
+
+
+def resolve_user(payload):
+    """
+    Return the user a verified token payload belongs to, or None if the user
+    no longer exists or the token was issued before a password change.
+    Active users are served from user_cache.
+    """
+    user_id = payload.get('user_id')
+    token_version = payload.get('token_version', 0)
+
+    user = user_cache.get(user_id, token_version)
+    if user is not None:
+        return user
+
+    try:
+        user = User.objects.get(id=user_id)
+    except User.DoesNotExist:
+        return None
+    if user.token_version != token_version:
+        return None
+    if user.is_active:
+        user_cache.set(user)
+    return user
+
+
 class JWTAuthentication(authentication.BaseAuthentication):
     def authenticate(self, request):
         # Get the auth header
@@ -28,13 +103,12 @@ class JWTAuthentication(authentication.BaseAuthentication):
         if not user_id:
             raise exceptions.AuthenticationFailed('Token has no user ID')
         
-        try:
-            user = User.objects.get(id=user_id)
-            if not user.is_active:
-                raise exceptions.AuthenticationFailed('User is inactive')
-            
-            # Set user on the request for easy access in views
-            request.user = user
-            return (user, token)
-        except User.DoesNotExist:
-            raise exceptions.AuthenticationFailed('User not found')
\ No newline at end of file
+        user = resolve_user(payload)
+        if user is None:
+            raise exceptions.AuthenticationFailed('User not found')
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User is inactive')
+        
+        # Set user on the request for easy access in views
+        request.user = user
+        return (user, token)
@@ -12,6 +12,7 @@ class User(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+    token_version = models.IntegerField(default=0) #bumped to revoke issued tokens (password change, deactivation)
 
     @property
     def is_authenticated(self):
@@ -22,10 +23,23 @@ class User(models.Model):
         return False
 
     def set_password(self, password):
+        if self.password_hash:
+            # tokens issued under the old password stop working
+            self.token_version += 1
         password_bytes = password.encode('utf-8')
         salt = bcrypt.gensalt()
         self.password_hash = bcrypt.hashpw(password_bytes, salt).decode('utf-8')
 
+    def revoke_tokens(self):
+        """Invalidate every token issued so far (log out everywhere)"""
+        self.token_version += 1
+        self.save(update_fields=['token_version', 'updated_at'])
+
+    def deactivate(self):
+        self.is_active = False
+        self.token_version += 1
+        self.save(update_fields=['is_active', 'token_version', 'updated_at'])
+
     def check_password(self, password):
         password_bytes = password.encode('utf-8')
         hash_bytes = self.password_hash.encode('utf-8')
@@ -36,6 +50,7 @@ class User(models.Model):
             'user_id': self.id,
             'email': self.email,
             'full_name': self.full_name,
+            'token_version': self.token_version,
             'exp': datetime.utcnow() + timedelta(days=1)
         }
         token = jwt.encode(payload, settings.SECRET_KEY, algorithm='HS256')
@@ -1,13 +1,14 @@
 from rest_framework import serializers
+from workforce_backend.timing import TimedSerializerMixin
 
 from .models import User, Company
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'email', 'full_name']  
 
-class CompanySerializer(serializers.ModelSerializer):
+class CompanySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)  
 
     class Meta:
@@ -0,0 +1,25 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .authentication import user_cache
+from .models import User
+
+# changes to these fields must not be served from the auth cache
+AUTH_FIELDS = {'email', 'password_hash', 'is_active', 'token_version'}
+
+
+# Only save() and delete() send these signals. QuerySet.update() and
+# bulk_update() touching AUTH_FIELDS bypass them: bump token_version in the
+# same update (F('token_version') + 1) and call user_cache.evict() for each
+# affected user, or this process keeps serving them for up to the cache TTL.
+
+@receiver(post_save, sender=User)
+def evict_on_auth_change(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        return
+    if update_fields is None or AUTH_FIELDS.intersection(update_fields):
+        user_cache.evict(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def evict_on_delete(sender, instance, **kwargs):
+    user_cache.evict(instance.pk)
@@ -1,3 +1,62 @@
 from django.test import TestCase
+from rest_framework.test import APIClient
+from .authentication import user_cache
+from .models import User
 
-# Create your tests here.
+
+class JWTAuthenticationCacheTests(TestCase):
+    def setUp(self):
+        user_cache._entries.clear()
+        self.user = User(email='manager@example.com', full_name='Manager')
+        self.user.set_password('secret')
+        self.user.save()
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {self.user.generate_jwt()}')
+
+    def test_repeat_requests_skip_user_lookup(self):
+        self.api.get('/auth/user-details/')
+        with self.assertNumQueries(0):
+            response = self.api.get('/auth/user-details/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_deactivation_takes_effect_immediately(self):
+        self.api.get('/auth/user-details/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.api.get('/auth/user-details/').status_code, 403)
+
+    def test_password_change_revokes_tokens(self):
+        self.api.get('/auth/user-details/')
+        self.user.set_password('new secret')
+        self.user.save()
+        response = self.api.get('/auth/user-details/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'error': 'Token has been revoked'})
+        self.assertEqual(self.api.get('/auth/companies/').status_code, 403)
+
+    def test_deleted_user_token_is_rejected(self):
+        self.api.get('/auth/user-details/')
+        self.user.delete()
+        self.assertEqual(self.api.get('/auth/user-details/').status_code, 401)
+
+    def test_saves_do_not_reread_the_user(self):
+        with self.assertNumQueries(1):
+            self.user.save()
+        self.api.get('/auth/user-details/')
+        self.user.full_name = 'Team lead'
+        with self.assertNumQueries(1):
+            self.user.save(update_fields=['full_name'])
+        # no authentication field changed, so the cached user is still served
+        with self.assertNumQueries(0):
+            self.api.get('/auth/user-details/')
+
+    def test_deactivation_and_logout_everywhere_revoke_tokens(self):
+        self.api.get('/auth/user-details/')
+        self.user.revoke_tokens()
+        self.assertEqual(self.api.get('/auth/user-details/').status_code, 401)
+
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {self.user.generate_jwt()}')
+        self.assertEqual(self.api.get('/auth/user-details/').status_code, 200)
+        self.user.deactivate()
+        self.assertEqual(self.api.get('/auth/user-details/').status_code, 401)
+        self.assertFalse(User.objects.get(id=self.user.id).is_active)
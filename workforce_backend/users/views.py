@@ -7,8 +7,8 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 import json
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.exceptions import PermissionDenied
-from .authentication import JWTAuthentication
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
+from .authentication import JWTAuthentication, resolve_user
 
 
 class CompanyViewSet(viewsets.ModelViewSet):
@@ -18,8 +18,8 @@ class CompanyViewSet(viewsets.ModelViewSet):
     authentication_classes = [JWTAuthentication]
     
     def get_queryset(self):
-        # Filter by the authenticated user
-        return Company.objects.filter(user=self.request.user)
+        # Filter by the authenticated user; the serializer nests the user
+        return Company.objects.filter(user=self.request.user).select_related('user')
     
     def perform_create(self, serializer):
         # Set the user automatically when creating
@@ -107,6 +107,8 @@ def login(request):
                 'full_name': user.full_name
             }
         })
+    except AuthenticationFailed as e:
+        return JsonResponse({'error': str(e.detail)}, status=e.status_code)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
     
@@ -128,11 +130,10 @@ def get_user_profile(request):
             return JsonResponse({'error': 'Invalid or expired token'}, status=401)
         
         # Get user from payload
-        user_id = payload.get('user_id')
-        try:
-            user = User.objects.get(id=user_id)
-        except User.DoesNotExist:
-            return JsonResponse({'error': 'User not found'}, status=404)
+        user = resolve_user(payload)
+        if user is None:
+            # deleted user, or a token revoked by a password change
+            raise AuthenticationFailed('Token has been revoked')
         
         # Check if user is active
         if not user.is_active:
@@ -148,5 +149,7 @@ def get_user_profile(request):
                 'is_active': user.is_active
             }
         })
+    except AuthenticationFailed as e:
+        return JsonResponse({'error': str(e.detail)}, status=e.status_code)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
\ No newline at end of file
@@ -0,0 +1,92 @@
+"""
+Environment-driven database configuration.
+
+DB_ENGINE selects the backend (sqlite, the default, or postgres). SQLite
+connections get WAL journaling and a busy timeout through a
+connection_created hook, so concurrent conversation writes queue briefly
+instead of failing with "database is locked". PostgreSQL connections are
+persistent with health checks, or pooled when DB_POOL is set.
+"""
+import os
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _env_bool(name, default=False):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+
+SQLITE_BUSY_TIMEOUT_MS = _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)
+
+# applied to every new SQLite connection
+SQLITE_PRAGMAS = [
+    ('journal_mode', 'WAL'),  # readers no longer block the writer
+    ('busy_timeout', SQLITE_BUSY_TIMEOUT_MS),
+    ('synchronous', 'NORMAL'),  # safe with WAL; fsync at checkpoints instead of every commit
+    ('mmap_size', _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    ('temp_store', 'MEMORY'),
+]
+
+
+def database_config(base_dir):
+    """
+    Build DATABASES['default'] from the environment
+    """
+    engine = os.environ.get('DB_ENGINE', 'sqlite').lower()
+
+    if engine in ('postgres', 'postgresql'):
+        config = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'workforce'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+            'CONN_MAX_AGE': _env_int('DB_CONN_MAX_AGE', 600),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+        if _env_bool('DB_POOL'):
+            # psycopg 3 connection pool; Django requires persistent connections off with it
+            config['CONN_MAX_AGE'] = 0
+            config['OPTIONS']['pool'] = {
+                'min_size': _env_int('DB_POOL_MIN_SIZE', 2),
+                'max_size': _env_int('DB_POOL_MAX_SIZE', 20),
+                'timeout': _env_int('DB_POOL_TIMEOUT', 10),
+            }
+        return config
+
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('DB_NAME', base_dir / 'db.sqlite3'),
+        'CONN_MAX_AGE': _env_int('DB_CONN_MAX_AGE', 600),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+            # take the write lock at BEGIN so two transactions never deadlock upgrading
+            # from a read lock, which SQLite reports as "database is locked" immediately
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # file-backed so tests exercising worker threads get real locking
+        # instead of shared-cache in-memory "table is locked" errors
+        'TEST': {
+            'NAME': base_dir / 'test_db.sqlite3',
+        },
+    }
+
+
+def apply_sqlite_pragmas(cursor, pragmas=SQLITE_PRAGMAS):
+    for name, value in pragmas:
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created, dispatch_uid='workforce_sqlite_pragmas')
+def configure_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        apply_sqlite_pragmas(cursor)
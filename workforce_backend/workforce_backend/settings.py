@@ -12,7 +12,9 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 from dotenv import load_dotenv
+from .database import database_config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -48,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'workforce_backend.timing.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -61,6 +64,96 @@ MIDDLEWARE = [
 ROOT_URLCONF = 'workforce_backend.urls'
 
 ANTHROPIC_API_KEY = os.environ.get('ANTHROPIC_API_KEY')
+ANTHROPIC_API_BASE = os.environ.get('ANTHROPIC_API_BASE', 'https://api.anthropic.com')
+ANTHROPIC_CONNECT_TIMEOUT = float(os.environ.get('ANTHROPIC_CONNECT_TIMEOUT', 5))
+ANTHROPIC_READ_TIMEOUT = float(os.environ.get('ANTHROPIC_READ_TIMEOUT', 120))
+ANTHROPIC_MAX_RETRIES = int(os.environ.get('ANTHROPIC_MAX_RETRIES', 3))
+ANTHROPIC_RETRY_BACKOFF = float(os.environ.get('ANTHROPIC_RETRY_BACKOFF', 1))
+ANTHROPIC_RETRY_MAX_BACKOFF = float(os.environ.get('ANTHROPIC_RETRY_MAX_BACKOFF', 30))
+ANTHROPIC_POOL_MAXSIZE = int(os.environ.get('ANTHROPIC_POOL_MAXSIZE', 10))
+# Upper bound on concurrent upstream connections from the async views; each
+# in-flight generation holds one for its whole duration
+ANTHROPIC_ASYNC_MAX_CONNECTIONS = int(os.environ.get('ANTHROPIC_ASYNC_MAX_CONNECTIONS', 500))
+
+# Node-wide upstream budget shared by all processes through a local SQLite file.
+# The per-minute limits are starting values; the anthropic-ratelimit-* response
+# headers replace them. Callers wait up to MAX_WAIT seconds for capacity.
+ANTHROPIC_RATE_LIMIT_ENABLED = os.environ.get('ANTHROPIC_RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ANTHROPIC_RATE_LIMIT_STORE = os.environ.get(
+    'ANTHROPIC_RATE_LIMIT_STORE', os.path.join(tempfile.gettempdir(), 'workforce-anthropic-ratelimit.sqlite3')
+)
+ANTHROPIC_RATE_LIMIT_RPM = float(os.environ.get('ANTHROPIC_RATE_LIMIT_RPM', 50))
+ANTHROPIC_RATE_LIMIT_INPUT_TPM = float(os.environ.get('ANTHROPIC_RATE_LIMIT_INPUT_TPM', 20000))
+ANTHROPIC_RATE_LIMIT_OUTPUT_TPM = float(os.environ.get('ANTHROPIC_RATE_LIMIT_OUTPUT_TPM', 4000))
+ANTHROPIC_RATE_LIMIT_MAX_WAIT = float(os.environ.get('ANTHROPIC_RATE_LIMIT_MAX_WAIT', 30))
+
+# Record/replay of upstream calls for offline load tests: with ANTHROPIC_CASSETTE
+# set to a file, calls are recorded to it (MODE=record, real API) or answered
+# from it (MODE=replay, no network or API key needed). Replay waits
+# LATENCY_SCALE times the recorded latency; 0 answers instantly.
+ANTHROPIC_CASSETTE = os.environ.get('ANTHROPIC_CASSETTE', '')
+ANTHROPIC_CASSETTE_MODE = os.environ.get('ANTHROPIC_CASSETTE_MODE', 'replay')
+ANTHROPIC_CASSETTE_LATENCY_SCALE = float(os.environ.get('ANTHROPIC_CASSETTE_LATENCY_SCALE', 1))
+
+# Every upstream call is recorded to the LLMCall table through a write-behind
+# buffer flushed every FLUSH_INTERVAL seconds, which also adds it to the
+# running totals /metrics reports. The prune_llm_calls command deletes call
+# records older than RETENTION_DAYS; the totals are kept.
+# /metrics answers only "Authorization: Bearer <METRICS_TOKEN>" and is
+# disabled (403) while METRICS_TOKEN is unset.
+LLM_METRICS_ENABLED = os.environ.get('LLM_METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+LLM_METRICS_FLUSH_INTERVAL = float(os.environ.get('LLM_METRICS_FLUSH_INTERVAL', 5))
+LLM_METRICS_BATCH_SIZE = int(os.environ.get('LLM_METRICS_BATCH_SIZE', 500))
+LLM_METRICS_MAX_PENDING = int(os.environ.get('LLM_METRICS_MAX_PENDING', 10000))
+LLM_METRICS_RETENTION_DAYS = int(os.environ.get('LLM_METRICS_RETENTION_DAYS', 30))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Fraction of requests (0-1) that get a Server-Timing header and a JSON line on
+# the "request_timing" logger with view, database, serializer and LLM time.
+# 0 disables the middleware entirely.
+REQUEST_TIMING_SAMPLE_RATE = float(os.environ.get('REQUEST_TIMING_SAMPLE_RATE', 0))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'request_timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'assessment': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
+# Generated assessments/questions are cached by content hash of the request
+GENERATION_CACHE_TTL = int(os.environ.get('GENERATION_CACHE_TTL', 7 * 24 * 3600))
+GENERATION_CACHE_MAX_ENTRIES = int(os.environ.get('GENERATION_CACHE_MAX_ENTRIES', 256))
+
+# Identical generations requested while one is running wait for it instead of
+# calling the API again. LEASE bounds how long a leader may run before another
+# caller takes over; RESULT_TTL is how long a finished result is shared.
+GENERATION_SINGLE_FLIGHT_LEASE = int(os.environ.get('GENERATION_SINGLE_FLIGHT_LEASE', 300))
+GENERATION_SINGLE_FLIGHT_RESULT_TTL = int(os.environ.get('GENERATION_SINGLE_FLIGHT_RESULT_TTL', 10))
+GENERATION_SINGLE_FLIGHT_POLL_INTERVAL = float(os.environ.get('GENERATION_SINGLE_FLIGHT_POLL_INTERVAL', 0.5))
+
+# Single-question requests reuse a banked question whose role, area and skills
+# overlap the request's by at least this estimated Jaccard similarity, with the
+# same difficulty and question type, instead of calling the API
+QUESTION_BANK_THRESHOLD = float(os.environ.get('QUESTION_BANK_THRESHOLD', 0.6))
+QUESTION_BANK_MAX_CANDIDATES = int(os.environ.get('QUESTION_BANK_MAX_CANDIDATES', 5))
+
+# Conversation history sent upstream is capped at this many (estimated) tokens;
+# older turns are folded into a rolling summary written by the summary model
+CONVERSATION_CONTEXT_TOKENS = int(os.environ.get('CONVERSATION_CONTEXT_TOKENS', 12000))
+CONVERSATION_CONTEXT_RETAIN = float(os.environ.get('CONVERSATION_CONTEXT_RETAIN', 0.6))
+CONVERSATION_SUMMARY_MODEL = os.environ.get('CONVERSATION_SUMMARY_MODEL', 'claude-3-haiku-20240307')
+CONVERSATION_SUMMARY_MAX_TOKENS = int(os.environ.get('CONVERSATION_SUMMARY_MAX_TOKENS', 1024))
+
+# Bulk generation: default and maximum generations in flight per batch, and how
+# often workers poll batches submitted through the Message Batches API
+GENERATION_BATCH_CONCURRENCY = int(os.environ.get('GENERATION_BATCH_CONCURRENCY', 8))
+GENERATION_BATCH_MAX_CONCURRENCY = int(os.environ.get('GENERATION_BATCH_MAX_CONCURRENCY', 32))
+MESSAGE_BATCH_POLL_INTERVAL = int(os.environ.get('MESSAGE_BATCH_POLL_INTERVAL', 30))
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -71,6 +164,10 @@ REST_FRAMEWORK = {
     ),
 }
 
+# Resolved users are cached per process for this many seconds
+AUTH_USER_CACHE_TTL = int(os.environ.get('AUTH_USER_CACHE_TTL', 60))
+AUTH_USER_CACHE_MAX_ENTRIES = int(os.environ.get('AUTH_USER_CACHE_MAX_ENTRIES', 10000))
+
 PUBLIC_PATHS = [
     '/auth/login/',
     '/auth/register/',
@@ -113,11 +210,10 @@ CORS_ALLOW_HEADERS = [
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Configured from DB_ENGINE / DB_* environment variables, see workforce_backend/database.py
+
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_config(BASE_DIR),
 }
 
 
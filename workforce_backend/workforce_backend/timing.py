@@ -0,0 +1,166 @@
+"""
+Opt-in per-request performance instrumentation.
+
+ServerTimingMiddleware samples REQUEST_TIMING_SAMPLE_RATE of requests (none
+by default; the middleware removes itself at 0) and reports, for each sampled
+request, wall time, database query count and time, serializer time and
+upstream LLM time as a Server-Timing header plus one JSON log line on the
+"request_timing" logger. Unsampled requests only pay for a random() call.
+
+Timings are collected in a context variable, so they follow the request into
+sync_to_async threads and asyncio tasks. Database queries are timed by an
+execute wrapper installed on every connection; serializers opt in with
+TimedSerializerMixin; upstream calls report through add_timing(). For
+streaming responses only the work done before the first byte is covered.
+"""
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger('request_timing')
+
+_current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """Accumulated seconds and event counts per timing name for one request"""
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.active = set()
+
+    def add(self, name, seconds, count=1):
+        self.seconds[name] += seconds
+        self.counts[name] += count
+
+
+def add_timing(name, seconds, count=1):
+    """Add to the current request's timings; a no-op outside sampled requests"""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds, count)
+
+
+@contextmanager
+def timed(name):
+    """
+    Time a block under name. Nested blocks of the same name (a serializer
+    inside a serializer) are counted once, by the outermost.
+    """
+    timings = _current.get()
+    if timings is None or name in timings.active:
+        yield
+        return
+    timings.active.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.active.discard(name)
+        timings.add(name, time.perf_counter() - start)
+
+
+class TimedSerializerMixin:
+    """Reports a serializer's to_representation time as "serialize" """
+
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+
+def _record_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add('db', time.perf_counter() - start)
+
+
+def _instrument(connection):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _instrument_new_connection(sender, connection, **kwargs):
+    _instrument(connection)
+
+
+class ServerTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.sample_rate = settings.REQUEST_TIMING_SAMPLE_RATE
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        connection_created.connect(_instrument_new_connection, dispatch_uid='request_timing')
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        for connection in connections.all(initialized_only=True):
+            _instrument(connection)
+        timings, start = RequestTimings(), time.perf_counter()
+        token = _current.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._report(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if random.random() >= self.sample_rate:
+            return await self.get_response(request)
+
+        timings, start = RequestTimings(), time.perf_counter()
+        token = _current.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._report(request, response, timings, time.perf_counter() - start)
+
+    def _report(self, request, response, timings, total):
+        metrics = [f'total;dur={total * 1000:.1f}']
+        for name, desc in (('db', '{} queries'), ('serialize', '{} objects'), ('llm', '{} calls')):
+            if name in timings.seconds:
+                metrics.append(
+                    f'{name};dur={timings.seconds[name] * 1000:.1f};desc="{desc.format(timings.counts[name])}"'
+                )
+        response['Server-Timing'] = ', '.join(metrics)
+
+        match = request.resolver_match
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'db_queries': timings.counts.get('db', 0),
+            'db_ms': round(timings.seconds.get('db', 0) * 1000, 1),
+            'serialize_ms': round(timings.seconds.get('serialize', 0) * 1000, 1),
+            'llm_calls': timings.counts.get('llm', 0),
+            'llm_ms': round(timings.seconds.get('llm', 0) * 1000, 1),
+            'response_bytes': None if response.streaming else len(response.content),
+        }))
+        return response
@@ -16,9 +16,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from assessment.views import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('auth/', include('users.urls')),
     path('assessment/', include('assessment.urls')),
+    path('metrics', metrics, name='metrics'),
 ]